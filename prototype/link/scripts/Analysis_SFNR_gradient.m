@@ -17,6 +17,9 @@
 %   close all
 % end
 %
+% sfnr_profile_utils.py computes the same profiles in python and
+% scripts/sfnr_profiles.py does it for every participant in parallel
+%
 % C Ellis 12/7/16
 function Analysis_SFNR_gradient(gradient_method)
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+## Work with the confound files that are used to exclude TRs
+# The confound files (e.g. analysis/firstlevel/Confounds/MotionConfounds_functional01.txt) are space delimited text
+# with a row per TR and a column per confound. Columns with a single 1 exclude that TR. These functions do what
+# motion_recovery.m and z_score_exclude.m do, but operate on whole arrays so that different numbers of recovery TRs can
+# be compared across all of the runs quickly.
+#
+# To add recovery TRs to a confound file (the same inputs as motion_recovery.m):
+# python $PROJ_DIR/prototype/link/scripts/confound_utils.py $input_confound_mat $output_confound_mat $recovery_TRs
+
+import sys
+import numpy as np
+
+# Load a confound file as a TR x confound matrix. An empty file has no confounds (and TR_num rows if supplied)
+def load_confounds(confound_file, TR_num=None):
+
+    with open(confound_file) as fid:
+        text = fid.read()
+
+    if len(text.split()) == 0:
+        return np.zeros((0 if TR_num is None else TR_num, 0))
+
+    return np.loadtxt(confound_file, ndmin=2)
+
+
+# Save a confound matrix in the same format as dlmwrite (space delimited, integers without decimals)
+def save_confounds(confound_mat, confound_file):
+    np.savetxt(confound_file, np.atleast_2d(confound_mat), fmt='%.8g', delimiter=' ')
+
+
+# Which columns exclude a single TR
+def exclusion_columns(confound_mat):
+    return np.asarray(confound_mat).sum(0) == 1
+
+
+# Which TRs are excluded by the columns that exclude a single TR, returned as a boolean vector
+def excluded_TRs(confound_mat):
+
+    confound_mat = np.asarray(confound_mat)
+    return confound_mat[:, exclusion_columns(confound_mat)].sum(1) > 0
+
+
+# Make a column that excludes each of these TRs
+def exclusion_matrix(TR_idxs, TR_num):
+
+    exclusion_mat = np.zeros((TR_num, len(TR_idxs)))
+    exclusion_mat[TR_idxs, np.arange(len(TR_idxs))] = 1
+
+    return exclusion_mat
+
+
+# Which TRs need to be excluded for recovery from motion: the recovery_TRs TRs after every excluded TR that aren't
+# already excluded (and aren't past the end of the run). Returns the TR indexes in order
+def recovery_idxs(excluded, recovery_TRs):
+
+    excluded = np.asarray(excluded, dtype=bool)
+    TR_num = len(excluded)
+
+    # Every TR that follows an excluded TR within the recovery window
+    following = (np.flatnonzero(excluded)[:, np.newaxis] + np.arange(1, recovery_TRs + 1)).ravel()
+    following = np.unique(following[following < TR_num])
+
+    return following[~excluded[following]]
+
+
+# Add a column to the confound matrix for every TR that is excluded for recovery
+def add_recovery(confound_mat, recovery_TRs):
+
+    confound_mat = np.asarray(confound_mat)
+    idxs = recovery_idxs(excluded_TRs(confound_mat), recovery_TRs)
+
+    return np.hstack((confound_mat, exclusion_matrix(idxs, confound_mat.shape[0]))), idxs
+
+
+# Add in time after motion to account for recovery of T1 magnetization (see motion_recovery.m). Unlike
+# motion_recovery.m, a TR that is within the recovery window of two excluded TRs is only added once
+def motion_recovery(input_confound_mat, output_confound_mat, recovery_TRs):
+
+    recovery_TRs = int(recovery_TRs)
+
+    input_mat = load_confounds(input_confound_mat)
+    output_mat, idxs = add_recovery(input_mat, recovery_TRs)
+
+    # Give a summary
+    summary = exclusion_summary(excluded_TRs(output_mat))
+    print('An additional %d TRs were excluded, bringing the total to %d (%0.2f percent)\n' % (len(idxs), summary['excluded_num'], summary['excluded_proportion'] * 100))
+
+    save_confounds(output_mat, output_confound_mat)
+
+    return output_mat
+
+
+# Count the excluded TRs and the longest stretch of consecutive included TRs
+def exclusion_summary(excluded):
+
+    excluded = np.asarray(excluded, dtype=bool)
+    TR_num = len(excluded)
+
+    # The boundaries of each stretch of included TRs
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], excluded.astype(int), [1]))))
+    included_runs = edges[1::2] - edges[::2]
+
+    return {'TR_num': TR_num,
+            'excluded_num': int(excluded.sum()),
+            'excluded_proportion': excluded.mean() if TR_num > 0 else 0,
+            'longest_included': int(included_runs.max()) if len(included_runs) > 0 else 0,
+            }
+
+
+# How many TRs would be excluded in each run for each number of recovery TRs. Returns a runs x recovery_range array
+def recovery_sweep(confound_files, recovery_range=range(0, 6)):
+
+    recovery_range = np.asarray(recovery_range)
+    excluded_num = np.zeros((len(confound_files), len(recovery_range)), dtype=int)
+
+    for file_counter, confound_file in enumerate(confound_files):
+        excluded = excluded_TRs(load_confounds(confound_file))
+
+        # The distance of each TR from the last excluded TR (at or before it)
+        last_excluded = np.maximum.accumulate(np.where(excluded, np.arange(len(excluded)), -len(excluded) - recovery_range.max() - 1))
+        distance = np.arange(len(excluded)) - last_excluded
+
+        excluded_num[file_counter] = (distance[:, np.newaxis] <= recovery_range).sum(0)
+
+    return excluded_num
+
+
+# Z score the data over time while ignoring the excluded TRs (see z_score_exclude.m). Time is the last dimension. The
+# mean and standard deviation are calculated from the included TRs, the excluded TRs are set to zero and voxels with
+# no variance are zero. The output is float32 if the data is, otherwise float64
+def z_score_exclude(data, excluded):
+
+    data = np.asarray(data)
+    data = data.astype(np.result_type(data.dtype, np.float32), copy=False)
+    included = ~np.asarray(excluded, dtype=bool)
+
+    data_mean = data[..., included].mean(-1, keepdims=True)
+    data_std = data[..., included].std(-1, ddof=1, keepdims=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscored = (data - data_mean) / data_std
+
+    zscored[..., ~included] = 0
+    zscored[~np.isfinite(zscored)] = 0
+
+    return zscored
+
+
+if __name__ == '__main__':
+    motion_recovery(*sys.argv[1:])
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+## Interpolate (and z score) the excluded TRs of 4D runs
+# This is a python version of interpolate_TRs.m and z_score_exclude.m. Rather than loading the whole run as doubles
+# and looping over the excluded TRs, the interpolation is expressed as a TR x TR matrix that maps the original TRs on
+# to the interpolated ones, and it is applied to a block of slices at a time in float32. The output is written in to
+# a memory mapped file block by block, so memory doesn't grow with the size of the run. The array functions can also
+# be used directly on time courses (e.g. to preview the interpolation in participant_summary_utils.py).
+#
+# The interpolation types are:
+#   mean_included: the average of the nearest included TR before and after the excluded TR (the default)
+#   linear: linear interpolation between the nearest included TRs before and after the excluded TR
+#   mean: the average of the TRs either side of the excluded TR, whether or not they are excluded
+#
+# Example commands (the same inputs as interpolate_TRs.m and z_score_exclude.m):
+# python $PROJ_DIR/prototype/link/scripts/interpolation_utils.py prefiltered_func_data.nii.gz prefiltered_func_data.nii.gz $Confound_File mean_included
+# python $PROJ_DIR/prototype/link/scripts/interpolation_utils.py --zscore $Input_file $Output_file $Confound_File
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import numpy as np
+import nibabel
+from nifti_utils import uncompressed_sidecar
+from confound_utils import load_confounds, exclusion_columns, z_score_exclude
+
+INTERPOLATION_TYPES = ['mean_included', 'linear', 'mean']
+
+# The most voxels (times TRs) to hold in memory at once
+CHUNK_VALUES = 32 * 1024 * 1024
+
+# Work out which TRs are excluded, returning a boolean vector (or None if the confounds can't be used). Confounds can be
+# a confound file (where, like interpolate_TRs.m, only columns with a single 1 are used and the file must have a row
+# for every TR), a boolean vector or a list of TR indexes
+def excluded_from_confounds(confounds, TR_num):
+
+    if isinstance(confounds, str):
+        if not os.path.isfile(confounds):
+            print('%s not found, not interpolating any TRs' % confounds)
+            return None
+
+        confound_mat = load_confounds(confounds, TR_num)
+        confound_mat = confound_mat[:, exclusion_columns(confound_mat)]
+
+        if confound_mat.shape[0] != TR_num:
+            print("%s doesn't match length, not interpolating any TRs" % confounds)
+            return None
+
+        return confound_mat.sum(1) == 1
+
+    confounds = np.asarray(confounds)
+    if confounds.dtype == bool:
+        return confounds
+
+    excluded = np.zeros(TR_num, dtype=bool)
+    excluded[confounds.astype(int)] = True
+
+    return excluded
+
+
+# Make the TR x TR matrix that maps the original TRs to the interpolated TRs (rows are the output TRs). Included TRs
+# are copied and each excluded TR is a weighted sum of other TRs
+def interpolation_matrix(excluded, interpolation_type='mean_included'):
+
+    if interpolation_type not in INTERPOLATION_TYPES:
+        raise ValueError('Interpolation type %s is not supported, use one of %s' % (interpolation_type, INTERPOLATION_TYPES))
+
+    excluded = np.asarray(excluded, dtype=bool)
+    TR_num = len(excluded)
+    TR_idxs = np.arange(TR_num)
+    weights = np.eye(TR_num, dtype=np.float32)
+
+    if interpolation_type == 'mean':
+
+        # Each TR is replaced in order, so a replaced TR is used for the next TR if it is also excluded (as in
+        # interpolate_TRs.m). Only the TRs either side are used (the last TR is never used, as in interpolate_TRs.m)
+        for TR in TR_idxs[excluded]:
+            border_TRs = [border_TR for border_TR in [TR - 1, TR + 1] if 0 <= border_TR < TR_num - 1]
+            if len(border_TRs) > 0:
+                weights[TR] = weights[border_TRs].mean(0)
+
+        return weights
+
+    if excluded.all():
+        print('All TRs are excluded, not interpolating any TRs')
+        return weights
+
+    # The nearest included TR before and after each TR (-1 or TR_num if there isn't one)
+    included_idxs = np.where(excluded, -1, TR_idxs)
+    before = np.maximum.accumulate(included_idxs)
+    after = np.minimum.accumulate(np.where(excluded, TR_num, TR_idxs)[::-1])[::-1]
+
+    for TR in TR_idxs[excluded]:
+        weights[TR, TR] = 0
+
+        # At the start or end of the run just use the one included TR
+        if before[TR] < 0:
+            weights[TR, after[TR]] = 1
+        elif after[TR] == TR_num:
+            weights[TR, before[TR]] = 1
+        elif interpolation_type == 'linear':
+            distance = (TR - before[TR]) / (after[TR] - before[TR])
+            weights[TR, before[TR]] = 1 - distance
+            weights[TR, after[TR]] = distance
+        else:
+            weights[TR, [before[TR], after[TR]]] = 0.5
+
+    return weights
+
+
+# Interpolate the excluded TRs of the data (time is the last dimension), returning float32
+def interpolate_TRs(data, excluded, interpolation_type='mean_included', weights=None):
+
+    data = np.asarray(data, dtype=np.float32)
+    excluded = np.asarray(excluded, dtype=bool)
+
+    if weights is None:
+        weights = interpolation_matrix(excluded, interpolation_type)
+
+    # Only the excluded TRs change
+    interpolated = data.copy()
+    interpolated[..., excluded] = data @ weights[excluded].T
+
+    return interpolated
+
+
+# Z score the data ignoring the excluded TRs and then interpolate the excluded TRs (as z_score_exclude.m does)
+def z_score_interpolate(data, excluded, interpolation_type='mean_included', weights=None):
+
+    zscored = z_score_exclude(np.asarray(data, dtype=np.float32), excluded)
+    return interpolate_TRs(zscored, excluded, interpolation_type, weights)
+
+
+# Apply this function to the time courses of a run a block of slices at a time, writing the float32 output
+# incrementally. If the input is compressed it is decompressed once (in to sidecar_dir if supplied, otherwise in to a
+# temporary directory) so that each block can be memory mapped. The output can be the same file as the input
+def process_run(input_file, output_file, function, sidecar_dir=None, chunk_values=CHUNK_VALUES):
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as temp_dir:
+
+        read_file = input_file
+        if input_file.endswith('.gz'):
+            read_file = uncompressed_sidecar(os.path.abspath(input_file), temp_dir if sidecar_dir is None else sidecar_dir)
+        nii = nibabel.load(read_file, mmap=True)
+        shape = nii.shape
+
+        # Make an empty uncompressed output with the same header (but float32 and no scaling) and memory map it
+        header = nii.header.copy()
+        header.set_data_dtype(np.float32)
+        header.set_slope_inter(1, 0)
+        header['vox_offset'] = max(int(header['vox_offset']), 352)
+        temp_output = os.path.join(temp_dir, 'output.nii')
+        with open(temp_output, 'wb') as fid:
+            fid.write(header.binaryblock)
+            fid.write(b'\x00' * (int(header['vox_offset']) - len(header.binaryblock)))
+            fid.truncate(int(header['vox_offset']) + int(np.prod(shape)) * 4)
+        output = np.memmap(temp_output, dtype=header.get_data_dtype(), mode='r+', offset=int(header['vox_offset']), shape=shape, order='F')
+
+        # Process blocks of slices
+        slice_num = max(chunk_values // int(np.prod(shape[:2]) * shape[3]), 1)
+        for slice_start in range(0, shape[2], slice_num):
+            block = np.asarray(nii.dataobj[:, :, slice_start:slice_start + slice_num, :], dtype=np.float32)
+            output[:, :, slice_start:slice_start + slice_num, :] = function(block)
+        output.flush()
+        del output
+
+        # Compress if necessary and then move the output in to place
+        if output_file.endswith('.gz'):
+            with open(temp_output, 'rb') as fid_in, gzip.open(temp_output + '.gz', 'wb', compresslevel=6) as fid_out:
+                shutil.copyfileobj(fid_in, fid_out, 16 * 1024 * 1024)
+            temp_output += '.gz'
+        os.replace(temp_output, output_file)
+
+
+# Interpolate the excluded TRs of a run and save it (see interpolate_TRs.m)
+def interpolate_TRs_file(input_file, output_file, confounds, interpolation_type='mean_included', sidecar_dir=None):
+
+    TR_num = nibabel.load(input_file).shape[3]
+    excluded = excluded_from_confounds(confounds, TR_num)
+
+    print('Loading %s, using %s and %s interpolation to output %s' % (input_file, confounds, interpolation_type, output_file))
+    if excluded is None:
+        return
+
+    print('Interpolate %d TRs' % excluded.sum())
+    weights = interpolation_matrix(excluded, interpolation_type)
+    process_run(input_file, output_file, lambda block: interpolate_TRs(block, excluded, weights=weights), sidecar_dir)
+
+    print('Saving %s, used %s interpolation' % (output_file, interpolation_type))
+
+
+# Z score a run ignoring the excluded TRs, interpolate the excluded TRs and save it (see z_score_exclude.m)
+def z_score_exclude_file(input_file, output_file, confounds, interpolation_type='mean_included', sidecar_dir=None):
+
+    TR_num = nibabel.load(input_file).shape[3]
+    excluded = excluded_from_confounds(confounds, TR_num)
+    if excluded is None:
+        excluded = np.zeros(TR_num, dtype=bool)
+
+    print('Loading %s' % input_file)
+    weights = interpolation_matrix(excluded, interpolation_type)
+    process_run(input_file, output_file, lambda block: z_score_interpolate(block, excluded, weights=weights), sidecar_dir)
+
+    print('Saving %s' % output_file)
+
+
+if __name__ == '__main__':
+
+    if sys.argv[1] == '--zscore':
+        z_score_exclude_file(*sys.argv[2:])
+    else:
+        interpolate_TRs_file(*sys.argv[1:])
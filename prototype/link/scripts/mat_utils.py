@@ -0,0 +1,157 @@
+## Read a few fields out of (possibly very large) MATLAB files
+# Files like analysis/Behavioral/AnalysedData.mat store everything, including the eye tracking data, in one struct so
+# loading it to read a handful of fields is slow. Fields are requested as dotted paths (e.g.
+# 'AnalysedData.EyeData.Coder_name', where * stands for every field of a struct). v7.3 (HDF5) files are read with h5py
+# so that only the datasets for those fields are touched. For older files (v7, what MATLAB and savemat write by
+# default) only the variables the fields belong to are loaded, but a variable is always decoded in full, so the first
+# read of a field in AnalysedData still decodes the whole struct, eye tracking data included. The extracted fields are
+# cached in a small sidecar (in a mat_fields/ folder next to the MAT file) that is used until the MAT file changes, so
+# it is only later reads that are fast.
+#
+# Values are converted to plain python: structs become dictionaries, cell arrays become lists, char arrays become
+# strings and numeric arrays are squeezed numpy arrays. scipy.io and h5py are only imported when a file is read.
+
+import os
+import numpy as np
+from summary_cache import cached_summary
+
+# Increase this whenever the way values are converted changes so that old sidecars aren't used
+MAT_FIELDS_VERSION = 1
+
+# Where the cached fields of a MAT file are stored
+def mat_cache_dir(mat_file):
+    return os.path.join(os.path.dirname(mat_file), 'mat_fields')
+
+
+# Is this a v7.3 MAT file (which is HDF5)
+def is_hdf5_mat(mat_file):
+
+    with open(mat_file, 'rb') as fid:
+        return fid.read(128).startswith(b'MATLAB 7.3')
+
+
+# Convert a value loaded by scipy (with struct_as_record=False and squeeze_me=True) to plain python
+def convert_value(value):
+
+    from scipy.io.matlab import mat_struct
+
+    if isinstance(value, mat_struct):
+        return {field: convert_value(getattr(value, field)) for field in value._fieldnames}
+
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return [convert_value(item) for item in value.ravel(order='F')]
+
+    if isinstance(value, np.ndarray) and value.dtype.kind == 'U':
+        return str(value.squeeze()) if value.size == 1 else [str(item) for item in value.ravel(order='F')]
+
+    return value
+
+
+# Convert an HDF5 node of a v7.3 MAT file to plain python. MATLAB stores arrays in column major order so they are
+# transposed, and cells and struct arrays are stored as references to other nodes
+def convert_hdf5(h5_file, node):
+
+    import h5py
+
+    if isinstance(node, h5py.Group):
+        return {key: convert_hdf5(h5_file, node[key]) for key in node.keys() if not key.startswith('#')}
+
+    matlab_class = node.attrs.get('MATLAB_class', b'')
+    matlab_class = matlab_class.decode() if isinstance(matlab_class, bytes) else matlab_class
+
+    if node.attrs.get('MATLAB_empty', 0):
+        return np.array([])
+
+    data = node[()]
+
+    if data.dtype == h5py.ref_dtype:
+        return [convert_hdf5(h5_file, h5_file[ref]) for ref in data.T.ravel()]
+
+    if matlab_class == 'char':
+        return ''.join(chr(character) for character in data.T.ravel())
+
+    data = np.squeeze(data.T)
+    if matlab_class == 'logical':
+        data = data.astype(bool)
+
+    return data
+
+
+# Follow a path through loaded values, returning None if any part of the path doesn't exist. Struct arrays with a
+# single element are stepped through and * returns a dictionary with the rest of the path followed for every field
+def follow_path(value, path):
+
+    from scipy.io.matlab import mat_struct
+
+    for field_counter, field in enumerate(path):
+        if isinstance(value, np.ndarray) and value.dtype == object and value.size == 1:
+            value = value.item()
+
+        if not isinstance(value, mat_struct):
+            return None
+
+        if field == '*':
+            return {name: follow_path(getattr(value, name), path[field_counter + 1:]) for name in value._fieldnames}
+
+        if field not in value._fieldnames:
+            return None
+        value = getattr(value, field)
+
+    return convert_value(value)
+
+
+# The same as follow_path for the nodes of a v7.3 MAT file. Struct arrays are stored as datasets of references
+def follow_hdf5_path(h5_file, node, path):
+
+    import h5py
+
+    for field_counter, field in enumerate(path):
+        if isinstance(node, h5py.Dataset) and node.dtype == h5py.ref_dtype and node.size == 1:
+            node = h5_file[node[()].ravel()[0]]
+
+        if not isinstance(node, h5py.Group):
+            return None
+
+        if field == '*':
+            return {name: follow_hdf5_path(h5_file, node[name], path[field_counter + 1:]) for name in node.keys() if not name.startswith('#')}
+
+        if field not in node:
+            return None
+        node = node[field]
+
+    return convert_hdf5(h5_file, node)
+
+
+# Read the fields from the MAT file without caching. For v7 files every variable that a field belongs to is decoded
+def read_fields(mat_file, fields):
+
+    paths = [field.split('.') for field in fields]
+    variable_names = sorted(set(path[0] for path in paths))
+
+    values = {}
+    if is_hdf5_mat(mat_file):
+
+        # Only the datasets below the requested fields are read
+        import h5py
+        with h5py.File(mat_file, 'r') as h5_file:
+            for field, path in zip(fields, paths):
+                values[field] = follow_hdf5_path(h5_file, h5_file[path[0]], path[1:]) if path[0] in h5_file else None
+    else:
+        from scipy.io import loadmat
+        variables = loadmat(mat_file, variable_names=variable_names, struct_as_record=False, squeeze_me=True)
+        for field, path in zip(fields, paths):
+            values[field] = follow_path(variables[path[0]], path[1:]) if path[0] in variables else None
+
+    return values
+
+
+# Return a dictionary of the value of each field (None if it doesn't exist). Fields are dotted paths, starting with the
+# variable name (e.g. 'AnalysedData.EyeData.Reliability.*.Intraframe_all'). The values are cached next to the MAT file unless use_cache is False
+def load_fields(mat_file, fields, use_cache=True):
+
+    fields = list(fields)
+    if not use_cache:
+        return read_fields(mat_file, fields)
+
+    key = ('mat_fields', MAT_FIELDS_VERSION, os.path.abspath(mat_file), tuple(fields))
+    return cached_summary(key, lambda: {'fields': read_fields(mat_file, fields), 'sources': [mat_file]}, mat_cache_dir(mat_file))['fields']
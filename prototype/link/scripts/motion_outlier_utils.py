@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+## Detect motion outliers (timepoints) and create confounds to eliminate them from the GLM
+# This is a python version of fsl_motion_outliers_example_func.sh. Rather than calling fslmaths and fslstats for every
+# timepoint, the motion corrected run is loaded once and each metric is computed for all TRs at once:
+#
+#   refrms: the RMS intensity difference of each TR to the reference volume, differenced over time (the default)
+#   refmse: the mean square error version of refrms
+#   dvars: the RMS intensity difference between consecutive TRs
+#   fd: framewise displacement (Power et al, 2011) from the mcflirt motion parameters
+#   fdrms: framewise displacement from the mcflirt relative RMS
+#
+# The intensity metrics are normalised by the median within the brain mask. The jth value of each metric is the change
+# between TR j - 1 and j, with a zero for the first TR. TRs with a metric at or above the threshold (by default the
+# box-plot cutoff: P75 + 1.5 * IQR) are outliers and get a confound column each. The options are the same as
+# fsl_motion_outliers_example_func.sh, for example:
+#
+# python scripts/motion_outlier_utils.py -i $Functional -o $Confound_file --dummy=2 --fd --thresh=3 -p $Metric_name -s $Metric_name.txt --reffile $Confound_dir/example_func_functional01.nii.gz
+
+import os
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import nibabel
+from confound_utils import exclusion_matrix, save_confounds
+
+METRICS = ['refrms', 'refmse', 'dvars', 'fd', 'fdrms']
+
+# Make a brain mask from the run: voxels whose mean is at least 10% of the robust range (2nd to 98th percentile of the
+# non zero voxels) of the run. Like fslmaths -thr -bin, values at the threshold are kept and zeros are not
+def robust_mask(func_data):
+
+    nonzero = func_data[func_data != 0]
+    thr2, thr98 = np.percentile(nonzero, [2, 98]) if nonzero.size > 0 else (0, 0)
+    mean_data = func_data.mean(-1)
+
+    return (mean_data >= thr2 + 0.1 * (thr98 - thr2)) & (mean_data > 0)
+
+
+# How the intensity of the run is normalised: the median of the non zero voxels within the mask across all TRs
+def brain_median(func_data, mask):
+
+    brain_data = func_data[mask]
+    return np.median(brain_data[brain_data != 0])
+
+
+# The RMS (or MSE if rms is False) difference of each TR to the reference volume within the mask, differenced over time.
+# Returns TR_num - 1 values
+def refrms(func_data, mask, reference, rms=True):
+
+    brain_data = func_data[mask]
+    brain_median_value = brain_median(func_data, mask)
+
+    residual = ((brain_data - reference[mask][:, np.newaxis]) / brain_median_value) ** 2
+    residual = residual.mean(0)
+    if rms:
+        residual = np.sqrt(residual)
+
+    return np.abs(np.diff(residual))
+
+
+# The RMS difference between consecutive TRs within the mask, as per mille of the median. Returns TR_num - 1 values
+def dvars(func_data, mask):
+
+    brain_data = func_data[mask]
+    brain_median_value = brain_median(func_data, mask)
+
+    return np.sqrt((np.diff(brain_data, axis=1) ** 2).mean(0)) / brain_median_value * 1000
+
+
+# The framewise displacement (in mm) from mcflirt motion parameters (three rotations in radians then three
+# translations). Rotations are converted to displacement on a 50mm sphere. Returns TR_num - 1 values
+def framewise_displacement(motion_parameters):
+
+    motion_diff = np.abs(np.diff(np.atleast_2d(motion_parameters), axis=0))
+    return (motion_diff[:, :3] * 50).sum(1) + motion_diff[:, 3:6].sum(1)
+
+
+# The box-plot cutoff for outliers in this metric
+def outlier_threshold(metric):
+
+    p25, p75 = np.percentile(metric, [25, 75])
+    return p75 + 1.5 * (p75 - p25)
+
+
+# Which TRs are outliers given the metric (which has a value for every TR, see compute_metric). If the threshold isn't
+# supplied then the box-plot cutoff is used, leaving out the zero for the first TR
+def find_outliers(metric_values, threshold=None):
+
+    metric_values = np.asarray(metric_values, dtype=np.float64)
+
+    if threshold is None:
+        threshold = outlier_threshold(metric_values[1:])
+
+    return (metric_values >= threshold) & (metric_values > 0), threshold
+
+
+# Run mcflirt on the functional (aligning to reffile) and return the output prefix. This is the only external command
+def run_mcflirt(func_file, reffile, output_dir):
+
+    mcf_prefix = os.path.join(output_dir, 'fmri_mcf')
+    subprocess.check_call(['mcflirt', '-in', func_file, '-out', mcf_prefix, '-mats', '-plots', '-reffile', reffile, '-rmsrel', '-rmsabs'])
+
+    return mcf_prefix
+
+
+# Compute the metric for this run, returning a vector with a value for every TR. Each metric is a forward difference so
+# a change between TRs j - 1 and j is assigned to TR j and the first TR is zero. func_file should
+# already be motion corrected unless do_moco is True, in which case mcflirt is run first (and FD uses its parameters)
+def compute_metric(func_file, reffile, metric='refrms', mask_file=None, dummy=0, do_moco=True, par_file=None, rms_file=None):
+
+    if metric not in METRICS:
+        raise ValueError('Metric %s is not supported' % metric)
+
+    if not do_moco and metric in ['fd', 'fdrms'] and par_file is None and rms_file is None:
+        raise ValueError('Cannot use metrics FD or FDRMS without motion correction')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        # Delete the dummy scans (before running anything)
+        nii = nibabel.load(func_file)
+        func_data = np.asarray(nii.dataobj[..., dummy:], dtype=np.float32)
+
+        if do_moco:
+            invol = os.path.join(temp_dir, 'invol.nii.gz')
+            nibabel.save(nibabel.Nifti1Image(func_data, nii.affine, nii.header), invol)
+            mcf_prefix = run_mcflirt(invol, reffile, temp_dir)
+            par_file = mcf_prefix + '.par'
+            rms_file = mcf_prefix + '_rel.rms'
+            func_data = np.asarray(nibabel.load(mcf_prefix + '.nii.gz').dataobj, dtype=np.float32)
+
+        if metric == 'fd':
+            values = framewise_displacement(np.loadtxt(par_file, ndmin=2))
+        elif metric == 'fdrms':
+            values = np.loadtxt(rms_file, ndmin=1)[-(func_data.shape[3] - 1):]
+        else:
+            if mask_file is None:
+                mask = robust_mask(func_data)
+            else:
+                mask = np.asarray(nibabel.load(mask_file).dataobj) >= 0.5
+
+            if metric == 'dvars':
+                values = dvars(func_data, mask)
+            else:
+                reference = np.asarray(nibabel.load(reffile).dataobj, dtype=np.float32)
+                values = refrms(func_data, mask, reference.reshape(reference.shape[:3]), metric == 'refrms')
+
+    return np.concatenate(([0], values))
+
+
+# Plot the metric (with the threshold) and save it as a png
+def plot_metric(metric_values, threshold, metric, plot_file):
+
+    # Draw without pyplot so that the backend of the caller (e.g. a notebook) isn't changed
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 3))
+    ax = fig.subplots()
+    ax.plot(metric_values)
+    ax.axhline(threshold, color='r', linestyle='--')
+    ax.set_title('Motion outlier metric: %s' % metric)
+    ax.set_xlabel('time')
+    ax.set_ylabel('metric value')
+    fig.savefig(plot_file if plot_file.endswith('.png') else plot_file + '.png')
+
+
+# Compute the metric, find the outliers and save the confound file (only if there are outliers, like
+# fsl_motion_outliers), the metric values and the plot. Returns the metric values and the outlier TRs
+def motion_outliers(func_file, output_file, reffile, metric='refrms', threshold=None, mask_file=None, dummy=0,
+                    do_moco=True, save_file=None, plot_file=None, par_file=None, rms_file=None):
+
+    metric_values = compute_metric(func_file, reffile, metric, mask_file, dummy, do_moco, par_file, rms_file)
+
+    outliers, threshold = find_outliers(metric_values, threshold)
+
+    print('Found %d outliers over %0.2f' % (outliers.sum(), threshold))
+
+    if save_file is not None:
+        np.savetxt(save_file, metric_values, fmt='%g')
+
+    if plot_file is not None:
+        plot_metric(metric_values, threshold, metric, plot_file)
+
+    if os.path.isfile(output_file):
+        os.remove(output_file)
+    if outliers.any():
+        save_confounds(exclusion_matrix(np.flatnonzero(outliers), len(outliers)), output_file)
+
+    return metric_values, outliers
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Detect motion outliers and create confounds to eliminate them')
+    parser.add_argument('-i', dest='func_file', required=True, help='Input 4D image')
+    parser.add_argument('-o', dest='output_file', required=True, help='Output confound file')
+    parser.add_argument('--reffile', required=True, help='The file to be used as the reference TR')
+    parser.add_argument('-m', dest='mask_file', default=None, help='Use supplied mask image for calculating metric')
+    parser.add_argument('-s', dest='save_file', default=None, help='Save metric values as text into specified file')
+    parser.add_argument('-p', dest='plot_file', default=None, help='Save metric values as a graphical plot (png format)')
+    parser.add_argument('--thresh', type=float, default=None, help='Absolute threshold (otherwise P75 + 1.5*IQR)')
+    parser.add_argument('--dummy', type=int, default=0, help='Number of dummy scans to delete')
+    parser.add_argument('--nomoco', action='store_true', help='Do not run motion correction (assumed already done)')
+    parser.add_argument('--par', dest='par_file', default=None, help='mcflirt parameters to use for --fd with --nomoco')
+    parser.add_argument('--rms', dest='rms_file', default=None, help='mcflirt relative RMS to use for --fdrms with --nomoco')
+    for metric in METRICS:
+        parser.add_argument('--' + metric, dest='metric', action='store_const', const=metric)
+    parser.set_defaults(metric='refrms')
+    args = parser.parse_args()
+
+    motion_outliers(args.func_file, args.output_file, args.reffile, args.metric, args.thresh, args.mask_file,
+                    args.dummy, not args.nomoco, args.save_file, args.plot_file, args.par_file, args.rms_file)
@@ -0,0 +1,121 @@
+## Functions for reading parts of NIfTI files without loading the whole volume
+# The summaries only need a handful of voxels from each 4D run, so rather than calling get_data() on the full volume
+# these functions read through the nibabel array proxy (dataobj). Uncompressed files are memory mapped and only the
+# requested voxels are touched. Compressed files are either streamed in chunks of TRs (so memory is bounded) or
+# decompressed once into an uncompressed sidecar that can be memory mapped on later calls.
+
+import os
+import gzip
+import shutil
+import numpy as np
+import nibabel
+from profiling_utils import profiled
+
+# How many TRs to decompress at a time when streaming from a .nii.gz
+CHUNK_TRS = 64
+
+# Turn the voxel list or mask into an n x 3 array of voxel coordinates
+def voxel_coordinates(volume_shape, voxels=None, mask=None):
+
+    volume_shape = tuple(volume_shape[:3])
+
+    if mask is not None:
+
+        # Load the mask if it is a file name
+        if isinstance(mask, str):
+            mask = np.asanyarray(nibabel.load(mask).dataobj)
+
+        mask = np.asarray(mask)
+
+        # Masks are sometimes saved with a singleton 4th dimension
+        if mask.ndim == 4 and mask.shape[3] == 1:
+            mask = mask[:, :, :, 0]
+
+        if mask.shape != volume_shape:
+            raise ValueError('Mask has shape %s but the volume has shape %s' % (mask.shape, volume_shape))
+
+        coords = np.argwhere(mask != 0)
+
+    elif voxels is not None:
+        coords = np.atleast_2d(np.asarray(voxels, dtype=int))
+
+        if coords.ndim != 2 or coords.shape[1] != 3:
+            raise ValueError('Voxels must be supplied as (x, y, z) coordinates')
+
+        if np.any(coords < 0) or np.any(coords >= np.asarray(volume_shape)):
+            raise IndexError('Voxel coordinates fall outside of a volume with shape %s' % (volume_shape,))
+
+    else:
+        raise ValueError('Either voxels or a mask must be supplied')
+
+    return coords
+
+
+# Make (or reuse) an uncompressed copy of a .nii.gz file so that it can be memory mapped.
+# The sidecar is stored in sidecar_dir, mirroring the path of the original, and is remade if the original is newer
+@profiled
+def uncompressed_sidecar(nifti_file, sidecar_dir):
+
+    sidecar_file = os.path.join(sidecar_dir, os.path.splitdrive(nifti_file)[1].lstrip(os.sep)[:-3])
+
+    if os.path.isfile(sidecar_file) and os.path.getmtime(sidecar_file) >= os.path.getmtime(nifti_file):
+        return sidecar_file
+
+    os.makedirs(os.path.dirname(sidecar_file), exist_ok=True)
+
+    # Decompress into a temporary file in blocks, then move it into place so that a partial file is never used
+    temp_file = '%s.%d.tmp' % (sidecar_file, os.getpid())
+    with gzip.open(nifti_file, 'rb') as fid_in, open(temp_file, 'wb') as fid_out:
+        shutil.copyfileobj(fid_in, fid_out, 16 * 1024 * 1024)
+    os.replace(temp_file, sidecar_file)
+
+    return sidecar_file
+
+
+# Pull out the time course of each voxel requested, returning an array that is voxels x TRs.
+# Voxels can be specified as a list of (x, y, z) coordinates or with a mask (a file name or a boolean volume).
+# If sidecar_dir is supplied then compressed files are decompressed there once and memory mapped from then on,
+# otherwise they are streamed CHUNK_TRS volumes at a time
+@profiled
+def extract_timecourses(nifti_file, voxels=None, mask=None, sidecar_dir=None):
+
+    is_compressed = nifti_file.endswith('.gz')
+
+    if is_compressed and sidecar_dir is not None:
+        nifti_file = uncompressed_sidecar(nifti_file, sidecar_dir)
+        is_compressed = False
+
+    if is_compressed:
+        # Keep a single handle open so each chunk continues decompressing from where the last one stopped
+        nii = nibabel.load(nifti_file, keep_file_open=True)
+    else:
+        nii = nibabel.load(nifti_file, mmap=True)
+
+    if len(nii.shape) != 4:
+        raise ValueError('%s is not a 4D volume' % nifti_file)
+
+    coords = voxel_coordinates(nii.shape, voxels, mask)
+    xs, ys, zs = coords.T
+
+    if not is_compressed:
+
+        # Index the memory map directly so only the pages containing these voxels are read
+        data = nii.dataobj.get_unscaled()
+        timecourses = np.asarray(data[xs, ys, zs, :], dtype=np.float64)
+
+        return timecourses * nii.dataobj.slope + nii.dataobj.inter
+
+    # Only decompress the bounding box around the voxels, a chunk of TRs at a time
+    lower = coords.min(0)
+    upper = coords.max(0) + 1
+    bounding_box = tuple(slice(low, high) for low, high in zip(lower, upper))
+    xs, ys, zs = (coords - lower).T
+
+    TR_num = nii.shape[3]
+    timecourses = np.zeros((coords.shape[0], TR_num))
+    for TR_start in range(0, TR_num, CHUNK_TRS):
+        TR_end = min(TR_start + CHUNK_TRS, TR_num)
+        chunk = nii.dataobj[bounding_box + (slice(TR_start, TR_end),)]
+        timecourses[:, TR_start:TR_end] = chunk[xs, ys, zs, :]
+
+    return timecourses
@@ -0,0 +1,112 @@
+## Make overlays of one volume on another for checking registration
+# Only the planes that are going to be shown are read from each volume (using the nibabel array proxy), they are
+# normalised after extraction rather than normalising the whole volume, and all of the planes are blended and tiled
+# into a single uint8 RGBA image in one pass. The top volume is shown in red at half opacity over the bottom volume
+# in gray, the same as overlay_slices in participant_summary_utils.py
+
+import numpy as np
+import nibabel
+
+# Pick slice_num evenly spaced slices through a dimension of this length. A single slice is the middle slice
+def slice_indices(length, slice_num):
+
+    step = max(length // (slice_num + 1), 1)
+    return np.arange(1, slice_num + 1) * step
+
+
+# Read the planes at these indices along this axis of a 3D volume, returned as a float32 array that is
+# planes x rows x columns. Only a single strided slab is read from the file
+def extract_planes(nifti_file, axis, indices):
+
+    nii = nibabel.load(nifti_file)
+    indices = np.asarray(indices)
+
+    # Read from the first to the last plane, skipping the planes in between
+    step = int(indices[1] - indices[0]) if len(indices) > 1 else 1
+    if len(indices) > 1 and np.any(np.diff(indices) != step):
+        raise ValueError('Plane indices must be evenly spaced')
+
+    slicer = [slice(None)] * 3
+    slicer[axis] = slice(int(indices[0]), int(indices[-1]) + 1, step)
+    if len(nii.shape) > 3:
+        slicer.append(0)
+
+    planes = np.asarray(nii.dataobj[tuple(slicer)], dtype=np.float32)
+
+    return np.moveaxis(planes, axis, 0)
+
+
+# Scale the planes so that vmin is 0 and vmax is 1 (by default the min and max of the planes)
+def normalise_planes(planes, vmin=None, vmax=None):
+
+    planes = np.asarray(planes, dtype=np.float32)
+    vmin = planes.min() if vmin is None else vmin
+    vmax = planes.max() if vmax is None else vmax
+
+    return (planes - vmin) / (vmax - vmin if vmax > vmin else 1)
+
+
+# Blend the top planes in red over the bottom planes in gray, returning a uint8 RGBA array with the same leading
+# dimensions as the planes. Both should already be scaled between 0 and 1
+def blend_planes(bottom_planes, top_planes, alpha=0.5):
+
+    bottom = np.clip(bottom_planes, 0, 1)
+    top = np.clip(top_planes, 0, 1)
+
+    rgba = np.empty(bottom.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.round(((1 - alpha) * bottom + alpha * top) * 255)
+    rgba[..., 1] = np.round((1 - alpha) * bottom * 255)
+    rgba[..., 2] = rgba[..., 1]
+    rgba[..., 3] = 255
+
+    return rgba
+
+
+# Tile a list of images (rows x columns x ...) into a grid with col_num columns. Images of different sizes are padded
+# (with zeros) to be centred in tiles of the same size
+def tile_images(images, col_num):
+
+    tile_shape = np.max([image.shape[:2] for image in images], 0)
+
+    tiles = np.zeros((len(images), tile_shape[0], tile_shape[1]) + images[0].shape[2:], dtype=images[0].dtype)
+    for image_counter, image in enumerate(images):
+        top = (tile_shape[0] - image.shape[0]) // 2
+        left = (tile_shape[1] - image.shape[1]) // 2
+        tiles[image_counter, top:top + image.shape[0], left:left + image.shape[1]] = image
+
+    # Pad to fill the last row and then rearrange into a grid
+    row_num = int(np.ceil(len(images) / col_num))
+    padding = np.zeros((row_num * col_num - len(images),) + tiles.shape[1:], dtype=tiles.dtype)
+    tiles = np.concatenate((tiles, padding), 0)
+    tiles = tiles.reshape((row_num, col_num) + tiles.shape[1:])
+    tiles = np.swapaxes(tiles, 1, 2)
+
+    return tiles.reshape((row_num * tile_shape[0], col_num * tile_shape[1]) + tiles.shape[4:])
+
+
+# Overlay top_file on bottom_file (which must be in the same space) for slice_num slices along each of the axes.
+# Each axis is a row of the output (or with one slice per axis the axes are shown side by side). The planes are
+# rotated so that they are displayed the same way as overlay_slices
+def lightbox(bottom_file, top_file, slice_num=1, axes=(0, 1, 2)):
+
+    shape = nibabel.load(bottom_file).shape
+
+    bottom_planes = []
+    top_planes = []
+    for axis in axes:
+        indices = slice_indices(shape[axis], slice_num)
+        bottom_planes.append(extract_planes(bottom_file, axis, indices))
+        top_planes.append(extract_planes(top_file, axis, indices))
+
+    # Scale using all of the planes that are shown: the bottom from its min to max (like imshow with a gray colormap)
+    # and the top by its max
+    bottom_min = min(planes.min() for planes in bottom_planes)
+    bottom_max = max(planes.max() for planes in bottom_planes)
+    top_max = max(planes.max() for planes in top_planes)
+
+    images = []
+    for bottom, top in zip(bottom_planes, top_planes):
+        rgba = blend_planes(normalise_planes(bottom, bottom_min, bottom_max), normalise_planes(top, 0, top_max))
+        images += list(np.rot90(rgba, 1, (1, 2)))
+
+    return tile_images(images, slice_num if slice_num > 1 else len(axes))
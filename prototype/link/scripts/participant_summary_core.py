@@ -0,0 +1,507 @@
+## The numeric core of the participant summary
+# The describe_* functions pull the information generated throughout the pipeline out of each participant's directory
+# and return dictionaries (cached in analysis/summary_cache/) without plotting anything. This module only imports
+# numpy, nibabel and the pipeline's own utilities so that batch jobs (e.g. scripts/batch_qa_summary.py) start quickly.
+# thumbnail_utils only imports Pillow when an image is made, and mat_utils only imports scipy.io or h5py when a MAT
+# file is read. The printing and plotting is in participant_summary_utils.py, which also
+# makes everything here available.
+
+import numpy as np
+import os
+import glob
+import functools
+import collections
+import concurrent.futures
+import nibabel
+from nifti_utils import extract_timecourses
+from summary_cache import cached_summary
+from qa_parsers import parse_qa_xml, parse_melodic_log
+from thumbnail_utils import cached_mosaic
+from overlay_utils import lightbox
+from sfnr_utils import whole_brain_sfnr
+from confound_utils import load_confounds
+from mat_utils import load_fields
+from sfnr_profile_utils import session_profiles, save_profiles
+from profiling_utils import profiled
+
+# Which voxel to show the time course of if no voxels or mask are specified
+EXAMPLE_VOXEL = (32, 32, 18)
+
+# Increase this whenever the contents of the describe_* summaries change so that old cached summaries aren't used
+SUMMARY_VERSION = 7
+
+# The fields of AnalysedData.mat that describe_behavior reads
+BEHAVIOR_FIELDS = ['FunctionalLength', 'FunctionalLength_Actual', 'TR', 'BurnInTRNumber', 'Include_Run',
+                   'EyeData.Coder_name', 'EyeData.IncludedCoders', 'EyeData.Reliability.*.Intraframe_all',
+                   'EyeData.Reliability.*.Interframe_all']
+
+# What describe_all returns instead of a section's summary if it couldn't be made (when catch_errors is True)
+SectionError = collections.namedtuple('SectionError', ['message'])
+
+# How many processes to use when workers isn't given: the cores this job was allocated (on SLURM this can be fewer than
+# the node has)
+def default_workers():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+
+# Describe a section, returning the error instead of raising it so that one failing run doesn't stop the others
+def describe_section(describe_function, *args, **kwargs):
+
+    try:
+        return describe_function(*args, **kwargs)
+    except Exception as err:
+        return SectionError('%s: %s' % (type(err).__name__, err))
+
+
+# Compute the descriptives for this run without plotting anything. The returned dictionary lists the sources that were
+# used so that it can be cached in analysis/summary_cache/. If images is False then the plots of the excluded TRs aren't
+# tiled into a mosaic (so nothing is written to thumbnails/)
+@profiled
+def describe_run(func_run, use_cache=True, images=True):
+    
+    if use_cache:
+        return cached_summary(('describe_run', SUMMARY_VERSION, func_run, images), lambda: describe_run(func_run, False, images))
+    
+    summary = {'func_run': func_run}
+    sources = []
+    
+    # Get the functional name (do it differently if it is a pseudorun)
+    if len(func_run) == 2:
+        func_pattern = 'data/nifti/*_functional%s.nii.gz' % func_run
+    else:
+        func_pattern = 'analysis/firstlevel/pseudorun/*_functional%s.nii.gz' % func_run
+    func_name = glob.glob(func_pattern)
+    sources += [os.path.dirname(func_pattern), func_name[0]]
+    
+    # Get the number of TRs per run 
+    summary['TR_num'] = nibabel.load(func_name[0]).shape[3]
+    
+    # Extract the sfnr from the QA
+    QA_pattern = 'data/qa/qa_events_*_functional%s.bxh.xml' % func_run
+    QA_Filename = glob.glob(QA_pattern);
+    sources.append(os.path.dirname(QA_pattern))
+    
+    summary['qa_metrics'] = None
+    if len(QA_Filename) > 0:
+        sources.append(QA_Filename[0])
+        
+        # Read all of the metrics in the QA file
+        summary['qa_metrics'] = parse_qa_xml(QA_Filename[0]).metrics
+    
+    # Extract the number of Confound TRs
+    confound_folder = 'analysis/firstlevel/Confounds/'
+    confound_file_name = '%sMotionConfounds_functional%s.txt' % (confound_folder, func_run)
+    sources += [confound_folder, confound_file_name]
+    
+    summary['excluded_TRs'] = None
+    summary['excluded_TR_pngs'] = []
+    summary['excluded_TR_mosaic'] = None
+    if os.path.isfile(confound_file_name):
+        confound_mat = load_confounds(confound_file_name, summary['TR_num'])
+        summary['excluded_TRs'] = np.sum(confound_mat,1) > 0
+        
+        # Find the plots of the excluded TRs and tile them into a single image
+        summary['excluded_TR_pngs'] = glob.glob('%sExcluded_TRs_functional%s_*.png' % (confound_folder, func_run))
+        sources += summary['excluded_TR_pngs']
+        if images:
+            summary['excluded_TR_mosaic'] = cached_mosaic(summary['excluded_TR_pngs'], 'Excluded_TRs_functional%s' % func_run)
+            sources.append(summary['excluded_TR_mosaic'])
+    
+    # Find the motion metric and centroid plots
+    summary['motion_metric_png'] = '%s/MotionMetric_fslmotion_3_functional%s.png' % (confound_folder, func_run)
+    summary['centroid_TR_png'] = '%s/MotionPosition_functional%s.png' % (confound_folder, func_run)
+    sources += [summary['motion_metric_png'], summary['centroid_TR_png']]
+    
+    summary['sources'] = sources
+    
+    return summary
+
+
+# Compute the firstlevel summary for this run without plotting anything. If images is False then the voxel time
+# courses, registration slices and EV plot thumbnail are skipped (which avoids reading any of the functional or
+# anatomical volumes). If the SFNR maps are missing they are only made (with sfnr_utils.py, writing them to the feat
+# folder) if make_sfnr is True
+@profiled
+def describe_firstlevel(func_run, voxels=None, mask=None, sidecar_dir=None, use_cache=True, images=True, reg_slices=1, make_sfnr=False):
+    
+    if voxels is None and mask is None:
+        voxels = [EXAMPLE_VOXEL]
+    
+    if use_cache:
+        voxel_key = None if voxels is None else tuple(map(tuple, np.atleast_2d(voxels).tolist()))
+        key = ('describe_firstlevel', SUMMARY_VERSION, func_run, voxel_key, mask, images, reg_slices, make_sfnr)
+        return cached_summary(key, lambda: describe_firstlevel(func_run, voxels, mask, sidecar_dir, False, images, reg_slices, make_sfnr))
+    
+    feat_folder = 'analysis/firstlevel/functional%s.feat/' % func_run
+    summary = {'func_run': func_run, 'feat_folder': feat_folder, 'timecourses': None, 'registration': None}
+    sources = [feat_folder]
+    
+    if isinstance(mask, str):
+        sources.append(mask)
+
+    # Check if it was excluded    
+    excluded_file = 'analysis/firstlevel/functional%s_excluded_run.fsf' % func_run
+    summary['excluded_run'] = os.path.isfile(excluded_file)
+    sources.append(excluded_file)
+        
+    # Cycle through the timing files for this run and count how many blocks and how many were excluded
+    timing_files = glob.glob('analysis/firstlevel/Timing/functional%s_*.txt' % func_run)
+    sources += ['analysis/firstlevel/Timing/'] + timing_files
+
+    summary['timing_file_num'] = len(timing_files)
+    summary['blocks'] = []
+    for timing_file in timing_files:
+        
+        # Ignore event or condition files
+        if timing_file.find('Event') == -1 and timing_file.find('Condition') == -1:
+            
+            # When does the name start and end
+            start_idx = timing_file.find('functional') + 11 + len(func_run)
+            end_idx = timing_file.find('.txt')
+            
+            block_name = timing_file[start_idx:end_idx]
+
+            # Load timing file and fix its dim if it is wrong
+            timing_mat = np.loadtxt(timing_file)
+
+            if len(timing_mat.shape) == 1:
+                timing_mat = timing_mat.reshape((1, 3))
+
+            summary['blocks'].append((block_name, np.sum(timing_mat[:,2] == 1), np.sum(timing_mat[:,2] == 0)))
+    
+    # Look through the feat folder 
+    summary['feat_exists'] = os.path.isdir(feat_folder)
+    if summary['feat_exists']:
+        
+        # Load in the sfnr data and mask to show what was excluded
+        sfnr_mask_file = feat_folder + 'sfnr_mask_prefiltered_func_data_st.nii.gz'
+        sfnr_map_file  = feat_folder + 'sfnr_prefiltered_func_data_st.nii.gz'    
+        summary['sfnr_mask_file'] = sfnr_mask_file
+        sources += [sfnr_mask_file, sfnr_map_file]
+        
+        # If SFNR masking wasn't used (or the matlab job failed) then the maps can be made from the slice time corrected
+        # data, but only when asked to since it reads the whole run and writes to the feat folder
+        st_file = feat_folder + 'prefiltered_func_data_st.nii.gz'
+        if make_sfnr and not os.path.isfile(sfnr_mask_file) and os.path.isfile(st_file):
+            confound_file = 'analysis/firstlevel/Confounds/MotionConfounds_functional%s.txt' % func_run
+            sources += [st_file, confound_file]
+            whole_brain_sfnr(st_file, feat_folder, confound_file)
+
+        summary['sfnr'] = None
+        if os.path.isfile(sfnr_mask_file):
+
+            # Only read the middle slice of each file
+            sfnr_mask_nii = nibabel.load(sfnr_mask_file)
+            slice_idx = sfnr_mask_nii.shape[2] // 2
+            sfnr_mask_slice = np.squeeze(np.asanyarray(sfnr_mask_nii.dataobj[:, :, slice_idx]))
+            sfnr_map_slice = np.squeeze(np.asanyarray(nibabel.load(sfnr_map_file).dataobj[:, :, slice_idx]))
+            
+            summary['sfnr'] = {'mean': sfnr_map_slice[sfnr_mask_slice == 1].mean(),
+                               'std': sfnr_map_slice[sfnr_mask_slice == 1].std(),
+                               'max': sfnr_map_slice.max(),
+                               'map_slice': sfnr_map_slice,
+                               'mask_slice': sfnr_mask_slice,
+                               }
+        
+        # Read the output of the log file of the ICA
+        ica_dir = feat_folder + 'filtered_func_data.ica/'
+        ev_file = ica_dir + 'report/EVplot.png'
+        sources.append(ev_file)
+        
+        summary['ev_png'] = None
+        summary['component_num'] = None
+        summary['excluded_components'] = None
+        if os.path.isfile(ev_file):
+            if images:
+                summary['ev_png'] = cached_mosaic([ev_file], 'EVplot')
+                sources.append(summary['ev_png'])
+            
+            # Checking whether any components were found with ICA and then if any were excluded
+            summary['component_num'] = len(glob.glob(ica_dir + 'report/IC_*_prob.png'))
+            sources.append(ica_dir + 'report/')
+
+            ica_file = glob.glob(feat_folder + 'feat_ICA-*.out')
+            if len(ica_file) > 0:
+                sources.append(ica_file[0])
+                
+                # Read the log file
+                summary['excluded_components'] = parse_melodic_log(ica_file[0])
+        
+        # Load the functional data in and compare voxels between the raw, mcf temporally filtered and filtered_func
+        func_files = [feat_folder + 'prefiltered_func_data_raw.nii.gz',
+                      feat_folder + 'prefiltered_func_data_mcf.nii.gz',
+                      feat_folder + 'prefiltered_func_data_intnorm.nii.gz',
+                      feat_folder + 'filtered_func_data.nii.gz',
+                      ]
+        
+        # Pull out the data (averaging across voxels if there are multiple)
+        if images:
+            summary['timecourses'] = [extract_timecourses(func_file, voxels, mask, sidecar_dir).mean(0) for func_file in func_files]
+            sources += func_files
+        
+        # Check for manual registration
+        manual_reg_file=feat_folder+'reg/Manual_Reg/'
+        summary['manual_reg'] = os.path.isdir(manual_reg_file)
+        sources.append(manual_reg_file)
+        
+        example_func_file = feat_folder + 'reg/example_func2highres.nii.gz'
+        highres_file = feat_folder + 'reg/highres.nii.gz'
+        sources += [example_func_file, highres_file]
+        
+        # Load the files
+        summary['reg_exists'] = os.path.isfile(example_func_file)
+        if summary['reg_exists'] and images:
+            
+            # Overlay example_func on highres for the saggital, coronal and axial slices
+            summary['registration'] = lightbox(highres_file, example_func_file, reg_slices)
+    
+    summary['sources'] = sources
+    
+    return summary
+
+
+# Find the univariate outputs and pull out the middle slice of the z stat
+@profiled
+def describe_univariate(func_run, use_cache=True):
+    
+    if use_cache:
+        return cached_summary(('describe_univariate', SUMMARY_VERSION, func_run), lambda: describe_univariate(func_run, False))
+    
+    # Load the feat folder
+    feat_folder = 'analysis/firstlevel/Exploration/functional%s_univariate.feat/' % func_run 
+    summary = {'func_run': func_run, 'feat_exists': os.path.isdir(feat_folder)}
+    sources = [feat_folder]
+
+    # Check the feat folder
+    if summary['feat_exists']:
+        
+        summary['design_png'] = feat_folder + 'design.png'
+        summary['motion_png'] = feat_folder + 'Motion_TaskCorrelation.png'
+        
+        # Open the file
+        zstat_file = feat_folder + 'stats/zstat1.nii.gz'
+        sources += [summary['design_png'], summary['motion_png'], zstat_file]
+        
+        # Load the middle slice of the z stat
+        nii = nibabel.load(zstat_file)
+        summary['zstat_idx'] = nii.shape[2] // 2
+        summary['zstat_slice'] = np.asanyarray(nii.dataobj[:, :, summary['zstat_idx']])
+    
+    summary['sources'] = sources
+    
+    return summary
+
+
+# Find the names of the runs (and pseudoruns) for this participant
+@profiled
+def find_runs():
+    
+    runs = glob.glob('analysis/firstlevel/pseudorun/*.nii.gz') + glob.glob('data/nifti/*_functional??.nii.gz')  # Work for both runs and pseudo runs
+    
+    # Pull out the run name
+    return [run[run.find('functional') + 10:run.find('.nii.gz')] for run in runs]
+
+
+# Compute all of the summaries for a single run. This is what each worker of summarise_participant runs. If
+# catch_errors is True then a section that fails is a SectionError rather than stopping the other sections
+@profiled
+def describe_all(func_run, voxels=None, mask=None, sidecar_dir=None, use_cache=True, reg_slices=1, catch_errors=False):
+    
+    describe = describe_section if catch_errors else lambda describe_function, *args, **kwargs: describe_function(*args, **kwargs)
+    
+    return {'func_run': func_run,
+            'descriptives': describe(describe_run, func_run, use_cache),
+            'firstlevel': describe(describe_firstlevel, func_run, voxels, mask, sidecar_dir, use_cache, reg_slices=reg_slices),
+            'univariate': describe(describe_univariate, func_run, use_cache),
+            }
+
+
+# Compute the summaries for every run in parallel, returning a list with one dictionary per run in the same order as
+# runs. Nothing is plotted, pass the output to plot_participant to do that. workers sets how many processes to use
+# (defaults to all of the cores); with workers=1 everything is run serially in this process. catch_errors is passed to
+# describe_all
+@profiled
+def summarise_participant(runs=None, workers=None, voxels=None, mask=None, sidecar_dir=None, use_cache=True, reg_slices=1, catch_errors=False):
+    
+    if runs is None:
+        runs = find_runs()
+    
+    if workers is None:
+        workers = default_workers()
+    
+    describe_func = functools.partial(describe_all, voxels=voxels, mask=mask, sidecar_dir=sidecar_dir, use_cache=use_cache, reg_slices=reg_slices, catch_errors=catch_errors)
+    
+    if workers <= 1 or len(runs) <= 1:
+        return [describe_func(func_run) for func_run in runs]
+    
+    # Each worker only returns numbers, slices and file names so all of the plotting happens in this process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(runs))) as executor:
+        return list(executor.map(describe_func, runs))
+
+
+# Compute the SFNR profile of every run and save them all to analysis/firstlevel/sfnr_profiles.npz without plotting
+@profiled
+def describe_sfnr_profiles(use_cache=True):
+
+    summary = session_profiles('.', use_cache=use_cache)
+
+    summary['profiles_file'] = None
+    if len(summary['runs']) > 0:
+        summary['profiles_file'] = 'analysis/firstlevel/sfnr_profiles.npz'
+        save_profiles(summary, summary['profiles_file'])
+
+    return summary
+
+
+# Pull the run and eye tracking information out of AnalysedData.mat without plotting anything. If images is False then
+# the behavioral figures are listed but not tiled into a mosaic
+@profiled
+def describe_behavior(use_cache=True, images=True):
+    
+    if use_cache:
+        return cached_summary(('describe_behavior', SUMMARY_VERSION, images), lambda: describe_behavior(False, images))
+    
+    behavioral_folder = 'analysis/Behavioral/'
+    summary = {'analysis_timing': None, 'coders': None, 'reliability': None}
+    sources = [behavioral_folder]
+
+    # Load analysis timing in and look at some of the outputs
+    analysis_timing_file = behavioral_folder + 'AnalysedData.mat'
+    sources.append(analysis_timing_file)
+    if os.path.isfile(analysis_timing_file):
+
+        # Only keep the fields that are needed. They are cached next to the file since the eye tracking data makes it
+        # slow to load (v7 files are decoded in full the first time)
+        fields = load_fields(analysis_timing_file, ['AnalysedData.' + field for field in BEHAVIOR_FIELDS])
+        analysis_timing = {field: fields['AnalysedData.' + field] for field in BEHAVIOR_FIELDS}
+
+        # Get the TRs per run
+        expected_duration = np.atleast_1d(analysis_timing['FunctionalLength'])
+        actual_TRs = np.atleast_1d(analysis_timing['FunctionalLength_Actual'])
+        TR_duration = np.atleast_1d(analysis_timing['TR'])
+        BurnInTRNumber = np.atleast_1d(analysis_timing['BurnInTRNumber'])
+        Included_Runs = np.atleast_1d(analysis_timing['Include_Run'])
+        
+        # Calculate the expected number of TRs
+        expected_TRs = (expected_duration / TR_duration[:len(expected_duration)]) + BurnInTRNumber
+        
+        summary['analysis_timing'] = {'expected_TRs': expected_TRs,
+                                      'actual_TRs': actual_TRs,
+                                      'included_runs': Included_Runs,
+                                      # Check to see if there is a mismatch for the included runs
+                                      'TR_mismatch': bool(np.any((actual_TRs != expected_TRs)[np.where(Included_Runs == 1)])),
+                                      }
+        
+        # Get the coder names
+        if analysis_timing['EyeData.Coder_name'] is not None:
+            coder_names = analysis_timing['EyeData.Coder_name']
+            if isinstance(coder_names, str):
+                coder_names = [coder_names]
+            included_coders = np.atleast_1d(analysis_timing['EyeData.IncludedCoders']).astype(int) - 1
+            excluded_coders = np.setxor1d(np.arange(len(coder_names)), included_coders)
+            
+            summary['coders'] = {'names': coder_names,
+                                 'included': included_coders,
+                                 'excluded': excluded_coders,
+                                 }
+        
+        Intraframes = analysis_timing['EyeData.Reliability.*.Intraframe_all']
+        Interframes = analysis_timing['EyeData.Reliability.*.Interframe_all']
+        if Intraframes is not None and len(Intraframes) > 0:
+
+            summary['reliability'] = []
+            for attribute in Intraframes:
+                Intraframe = np.atleast_1d(Intraframes[attribute])
+                Interframe = np.atleast_1d(Interframes[attribute])
+                summary['reliability'].append((attribute, Intraframe, Interframe))
+        
+    # Find all of the figures that are stored in the behavioral folder starting with Experiment_* and tile them
+    summary['behavior_pngs'] = sorted(glob.glob(behavioral_folder + '*.png'))
+    summary['behavior_mosaic'] = None
+    sources += summary['behavior_pngs']
+    if images:
+        summary['behavior_mosaic'] = cached_mosaic(summary['behavior_pngs'], 'Behavioral')
+        sources.append(summary['behavior_mosaic'])
+    
+    summary['sources'] = sources
+    
+    return summary
+
+
+# Find the registration to standard and count the blocks in each secondlevel experiment folder without plotting
+@profiled
+def describe_secondlevel(use_cache=True):
+    
+    if use_cache:
+        return cached_summary(('describe_secondlevel', SUMMARY_VERSION), lambda: describe_secondlevel(False))
+    
+    summary = {}
+    sources = []
+    
+    reg_folder = 'analysis/secondlevel/registration_ANTs/'    
+    sources.append(reg_folder)
+    if os.path.isdir(reg_folder):
+
+        summary['registration'] = 'ANTs'
+        summary['highres_file'] = reg_folder + 'highres2standard.nii.gz'
+        summary['standard_file'] = None # Get this from the automatic directory
+        summary['manual_reg'] = None
+
+    else:
+        reg_folder = 'analysis/secondlevel/registration.feat/'
+        summary['registration'] = 'FEAT'
+        summary['highres_file'] = reg_folder + 'reg/highres2standard.nii.gz'
+        summary['standard_file'] = reg_folder + 'reg/standard.nii.gz'
+
+        manual_reg_folder=reg_folder+'reg/Manual_Reg_Standard/'
+        summary['manual_reg'] = os.path.isdir(manual_reg_folder)
+        sources += [reg_folder + 'reg/', manual_reg_folder]
+    
+    summary['highres_exists'] = os.path.isfile(summary['highres_file'])
+    sources.append(summary['highres_file'])
+    
+    # Check the secondlevel experiment folders that exist
+    experiment_folders = glob.glob('analysis/secondlevel_*')    
+    sources.append('analysis/')
+    
+    summary['experiments'] = []
+    for experiment_folder in experiment_folders:
+        
+        timing_files = glob.glob(experiment_folder + '/default/Timing/*_Only.txt')
+        sources += [experiment_folder + '/default/Timing/'] + timing_files
+        
+        blocks = []
+        for timing_file in timing_files:
+            timing_mat = np.loadtxt(timing_file)
+            
+            if len(timing_mat.shape) == 1:
+                timing_mat = timing_mat.reshape((1, 3))
+                
+            blocks.append((timing_file, np.sum(timing_mat[:,2] == 1), np.sum(timing_mat[:,2] == 0)))
+        
+        summary['experiments'].append((experiment_folder, blocks))
+    
+    # Load the ScanTimeAnalysis data for this participant
+    stacked_data_name = 'analysis/Behavioral/ppt_stacked_data.mat'
+    summary['stacked_data_name'] = stacked_data_name
+    summary['stacked_data'] = None
+    sources += [stacked_data_name, 'analysis/secondlevel/FunctionalSplitter_Log']
+    if os.path.isfile(stacked_data_name):
+        
+        out_of_date = os.path.exists('analysis/secondlevel/FunctionalSplitter_Log') == False or os.path.getmtime('analysis/secondlevel/FunctionalSplitter_Log') > os.path.getmtime('analysis/Behavioral/ppt_stacked_data.mat')
+        
+        # Load just the stacked data from the matlab file
+        stacked_data_all = load_fields(stacked_data_name, ['ppt_stacked_data', 'stacked_labels'])
+        
+        # Pull out the data
+        stacked_labels = []
+        stacked_data = []
+        for category_counter in range(len(stacked_data_all['ppt_stacked_data'])):
+            stacked_labels.append(stacked_data_all['stacked_labels'][category_counter])
+            stacked_data.append(stacked_data_all['ppt_stacked_data'][category_counter])
+        
+        summary['stacked_data'] = {'labels': stacked_labels, 'data': stacked_data, 'out_of_date': out_of_date}
+    
+    summary['sources'] = sources
+    
+    return summary
@@ -1,95 +1,74 @@
 ## Create the functions needed to run participant_summary.ipynb
 # Various functions are defined herein that preprocess information generated throughout the pipeline in order to facilitate viewing.
+# The information is computed by the describe_* functions in participant_summary_core.py (which are all available from
+# here) and this module prints and plots it. matplotlib, scipy.stats and nilearn take seconds to import so they are
+# only imported when something is first plotted.
 
 # Edited TY 04032020
 
 import numpy as np
 import os
-import glob
+import re
 import nibabel
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from scipy import stats
-from scipy.io import loadmat
-import matplotlib
-import nilearn.plotting as plotting
-matplotlib.rcParams['figure.dpi'] = 100
+from participant_summary_core import *
+from nifti_utils import extract_timecourses
+from qa_parsers import first_metric
+from overlay_utils import normalise_planes, blend_planes
+from motion_outlier_utils import find_outliers
+from interpolation_utils import excluded_from_confounds, interpolate_TRs, z_score_interpolate
+from reliability_utils import session_reliability
+from profiling_utils import profiled, profile_stage
+
+# The resolution of the figures (set per figure rather than in rcParams so that importing this doesn't change other plots)
+FIGURE_DPI = 100
 
 # Generate the descriptives for this run
-def generate_descriptives(func_run):
-    
-    # Get the functional name (do it differently if it is a pseudorun)
-    if len(func_run) == 2:
-        func_name = glob.glob('data/nifti/*_functional%s.nii.gz' % func_run)
-    else:
-        func_name = glob.glob('analysis/firstlevel/pseudorun/*_functional%s.nii.gz' % func_run)
-    
-    # Get the number of TRs per run 
-    nii = nibabel.load(func_name[0])
-    
-    print('Functional run %s has %d TRs' % (func_run, nii.shape[3]))
-    
-    # Extract the sfnr from the QA
-    QA_Filename = glob.glob('data/qa/qa_events_*_functional%s.bxh.xml' % func_run);
-    
-    if len(QA_Filename) > 0:
-        
-        # Open the file and find the secions that define SNR and SFNR
-        fid = open(QA_Filename[0], 'r')
-        lines = fid.readlines()
+@profiled
+def generate_descriptives(func_run, use_cache=True):
+    plot_descriptives(describe_run(func_run, use_cache))
+
 
-        for line in lines:
-            if line.find('mean_snr_middle_slice') > -1:
-                print('QA SNR: %s' % line[line.find('>') + 1:line.find('</')])
-            elif line.find('mean_sfnr_middle_slice') > -1:
-                print('QA SFNR: %s' % line[line.find('>') + 1:line.find('</')])
+# Print and plot the descriptives made by describe_run
+@profiled
+def plot_descriptives(summary):
 
-        fid.close()
+    import matplotlib.pyplot as plt
+    
+    print('Functional run %s has %d TRs' % (summary['func_run'], summary['TR_num']))
+    
+    if summary['qa_metrics'] is not None:
+        for qa_label, qa_metric in [('SNR', 'mean_snr_middle_slice'), ('SFNR', 'mean_sfnr_middle_slice')]:
+            if qa_metric in summary['qa_metrics']:
+                print('QA %s: %s' % (qa_label, first_metric(summary['qa_metrics'], qa_metric)))
     else:
         print('No QA file found')
     
-    # Extract the number of Confound TRs
-    confound_file_name = 'analysis/firstlevel/Confounds/MotionConfounds_functional%s.txt' % func_run 
-    
-    if os.path.isfile(confound_file_name):
-        confound_mat = np.loadtxt(confound_file_name)
-        
-        if len(confound_mat.shape) == 1:
-            confound_mat = confound_mat.reshape((len(confound_mat), 1))
-        
-        confound_TRs = np.sum(confound_mat,1) > 0
+    if summary['excluded_TRs'] is not None:
+        confound_TRs = summary['excluded_TRs']
         print('%d time points are excluded (Proportion=%0.2f)' % (np.sum(confound_TRs), np.mean(confound_TRs)))
         
         # Plot the excluded TRs
-        Excluded_TR_files = glob.glob('analysis/firstlevel/Confounds/Excluded_TRs_functional%s_*.png' % func_run) 
-
-        file_num = len(Excluded_TR_files)
-        
-        if file_num > 0: 
-            plt.figure()
-            for file_counter, Excluded_TR_file in enumerate(Excluded_TR_files):
-                plt.subplot(int(np.ceil(np.sqrt(file_num))), int(np.ceil(np.sqrt(file_num))),file_counter+1)
+        if summary['excluded_TR_mosaic'] is not None: 
+            new_figure()
 
-                # Load in the image
-                img = mpimg.imread(Excluded_TR_file)
+            # Load in the mosaic of all of the images
+            img = read_png(summary['excluded_TR_mosaic'])
 
-                # Show the image
-                plt.imshow(img)
-                plt.axis('off')
+            # Show the image
+            plt.imshow(img)
+            plt.axis('off')
 
     else:
         print('No Confound file found')
-        
-    confound_folder = 'analysis/firstlevel/Confounds/'
     
     # Plot the motion metric data
-    motion_metric_file = '%s/MotionMetric_fslmotion_3_functional%s.png' % (confound_folder, func_run)
+    motion_metric_file = summary['motion_metric_png']
     if os.path.isfile(motion_metric_file):
         
-        plt.figure()
+        new_figure()
         
         # Load in the image
-        img = mpimg.imread(motion_metric_file)
+        img = read_png(motion_metric_file)
 
         # Show the image
         plt.imshow(img)
@@ -97,440 +76,506 @@ def generate_descriptives(func_run):
     else:
         print('Can''t find %s' % motion_metric_file)
     
-    centroid_TR_file = '%s/MotionPosition_functional%s.png' % (confound_folder, func_run)
+    centroid_TR_file = summary['centroid_TR_png']
     if os.path.isfile(centroid_TR_file):
-        plt.figure()
+        new_figure()
         
         # Load in the image
-        img = mpimg.imread(centroid_TR_file)
+        img = read_png(centroid_TR_file)
 
         # Show the image
         plt.imshow(img)
         plt.axis('off')
     else:
         print('Can''t find %s' % centroid_TR_file)
-    
-    
-# Look at the feat folder and report summary information    
-def summarise_firstlevel(func_run):
-       
+
+
+# Re-threshold the motion metric saved for this run (analysis/firstlevel/Confounds/MotionMetric_*_functional*.txt) to
+# see how many TRs would be excluded. metric_name is the part of the file name after MotionMetric_ (e.g. refrms or
+# fslmotion_3). If the threshold is None then the one the pipeline used is taken from the name (fslmotion_<N> is
+# --fd --thresh=N) and otherwise the box-plot cutoff is used
+def summarise_motion_outliers(func_run, threshold=None, metric_name='fslmotion_3'):
+
+    import matplotlib.pyplot as plt
+
+    metric_file = 'analysis/firstlevel/Confounds/MotionMetric_%s_functional%s.txt' % (metric_name, func_run)
+    if not os.path.isfile(metric_file):
+        print('Can\'t find %s' % metric_file)
+        return None
+
+    fslmotion_threshold = re.match(r'fslmotion_(\d+(\.\d+)?)$', metric_name)
+    if threshold is None and fslmotion_threshold is not None:
+        threshold = float(fslmotion_threshold.group(1))
+
+    metric_values = np.loadtxt(metric_file, ndmin=1)
+    outliers, threshold = find_outliers(metric_values, threshold)
+
+    print('%d of %d time points are over %0.2f (Proportion=%0.2f)' % (outliers.sum(), len(outliers), threshold, outliers.mean()))
+
+    new_figure(figsize=(8, 3))
+    plt.plot(metric_values)
+    plt.plot(np.flatnonzero(outliers), metric_values[outliers], 'r.')
+    plt.axhline(threshold, color='r', linestyle='--')
+    plt.xlabel('TR')
+    plt.ylabel(metric_name)
+
+    return outliers
+
+
+# Show what interpolating (and z scoring) the excluded TRs of this run would do to the time course of a voxel (or the
+# average within a mask) without writing any files. interpolation_type is mean_included, linear or mean. This uses the
+# same input as FEAT_prestats.sh: prefiltered_func_data in the feat folder, which is backed up as
+# prefiltered_func_data_raw before it is interpolated
+def preview_interpolation(func_run, voxels=None, mask=None, interpolation_type='mean_included', sidecar_dir=None):
+
+    import matplotlib.pyplot as plt
+
+    if voxels is None and mask is None:
+        voxels = [EXAMPLE_VOXEL]
+
     feat_folder = 'analysis/firstlevel/functional%s.feat/' % func_run
+    func_name = feat_folder + 'prefiltered_func_data_raw.nii.gz'
+    if not os.path.isfile(func_name):
+        func_name = feat_folder + 'prefiltered_func_data.nii.gz'
+    if not os.path.isfile(func_name):
+        print('Can\'t find %s' % func_name)
+        return None
 
-    # Check if it was excluded    
-    if os.path.isfile('analysis/firstlevel/functional%s_excluded_run.fsf' % func_run):
-        print('This run was excluded!')
-        
-    # Cycle through the timing files for this run and output how many blocks and how many were excluded
-    timing_files = glob.glob('analysis/firstlevel/Timing/functional%s_*.txt' % func_run)
+    timecourse = extract_timecourses(func_name, voxels, mask, sidecar_dir).mean(0)
 
-    for timing_file in timing_files:
-        
-        # Ignore event or condition files
-        if timing_file.find('Event') == -1 and timing_file.find('Condition') == -1:
-            
-            # When does the name start and end
-            start_idx = timing_file.find('functional') + 11 + len(func_run)
-            end_idx = timing_file.find('.txt')
-            
-            block_name = timing_file[start_idx:end_idx]
+    confound_file = 'analysis/firstlevel/Confounds/MotionConfounds_functional%s.txt' % func_run
+    excluded = excluded_from_confounds(confound_file, len(timecourse))
+    if excluded is None:
+        return None
+
+    interpolated = interpolate_TRs(timecourse, excluded, interpolation_type)
+    zscored = z_score_interpolate(timecourse, excluded, interpolation_type)
+
+    print('Interpolating %d of %d TRs using %s' % (excluded.sum(), len(excluded), interpolation_type))
+
+    new_figure(figsize=(8, 5))
+    plt.subplot(2, 1, 1)
+    plt.plot(timecourse, 'k', label='Original')
+    plt.plot(interpolated, 'b', label='Interpolated')
+    plt.plot(np.flatnonzero(excluded), interpolated[excluded], 'r.', label='Excluded TRs')
+    plt.legend()
+    plt.subplot(2, 1, 2)
+    plt.plot(zscored, 'b')
+    plt.ylabel('Z score')
+    plt.xlabel('TR')
+
+    return interpolated
+
+
+# Look at the feat folder and report summary information    
+# To plot a different voxel provide a list of (x, y, z) coordinates as voxels, or a mask (file name or volume) to
+# plot the average time course within it. If sidecar_dir is specified then uncompressed copies of the functionals are
+# stored there so that future calls are faster. reg_slices sets how many slices along each axis are shown for the
+# registration (e.g. 8 gives a 3 x 8 lightbox). If the SFNR maps are missing, make_sfnr=True makes them in the feat folder
+@profiled
+def summarise_firstlevel(func_run, voxels=None, mask=None, sidecar_dir=None, use_cache=True, reg_slices=1, make_sfnr=False):
+    plot_firstlevel(describe_firstlevel(func_run, voxels, mask, sidecar_dir, use_cache, reg_slices=reg_slices, make_sfnr=make_sfnr))
 
-            # Load timing file and fix its dim if it is wrong
-            timing_mat = np.loadtxt(timing_file)
 
-            if len(timing_mat.shape) == 1:
-                timing_mat = timing_mat.reshape((1, 3))
+# Print and plot the firstlevel summary made by describe_firstlevel
+@profiled
+def plot_firstlevel(summary):
 
-            print('%s has %d included blocks and %d excluded blocks' % (block_name, np.sum(timing_mat[:,2] == 1), np.sum(timing_mat[:,2] == 0)))
+    import matplotlib.pyplot as plt
+    from scipy import stats
+    
+    func_run = summary['func_run']
+    feat_folder = summary['feat_folder']
+    
+    # Check if it was excluded    
+    if summary['excluded_run']:
+        print('This run was excluded!')
+    
+    # Output how many blocks and how many were excluded
+    for block_name, included_num, excluded_num in summary['blocks']:
+        print('%s has %d included blocks and %d excluded blocks' % (block_name, included_num, excluded_num))
         
-    if len(timing_files) == 0:
+    if summary['timing_file_num'] == 0:
         print('No timing files found for this run')
     
     # Look through the feat folder 
-    if os.path.isdir(feat_folder):
+    if summary['feat_exists']:
         
         print('Looking through %s' % feat_folder)
 
-        # Load in the sfnr data and mask to show what was excluded
-        sfnr_mask_file = feat_folder + 'sfnr_mask_prefiltered_func_data_st.nii.gz'
-        sfnr_map_file  = feat_folder + 'sfnr_prefiltered_func_data_st.nii.gz'    
-        
-        if os.path.isfile(sfnr_mask_file):
-
-            # Load the files
-            sfnr_mask = nibabel.load(sfnr_mask_file).get_data()
-            sfnr_map = nibabel.load(sfnr_map_file).get_data()
-
-            # Make slices
-            slice_idx = sfnr_mask.shape[2] // 2
-            sfnr_mask_slice = np.squeeze(sfnr_mask[:, :, slice_idx])
-            sfnr_map_slice = np.squeeze(sfnr_map[:, :, slice_idx])
+        if summary['sfnr'] is not None:
+            sfnr = summary['sfnr']
                         
             # Overlay the slices
-            print('SFNR Mean=%0.2f, STD=%0.2f, Max=%0.2f' % (sfnr_map_slice[sfnr_mask_slice == 1].mean(), sfnr_map_slice[sfnr_mask_slice == 1].std(), sfnr_map_slice.max()))
+            print('SFNR Mean=%0.2f, STD=%0.2f, Max=%0.2f' % (sfnr['mean'], sfnr['std'], sfnr['max']))
             
             # Set the range 
-            sfnr_mask_slice /= sfnr_mask_slice.max()
-            sfnr_map_slice /= sfnr_map_slice.max()
+            sfnr_mask_slice = sfnr['mask_slice'] / sfnr['mask_slice'].max()
+            sfnr_map_slice = sfnr['map_slice'] / sfnr['map_slice'].max()
 
-            plt.figure()
+            new_figure()
             plt.title('SFNR volume with masked voxels')
             overlay_slices(sfnr_map_slice, sfnr_mask_slice)
             
         else:
-            print('Couldn''t find %s' % sfnr_mask_file)
+            print("Couldn't find %s (make it with summarise_firstlevel(func_run, make_sfnr=True) or sfnr_utils.py)" % summary['sfnr_mask_file'])
         
-        # Read the output of the log file of the ICA
-        ica_dir = feat_folder + 'filtered_func_data.ica/'
-        ev_file = ica_dir + 'report/EVplot.png'
-        if os.path.isfile(ev_file):
+        if summary['ev_png'] is not None:
             
             # Load the variance explained
-            img = mpimg.imread(ev_file)
-            plt.figure()
+            img = read_png(summary['ev_png'])
+            new_figure()
             plt.imshow(img)
             plt.axis('off')
             plt.show()
             
-            # Checking whether any components were found with ICA and then if any were excluded
-            component_num = len(glob.glob(ica_dir + 'report/IC_*_prob.png'))
-
-            ica_file = glob.glob(feat_folder + 'feat_ICA-*.out')
-            if len(ica_file) > 0:
-                # Read the log file
-                fid = open(ica_file[0])
-                lines = fid.readlines()
-
-                # Walk through the lines 
-                Excluded_components=''
-                for line in lines:
-                    if line.find('Components=') > -1:
-                        idx_start = line.find('Components=') + 11
-                        idx_end = line.find('\n')
-                        Excluded_components = line[idx_start:idx_end]
-
-                print('MELODIC summary\nGenerated %d components, regressing out the following components: %s' % (component_num, Excluded_components))
-
+            if summary['excluded_components'] is not None:
+                print('MELODIC summary\nGenerated %d components, regressing out the following components: %s' % (summary['component_num'], summary['excluded_components']))
             else:
-                print('MELODIC summary\nGenerated %d components, couldn''t find how many were regressed out' % component_num)
+                print('MELODIC summary\nGenerated %d components, couldn''t find how many were regressed out' % summary['component_num'])
         else:
             print('MELODIC folder not found')
         
-        # Load the functional data in and compare voxels between the raw, mcf temporally filtered and filtered_func
-        
-        func_raw_file = feat_folder + 'prefiltered_func_data_raw.nii.gz'
-        func_mc_file = feat_folder + 'prefiltered_func_data_mcf.nii.gz'
-        func_intnorm_file = feat_folder + 'prefiltered_func_data_intnorm.nii.gz'
-        func_final_file = feat_folder + 'filtered_func_data.nii.gz'
-        
-        # Pull out the data
-        func_raw = nibabel.load(func_raw_file).get_data()[32, 32, 18, :]
-        func_mc = nibabel.load(func_mc_file).get_data()[32, 32, 18, :]
-        func_intnorm = nibabel.load(func_intnorm_file).get_data()[32, 32, 18, :]
-        func_final = nibabel.load(func_final_file).get_data()[32, 32, 18, :]
-        
-        plt.figure()
-        plt.plot(func_raw)
-        plt.plot(func_mc)
-        plt.plot(func_intnorm)
-        plt.plot(func_final)
-        plt.ylabel('MR value')
-        plt.title('Example voxel time course')
-        
-        plt.figure()
-        plt.plot(stats.zscore(func_raw))
-        plt.plot(stats.zscore(func_mc))
-        plt.plot(stats.zscore(func_intnorm))
-        plt.plot(stats.zscore(func_final))
-        plt.legend(('Raw', 'Motion corrected', 'Temporally filtered', 'filtered_func'))
-        plt.ylabel('Z score')
-        plt.title('Example voxel time course z scored')
+        # Compare voxels between the raw, mcf temporally filtered and filtered_func
+        if summary['timecourses'] is not None:
+            new_figure()
+            for timecourse in summary['timecourses']:
+                plt.plot(timecourse)
+            plt.ylabel('MR value')
+            plt.title('Example voxel time course')
+            
+            new_figure()
+            for timecourse in summary['timecourses']:
+                plt.plot(stats.zscore(timecourse))
+            plt.legend(('Raw', 'Motion corrected', 'Temporally filtered', 'filtered_func'))
+            plt.ylabel('Z score')
+            plt.title('Example voxel time course z scored')
         
         # Create the registration plots
         
         #First check manual registration
-        manual_reg_file=feat_folder+'reg/Manual_Reg/'
-        
-        if os.path.isdir(manual_reg_file):
+        if summary['manual_reg']:
             print('functional%s was manually aligned' % func_run)
         else:
             print('!#!#!#!#!#!#!#! functional%s was not manually aligned !#!#!#!#!#!#!#!' % func_run)
         
-        
-        example_func_file = feat_folder + 'reg/example_func2highres.nii.gz'
-        highres_file = feat_folder + 'reg/highres.nii.gz'
-        
-        # Load the files
-        if os.path.isfile(example_func_file):
-            example_func = nibabel.load(example_func_file).get_data()
-            highres = nibabel.load(highres_file).get_data()
-            
-            # Set the range 
-            highres /= highres.max()
-            example_func /= example_func.max()
-        
-            # Get slice idxs
-            saggital_idx = highres.shape[0] // 2
-            coronal_idx = highres.shape[1] // 2
-            axial_idx = highres.shape[2] // 2
-
-            plt.figure(figsize=(10,5))
+        if summary['registration'] is not None:
+            new_figure(figsize=(10, 10 * summary['registration'].shape[0] / summary['registration'].shape[1]))
             print('example_func2highres')
-            plt.subplot(1, 3, 1)
-            example_func_slice = np.squeeze(example_func[saggital_idx, :, :])
-            highres_slice = np.squeeze(highres[saggital_idx, :, :])
-            overlay_slices(highres_slice, example_func_slice)
-
-            plt.subplot(1, 3, 2)
-            example_func_slice = np.squeeze(example_func[:, coronal_idx, :])
-            highres_slice = np.squeeze(highres[:, coronal_idx, :])
-            overlay_slices(highres_slice, example_func_slice)
-
-            plt.subplot(1, 3, 3)
-            example_func_slice = np.squeeze(example_func[:, :, axial_idx])
-            highres_slice = np.squeeze(highres[:, :, axial_idx])
-            overlay_slices(highres_slice, example_func_slice)
-        else:
+            plt.imshow(summary['registration'])
+            plt.axis('off')
+            plt.show()
+        elif not summary['reg_exists']:
             print('No registration data found')
     else:
         print('%s not found, skipping' % feat_folder)
-    
-    
+
+
 # Read in the univariate file    
-def summarise_univariate(func_run):
-    
-    # Load the feat folder
-    feat_folder = 'analysis/firstlevel/Exploration/functional%s_univariate.feat/' % func_run 
+@profiled
+def summarise_univariate(func_run, use_cache=True):
+    plot_univariate(describe_univariate(func_run, use_cache))
+
+
+# Plot the univariate summary made by describe_univariate
+@profiled
+def plot_univariate(summary):
+
+    import matplotlib.pyplot as plt
 
     # Check the feat folder
-    if os.path.isdir(feat_folder):
+    if summary['feat_exists']:
 
         # Load the design matrix
-        img = mpimg.imread(feat_folder + 'design.png')
-        plt.figure(figsize=(10, 5))
+        img = read_png(summary['design_png'])
+        new_figure(figsize=(10, 5))
         plt.imshow(img)
         plt.axis('off')
         
-        img = mpimg.imread(feat_folder + 'Motion_TaskCorrelation.png')
-        plt.figure()
+        img = read_png(summary['motion_png'])
+        new_figure()
         plt.imshow(img)
         plt.axis('off')
         
-        # Open the file
-        zstat_file = feat_folder + 'stats/zstat1.nii.gz'
-        
-        # Load the nifti file
-        nii = nibabel.load(zstat_file)
-        
-        # Load the z stat
-        zstat = nii.get_data()
-        idx = zstat.shape[2] // 2
-        
         # Plot the z stat
-        plt.figure()
-        plt.title('Z stat: z coord=%d' % idx)
-        plt.imshow(zstat[:, :, idx])
+        new_figure()
+        plt.title('Z stat: z coord=%d' % summary['zstat_idx'])
+        plt.imshow(summary['zstat_slice'])
         plt.colorbar()
         plt.axis('off')
         plt.show()
 
 
-# Summarise the behavioral data
-def summarise_behavior():
-    print('#######################\n#######################\n# Summary across runs #\n#######################\n#######################\n')
-    behavioral_folder = 'analysis/Behavioral/'
-
-    # Load analysis timing in and look at some of the outputs
-    analysis_timing_file = behavioral_folder + 'AnalysedData.mat'
-    if os.path.isfile(analysis_timing_file):
-        analysis_timing_all = loadmat(analysis_timing_file, struct_as_record=False)['AnalysedData']
+# Print and plot the summaries made by summarise_participant
+@profiled
+def plot_participant(results):
+    
+    for result in results:
         
-        # The data is stored as an object in the third list down
-        analysis_timing = analysis_timing_all[0][0]
+        print('#######################\n#######################\n##   functional%s    ##\n#######################\n#######################\n' % result['func_run'])
         
-        # Get the TRs per run
-        expected_duration= analysis_timing.FunctionalLength[0]
-        actual_TRs = analysis_timing.FunctionalLength_Actual[0]
-        TR_duration = analysis_timing.TR[0]
-        BurnInTRNumber = analysis_timing.BurnInTRNumber[0]
-        Included_Runs = analysis_timing.Include_Run[0]
+        plot_descriptives(result['descriptives'])
+        plot_firstlevel(result['firstlevel'])
+        plot_univariate(result['univariate'])
         
-        # Calculate the expected number of TRs
-        expected_TRs = (expected_duration / TR_duration[:len(expected_duration)]) + BurnInTRNumber
+        # Finish the run    
+        print('----------------------------\n\n')
+
+
+# Summarise how SFNR changes across slices (along Y) for every run
+@profiled
+def summarise_sfnr_profiles(use_cache=True):
+    plot_sfnr_profiles(describe_sfnr_profiles(use_cache))
+
+
+# Plot the mean (and standard deviation) SFNR of each slice for every run, and the distribution of SFNR in each slice
+@profiled
+def plot_sfnr_profiles(summary):
+
+    import matplotlib.pyplot as plt
+
+    if len(summary['runs']) == 0:
+        print('No SFNR maps found')
+        return
+
+    print('SFNR profiles saved in %s' % summary['profiles_file'])
+
+    # Overlay the profiles of all of the runs
+    new_figure(figsize=(10, 4))
+    for run_counter, run in enumerate(summary['runs']):
+        mean = summary['mean'][run_counter]
+        std = summary['std'][run_counter]
+        line = plt.plot(mean, label=run.split('/')[-1])[0]
+        plt.fill_between(np.arange(len(mean)), mean - std, mean + std, color=line.get_color(), alpha=0.1)
+    plt.xlabel('Slice')
+    plt.ylabel('SFNR')
+    plt.legend(fontsize='small')
+    plt.show()
+
+    # Show the proportion of each slice with each SFNR for every run
+    new_figure(figsize=(3 * len(summary['runs']), 3))
+    for run_counter, run in enumerate(summary['runs']):
+        plt.subplot(1, len(summary['runs']), run_counter + 1)
+        max_value = summary['max_value'][run_counter]
+        plt.imshow(summary['distribution'][run_counter].T, origin='lower', aspect='auto', cmap='jet', extent=(0, summary['distribution'].shape[1], 0, max_value))
+        plt.title(run.split('/')[-1], fontsize='small')
+        plt.xlabel('Slice')
+        if run_counter == 0:
+            plt.ylabel('SFNR')
+    plt.show()
+
+
+# Summarise the behavioral data
+@profiled
+def summarise_behavior(use_cache=True):
+    plot_behavior(describe_behavior(use_cache))
+
+
+# Print the behavioral summary and plot the figures in the behavioral folder
+@profiled
+def plot_behavior(summary):
+
+    import matplotlib.pyplot as plt
+    print('#######################\n#######################\n# Summary across runs #\n#######################\n#######################\n')
+
+    if summary['analysis_timing'] is not None:
+        analysis_timing = summary['analysis_timing']
         
         print('Match between expected and actual TR numbers:')
-        print('Expected: %s' % expected_TRs)
-        print('Actual: %s' % actual_TRs)
+        print('Expected: %s' % analysis_timing['expected_TRs'])
+        print('Actual: %s' % analysis_timing['actual_TRs'])
         
         # Check to see if there is a mismatch for the included runs
-        if np.any((actual_TRs != expected_TRs)[np.where(Included_Runs == 1)]):
+        if analysis_timing['TR_mismatch']:
             print('!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!\n\nRUN TR MISMATCH\n\n!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!\n')
         
         # Get the coder names
-        if hasattr(analysis_timing.EyeData[0][0], 'Coder_name'):
-            coder_names = analysis_timing.EyeData[0][0].Coder_name[0]
-            included_coders = analysis_timing.EyeData[0][0].IncludedCoders[0] - 1
-            excluded_coders = np.setxor1d(np.arange(len(coder_names)), included_coders)
+        if summary['coders'] is not None:
+            coder_names = summary['coders']['names']
+            included_coders = summary['coders']['included']
+            excluded_coders = summary['coders']['excluded']
 
             print('Eye tracking reliability')
 
             # Print the included and excluded coders
             print('Included coders:')
             for coder_counter in included_coders:
-                print(coder_names[coder_counter][0])
+                print(coder_names[coder_counter])
 
             print('Excluded coders:')
             for coder_counter in excluded_coders:
-                print(coder_names[coder_counter][0])
+                print(coder_names[coder_counter])
         
-        if hasattr(analysis_timing.EyeData[0][0], 'Reliability') and len(analysis_timing.EyeData[0][0].Reliability) > 0:
-            Reliability = analysis_timing.EyeData[0][0].Reliability[0][0]
-
-            attributes = Reliability.__dir__()
+        if summary['reliability'] is not None:
+            for attribute, Intraframe, Interframe in summary['reliability']:
+                print('\nReliabilty for ' + attribute)
 
-            for attribute in attributes:
-                if attribute[0] is not '_':
-                    print('\nReliabilty for ' + attribute)
+                if (np.isnan(Intraframe[excluded_coders]) == False).sum() == 0:
+                    excluded_str = ' (No excluded accuracies)'
+                else:
+                    excluded_str = ' (excluded score:%0.3f)' % np.nanmean(Intraframe[excluded_coders])
 
-                    Intraframe = getattr(Reliability, attribute)[0][0].Intraframe_all[0]
-                    Interframe = getattr(Reliability, attribute)[0][0].Interframe_all[0]
+                print('Intraframe: %0.3f%s' % (np.nanmean(Intraframe[included_coders]), excluded_str))
 
-                    if (np.isnan(Intraframe[excluded_coders]) == False).sum() == 0:
-                        excluded_str = ' (No excluded accuracies)'
-                    else:
-                        excluded_str = ' (excluded score:%0.3f)' % np.nanmean(Intraframe[excluded_coders])
+                if (np.isnan(Interframe[excluded_coders]) == False).sum() == 0:
+                    excluded_str = ' (No excluded accuracies)'
+                else:
+                    excluded_str = ' (excluded score:%0.3f)' % np.nanmean(Interframe[excluded_coders])
 
-                    print('Intraframe: %0.3f%s' % (np.nanmean(Intraframe[included_coders]), excluded_str))
-
-                    if (np.isnan(Interframe[excluded_coders]) == False).sum() == 0:
-                        excluded_str = ' (No excluded accuracies)'
-                    else:
-                        excluded_str = ' (excluded score:%0.3f)' % np.nanmean(Interframe[excluded_coders])
-
-                    print('Interframe: %0.3f%s' % (np.nanmean(Interframe[included_coders]), excluded_str))
+                print('Interframe: %0.3f%s' % (np.nanmean(Interframe[included_coders]), excluded_str))
         else:
             print('Reliability information not found')
     else:
         print('Couldn''t find a Analysis_Timing file')
         
     # Print all of the figures that are stored in the behavioral folder starting with Experiment_*
-    img_names = glob.glob(behavioral_folder + '*.png')
-    
-    for img_name in img_names:
+    if summary['behavior_mosaic'] is not None:
+        
+        # List the figures in the order they are tiled (left to right, top to bottom)
+        print('\nBehavioral figures:')
+        for img_name in summary['behavior_pngs']:
+            print(img_name[img_name.rfind('/') + 1:])
         
-        # Plot the figure of the image
-        img = mpimg.imread(img_name)
-        plt.figure()
+        # Plot the mosaic of the figures
+        img = read_png(summary['behavior_mosaic'])
+        new_figure(figsize=(10, 10))
         plt.imshow(img)
         plt.axis('off')
-        img_name_clip = img_name[img_name.rfind('/') + 1:]
-        plt.title(img_name_clip)
-        
-    
-        
+
+
+# Recompute the eye tracking reliability from the coded frames as if the coders with excluded_coders in their names
+# were excluded (as well as the ignored coders) and print it like summarise_behavior
+@profiled
+def summarise_coder_reliability(excluded_coders=None, use_cache=True):
+
+    reliability = session_reliability('.', excluded_coders, use_cache)
+    if len(reliability['coder_names']) == 0:
+        print('Eye tracking data not found')
+        return reliability
+
+    coder_names = reliability['coder_names']
+    subset = reliability['subset']
+    print('Coders compared:')
+    for coder_counter in np.where(subset)[0]:
+        print(coder_names[coder_counter])
+
+    print('Coders that would be included:')
+    for coder_counter in np.where(reliability['included'])[0]:
+        print(coder_names[coder_counter])
+
+    for experiment_counter, experiment in enumerate(reliability['experiments']):
+        print('\nReliability for ' + experiment)
+        for name, values in [('Intraframe', reliability['intraframe'][experiment_counter]), ('Interframe', reliability['interframe'][experiment_counter])]:
+            if np.isnan(values[~subset]).all():
+                excluded_str = ' (No excluded accuracies)'
+            else:
+                excluded_str = ' (excluded score:%0.3f)' % np.nanmean(values[~subset])
+            print('%s: %0.3f%s' % (name, np.nanmean(values[subset]), excluded_str))
+
+    return reliability
+
+
 # Summarise the secondlevel data        
-def summarise_secondlevel():
-        
-    
+@profiled
+def summarise_secondlevel(use_cache=True):
+    return plot_secondlevel(describe_secondlevel(use_cache))
 
-    reg_folder = 'analysis/secondlevel/registration_ANTs/'    
-    if os.path.isdir(reg_folder):
 
-        print('Using ANTs directory')
-        highres_file = reg_folder + 'highres2standard.nii.gz'
-        standard_file = None # Get this from the automatic directory
+# Print the secondlevel summary, plot the scan time and return an interactive view of the registration to standard
+@profiled
+def plot_secondlevel(summary):
 
+    import matplotlib.pyplot as plt
+    
+    if summary['registration'] == 'ANTs':
+        print('Using ANTs directory')
     else:
         print('!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!\n\nANTs directory not found, looking for manual registration\n\n!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!')
 
-        reg_folder = 'analysis/secondlevel/registration.feat/'
-        highres_file = reg_folder + 'reg/highres2standard.nii.gz'
-        standard_file = reg_folder + 'reg/standard.nii.gz'
-
-        manual_reg_folder=reg_folder+'reg/Manual_Reg_Standard/'
-	    
-        if os.path.isdir(manual_reg_folder):
+        if summary['manual_reg']:
             print('Manual registration to standard has been performed')
         else:
             print('!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!\n\nCheck that you manually aligned HighRes to Standard\n\n!#!#!#!#!#!#!#!\n!#!#!#!#!#!#!#!\n')
     
+    highres_file = summary['highres_file']
+    standard_file = summary['standard_file']
+    
     # Load the files
-    if os.path.isfile(highres_file):
+    if summary['highres_exists']:
         
         # Load the images
+        import nilearn.plotting as plotting
         highres = nibabel.load(highres_file)
         if standard_file is not None:
             standard = nibabel.load(standard_file)
         
             # Show the interactive viewer for standard and highres
-            fig=plotting.view_img(highres, bg_img=standard, opacity=0.4)
+            with profile_stage('view_img'):
+                fig=plotting.view_img(highres, bg_img=standard, opacity=0.4)
         else:
-            fig=plotting.view_img(highres, opacity=0.4)
+            with profile_stage('view_img'):
+                fig=plotting.view_img(highres, opacity=0.4)
         
     else:
         # Set to nothing
         fig=[]
         print('%s doesn''t exist' % highres_file)
         
-    # Check the secondlevel experiment folders that exist
-    experiment_folders = glob.glob('analysis/secondlevel_*')    
-    
-    for experiment_folder in experiment_folders:
+    # Report the blocks in the secondlevel experiment folders that exist
+    for experiment_folder, blocks in summary['experiments']:
         
         print('Found %s' % experiment_folder)
         
-        timing_files = glob.glob(experiment_folder + '/default/Timing/*_Only.txt')
-        
-        for timing_file in timing_files:
-            timing_mat = np.loadtxt(timing_file)
-            
-            if len(timing_mat.shape) == 1:
-                timing_mat = timing_mat.reshape((1, 3))
-                
-            print('%s has %d included blocks and %d excluded blocks' % (timing_file, np.sum(timing_mat[:,2] == 1), np.sum(timing_mat[:,2] == 0)))
+        for timing_file, included_num, excluded_num in blocks:
+            print('%s has %d included blocks and %d excluded blocks' % (timing_file, included_num, excluded_num))
     
-    # Load the ScanTimeAnalysis data for this participant
-    stacked_data_name = 'analysis/Behavioral/ppt_stacked_data.mat'
-    if os.path.isfile(stacked_data_name):
+    # Plot the ScanTimeAnalysis data for this participant
+    if summary['stacked_data'] is not None:
         
-        if os.path.exists('analysis/secondlevel/FunctionalSplitter_Log') == False or os.path.getmtime('analysis/secondlevel/FunctionalSplitter_Log') > os.path.getmtime('analysis/Behavioral/ppt_stacked_data.mat'):
+        if summary['stacked_data']['out_of_date']:
             print('\n\n***********\n\n**WARNING**:\n\n***********\n\nThis graph relies on an output from ~/scripts/ScanTimeAnalysis.m and from a quick check it looks like this wasn''t run recently. This means this graph might be out of date. You should run that script again with this participant included in order to generate a new ''analysis/Behavioral/ppt_stacked_data.mat'' file for this participant\n\n***********\n')
-    
         
-        # Load the matlab file
-        stacked_data_all = loadmat(stacked_data_name)
-        
-        # Pull out the data
-        stacked_labels = []
-        stacked_data = []
-        for category_counter in range(len(stacked_data_all['ppt_stacked_data'][0])):
-            stacked_labels.append(stacked_data_all['stacked_labels'][0][category_counter][0])
-            stacked_data.append(stacked_data_all['ppt_stacked_data'][0][category_counter])
+        stacked_labels = summary['stacked_data']['labels']
+        stacked_data = summary['stacked_data']['data']
 
         # Plot the figure
-        plt.figure()
+        new_figure()
         plt.bar(range(len(stacked_data)), stacked_data)
         plt.ylabel('Minutes')
         plt.xticks(np.arange(len(stacked_data)), stacked_labels, rotation=15)
         print(stacked_labels)
     else:
-        print('%s doesn''t exist' % stacked_data_name)
+        print('%s doesn''t exist' % summary['stacked_data_name'])
             
 
-    print('\n\nReturning an interactive view of the registration from high res to standard for double-checking. If you want to do this for any of the functional to highres registrations, run this block of code (substitute func_run): \n\nimport nibabel as nib \nfrom nilearn import image \nfunc_run="01a" #which functional? \nfunc=nib.load("analysis/firstlevel/functional%s.feat/reg/example_func.nii.gz" % func_run)\nhighres=nib.load("analysis/firstlevel/functional%s.feat/reg/highres2example_func.nii.gz" % func_run) \nplotting.view_img(func,bg_img=highres,opacity=0.4)')
+    print('\n\nReturning an interactive view of the registration from high res to standard for double-checking. If you want to do this for any of the functional to highres registrations, run this block of code (substitute func_run): \n\nimport nibabel as nib \nfrom nilearn import plotting \nfunc_run="01a" #which functional? \nfunc=nib.load("analysis/firstlevel/functional%s.feat/reg/example_func.nii.gz" % func_run)\nhighres=nib.load("analysis/firstlevel/functional%s.feat/reg/highres2example_func.nii.gz" % func_run) \nplotting.view_img(func,bg_img=highres,opacity=0.4)')
           
     return fig
 
+
+# Decode a PNG for plotting
+def read_png(png_file):
+
+    import matplotlib.image as mpimg
+
+    with profile_stage('read_png'):
+        return mpimg.imread(png_file)
+
+
+# Make a new figure at FIGURE_DPI
+def new_figure(**kwargs):
+
+    import matplotlib.pyplot as plt
+
+    return plt.figure(dpi=FIGURE_DPI, **kwargs)
+
+
+# Overlay the top slice in red on the bottom slice in gray (the top slice should be scaled between 0 and 1)
 def overlay_slices(bottom_slice, top_slice):
-    
-    # Add an alpha layer for the second slice
-    temp_slice = np.zeros((top_slice.shape[0], top_slice.shape[1], 4))
-    temp_slice[:, :, 3] = 0.5
-    temp_slice[:, :, 0] = top_slice # Put in each layer
 
+    import matplotlib.pyplot as plt
+    
     # Plot slices through the midline overlaying the mask
-    plt.imshow(np.rot90(bottom_slice), cmap='gray')
-    plt.axis('off')
-    plt.imshow(np.rot90(temp_slice))
+    plt.imshow(np.rot90(blend_planes(normalise_planes(bottom_slice), top_slice)))
     plt.axis('off')
     plt.show()
-    
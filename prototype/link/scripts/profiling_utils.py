@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+## Record how long each stage of the participant summary takes and what it reads
+# When profiling is enabled, every stage (a function decorated with @profiled, or a block in a profile_stage context)
+# appends a JSON line to the profile file with its wall and CPU time, the bytes read by the process, the peak memory
+# allocated (tracked with tracemalloc, which includes numpy arrays), the maximum resident memory of the process and how
+# many files were opened and globs were run. Stages can be nested and each record lists the stages it was called from.
+# Profiling is off unless enable_profiling is called or the SUMMARY_PROFILE environment variable is set to the file to
+# write to (so workers started by ProcessPoolExecutor inherit it), and when it is off the decorated functions are
+# called directly.
+#
+# The profiles of many participants (or many profile files) can be combined per stage:
+# python $PROJ_DIR/prototype/link/scripts/profiling_utils.py subjects/*/analysis/summary_profile.jsonl
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import functools
+import tracemalloc
+import numpy as np
+
+# The environment variable that enables profiling
+PROFILE_ENV = 'SUMMARY_PROFILE'
+
+# Where to write the profile if the environment variable is set without a file name
+DEFAULT_PROFILE_FILE = 'analysis/summary_profile.jsonl'
+
+# The stages currently running in this process, innermost last
+_stage_stack = []
+
+# Counts of the files opened and globs run by this process (only counted once profiling is enabled)
+_counts = {'files_opened': 0, 'globs': 0}
+_audit_hook_installed = False
+
+# Files opened to make the measurements, which aren't counted
+_ignored_files = {'/proc/self/io'}
+
+# Which file is the profile being written to (None if profiling is off)
+def profile_file():
+
+    file_name = os.environ.get(PROFILE_ENV)
+    if file_name is None or file_name in ['', '0']:
+        return None
+
+    return DEFAULT_PROFILE_FILE if file_name == '1' else file_name
+
+
+# Count the files opened and the globs run (audit hooks can't be removed so this checks whether profiling is on)
+def _audit_hook(event, args):
+
+    if len(_stage_stack) == 0:
+        return
+
+    if event == 'open' and args[0] not in _ignored_files:
+        _counts['files_opened'] += 1
+    elif event == 'glob.glob':
+        _counts['globs'] += 1
+
+
+# Turn profiling on for this process and any workers it starts, appending the records to file_name
+def enable_profiling(file_name=DEFAULT_PROFILE_FILE):
+
+    os.environ[PROFILE_ENV] = os.path.abspath(file_name)
+
+
+# Turn profiling off
+def disable_profiling():
+
+    os.environ.pop(PROFILE_ENV, None)
+    if tracemalloc.is_tracing() and len(_stage_stack) == 0:
+        tracemalloc.stop()
+
+
+# How many bytes has this process read (from /proc/self/io, so None if that isn't available). This includes reads
+# that were served by the page cache
+def bytes_read():
+
+    try:
+        with open('/proc/self/io') as fid:
+            for line in fid:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+# The peak resident memory of this process in bytes
+def max_rss():
+
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+# Write a record as a line of JSON. Lines are written with a single append so that processes can share the file
+def write_record(record, file_name):
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    line = json.dumps(record, default=str) + '\n'
+    with open(file_name, 'a') as fid:
+        fid.write(line)
+
+
+# Context manager that records a stage if profiling is enabled. Labels (e.g. func_run) are stored with the record
+class profile_stage:
+
+    def __init__(self, stage, **labels):
+        self.stage = stage
+        self.labels = labels
+        self.file_name = None
+
+    def __enter__(self):
+        global _audit_hook_installed
+
+        self.file_name = profile_file()
+        if self.file_name is None:
+            return self
+
+        if not _audit_hook_installed:
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+        _ignored_files.add(self.file_name)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        # Keep the peak of the enclosing stage before resetting it for this one
+        if len(_stage_stack) > 0:
+            _stage_stack[-1]['peak_memory'] = max(_stage_stack[-1]['peak_memory'], tracemalloc.get_traced_memory()[1])
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        self.start = {'stage': self.stage,
+                      'time': time.time(),
+                      'wall': time.perf_counter(),
+                      'cpu': time.process_time(),
+                      'bytes_read': bytes_read(),
+                      'counts': dict(_counts),
+                      'peak_memory': 0,
+                      'base_memory': tracemalloc.get_traced_memory()[0],
+                      }
+        _stage_stack.append(self.start)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.file_name is None:
+            return False
+
+        _stage_stack.pop()
+        end_bytes_read = bytes_read()
+        peak_memory = max(self.start['peak_memory'], tracemalloc.get_traced_memory()[1])
+
+        record = {'stage': self.stage,
+                  'parents': [parent['stage'] for parent in _stage_stack],
+                  'labels': self.labels,
+                  'subject': os.path.basename(os.getcwd()),
+                  'host': socket.gethostname(),
+                  'pid': os.getpid(),
+                  'start_time': self.start['time'],
+                  'wall_time': time.perf_counter() - self.start['wall'],
+                  'cpu_time': time.process_time() - self.start['cpu'],
+                  'bytes_read': None if end_bytes_read is None or self.start['bytes_read'] is None else end_bytes_read - self.start['bytes_read'],
+                  'peak_memory': max(peak_memory - self.start['base_memory'], 0),
+                  'max_rss': max_rss(),
+                  'files_opened': _counts['files_opened'] - self.start['counts']['files_opened'],
+                  'globs': _counts['globs'] - self.start['counts']['globs'],
+                  'error': None if exc_type is None else exc_type.__name__,
+                  }
+        write_record(record, self.file_name)
+
+        # The enclosing stage's peak includes this one
+        if len(_stage_stack) > 0:
+            _stage_stack[-1]['peak_memory'] = max(_stage_stack[-1]['peak_memory'], peak_memory)
+
+        return False
+
+
+# Decorator that records every call of a function as a stage (named after the function). The values of any arguments
+# listed in labels (e.g. func_run) are stored with the record
+def profiled(func=None, labels=('func_run', 'use_cache')):
+
+    if func is None:
+        return functools.partial(profiled, labels=labels)
+
+    arg_names = func.__code__.co_varnames[:func.__code__.co_argcount]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        if profile_file() is None:
+            return func(*args, **kwargs)
+
+        values = dict(zip(arg_names, args))
+        values.update(kwargs)
+        stage_labels = {label: values[label] for label in labels if label in values}
+
+        with profile_stage(func.__name__, **stage_labels):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+# Load the records from one or more profile files
+def load_profile(file_names):
+
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    records = []
+    for file_name in file_names:
+        with open(file_name) as fid:
+            records += [json.loads(line) for line in fid if line.strip() != '']
+
+    return records
+
+
+# Summarise the records of each stage: how often it ran and the total, median and maximum of each measure. A stage
+# that is nested in itself (e.g. a cached summary calling itself to compute a cache miss) is only counted once
+def aggregate_profile(records):
+
+    stages = {}
+    for record in records:
+        if record['stage'] not in record['parents']:
+            stages.setdefault(record['stage'], []).append(record)
+
+    summary = {}
+    for stage, stage_records in stages.items():
+        summary[stage] = {'calls': len(stage_records), 'subjects': len(set(record['subject'] for record in stage_records))}
+        for measure in ['wall_time', 'cpu_time', 'bytes_read', 'peak_memory', 'files_opened', 'globs']:
+            values = np.array([record[measure] for record in stage_records if record[measure] is not None], dtype=float)
+            summary[stage][measure + '_total'] = values.sum() if len(values) > 0 else np.nan
+            summary[stage][measure + '_median'] = np.median(values) if len(values) > 0 else np.nan
+            summary[stage][measure + '_max'] = values.max() if len(values) > 0 else np.nan
+
+    return summary
+
+
+# Print the aggregate with the slowest stages first
+def print_profile(summary):
+
+    print('%-28s %6s %10s %10s %10s %12s %12s %8s %6s' % ('stage', 'calls', 'total (s)', 'median (s)', 'max (s)', 'read (MB)', 'peak (MB)', 'files', 'globs'))
+    for stage, stage_summary in sorted(summary.items(), key=lambda item: -item[1]['wall_time_total']):
+        print('%-28s %6d %10.2f %10.3f %10.3f %12.1f %12.1f %8d %6d' % (stage, stage_summary['calls'],
+                                                                         stage_summary['wall_time_total'],
+                                                                         stage_summary['wall_time_median'],
+                                                                         stage_summary['wall_time_max'],
+                                                                         np.nan_to_num(stage_summary['bytes_read_total']) / 1024 ** 2,
+                                                                         np.nan_to_num(stage_summary['peak_memory_max']) / 1024 ** 2,
+                                                                         stage_summary['files_opened_total'],
+                                                                         stage_summary['globs_total']))
+
+
+if __name__ == '__main__':
+    print_profile(aggregate_profile(load_profile(sys.argv[1:])))
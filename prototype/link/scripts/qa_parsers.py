@@ -0,0 +1,148 @@
+## Parse the QA XML files made by BXH XCEDE and the logs written by FEAT/MELODIC
+# The QA files (data/qa/qa_events_*_functional??.bxh.xml) are read with iterparse so that each element is discarded
+# once it has been read, and all of the metrics (the <value name="..."> elements) in the file are kept rather than just
+# the SNR and SFNR. Log files are scanned line by line without reading the whole file in.
+
+import os
+import collections
+import numpy as np
+import concurrent.futures
+import xml.etree.ElementTree as ElementTree
+
+# The metrics in a QA file. metrics maps the metric name (e.g. mean_sfnr_middle_slice) to its value, which is a float
+# where possible and otherwise the text. Metrics that appear more than once (e.g. one per event) are an array of
+# every value in the order they appear (or a list if any of them aren't numbers)
+QARecord = collections.namedtuple('QARecord', ['file_name', 'func_run', 'metrics'])
+
+# Turn the text of a value into a number if possible
+def parse_value(text):
+
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+# Pull the run name out of a QA file name (e.g. qa_events_XXX_functional01.bxh.xml gives 01)
+def qa_func_run(file_name):
+
+    base_name = os.path.basename(file_name)
+    start_idx = base_name.rfind('functional')
+    if start_idx == -1:
+        return None
+
+    return base_name[start_idx + 10:base_name.find('.', start_idx)]
+
+
+# Collect the values of each metric into a scalar if it appears once, or an array (or list) if it appears more
+def collect_metrics(values):
+
+    metrics = collections.OrderedDict()
+    for name, metric_values in values.items():
+        if len(metric_values) == 1:
+            metrics[name] = metric_values[0]
+        elif all(isinstance(value, float) for value in metric_values):
+            metrics[name] = np.array(metric_values)
+        else:
+            metrics[name] = metric_values
+
+    return metrics
+
+
+# Read every metric out of a QA file. Metrics are the text of the value elements, named by their name attribute (e.g.
+# <value name="mean_snr_middle_slice">). The other elements (e.g. the onset and duration of each event) are skipped.
+# The root is cleared after each element so that the elements that have been read are freed
+def parse_qa_xml(file_name):
+
+    values = collections.OrderedDict()
+
+    try:
+        root = None
+        for event, element in ElementTree.iterparse(file_name, events=('start', 'end')):
+
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+
+            # Only the value elements are metrics (removing any namespace from the tag)
+            name = element.get('name')
+            if element.tag.rsplit('}', 1)[-1] == 'value' and name is not None and element.text is not None and element.text.strip() != '':
+                values.setdefault(name, []).append(parse_value(element.text))
+
+            # Free the elements now that they have been read (clearing the element alone leaves it attached to its parent)
+            root.clear()
+
+    except ElementTree.ParseError:
+        # Fall back to the line by line search if the file isn't valid XML
+        values = parse_qa_lines(file_name)
+
+    return QARecord(file_name, qa_func_run(file_name), collect_metrics(values))
+
+
+# Search each line of the QA file for a value element with a name attribute and take the text between the first > and
+# </. Returns a list of the values of each metric
+def parse_qa_lines(file_name):
+
+    values = collections.OrderedDict()
+
+    with open(file_name, 'r') as fid:
+        for line in fid:
+            name_idx = line.find('name="')
+            if line.find('<value') > -1 and name_idx > -1 and line.find('</') > -1:
+                name = line[name_idx + 6:line.find('"', name_idx + 6)]
+                values.setdefault(name, []).append(parse_value(line[line.find('>') + 1:line.find('</')]))
+
+    return values
+
+
+# The first value of a metric (which is what QA_extract in Participant_Index.m reads), or None if it isn't in the file
+def first_metric(metrics, name):
+
+    value = metrics.get(name)
+    if isinstance(value, (np.ndarray, list)):
+        return value[0]
+
+    return value
+
+
+# Parse many QA files in parallel, returning the records in the same order as file_names
+def parse_qa_files(file_names, workers=None):
+
+    # participant_summary_core imports this module, so its helper is imported here rather than at the top
+    if workers is None:
+        from participant_summary_core import default_workers
+        workers = default_workers()
+
+    if workers <= 1 or len(file_names) <= 1:
+        return [parse_qa_xml(file_name) for file_name in file_names]
+
+    # The files are small so send them to the workers in batches
+    chunksize = max(1, len(file_names) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_qa_xml, file_names, chunksize=chunksize))
+
+
+# Scan a log file for lines containing each of the keys, returning the rest of the line after the key. If a key
+# appears on multiple lines then the last one is kept, if it doesn't appear then it is None
+def scan_log(file_name, keys):
+
+    values = dict((key, None) for key in keys)
+
+    with open(file_name, 'r') as fid:
+        for line in fid:
+            for key in keys:
+                key_idx = line.find(key)
+                if key_idx > -1:
+                    values[key] = line[key_idx + len(key):].rstrip('\n')
+
+    return values
+
+
+# Which components were regressed out according to the feat_ICA-*.out log (empty if it isn't reported)
+def parse_melodic_log(file_name):
+
+    excluded_components = scan_log(file_name, ['Components='])['Components=']
+
+    return '' if excluded_components is None else excluded_components
@@ -0,0 +1,215 @@
+## Compute the intraframe and interframe reliability of eye tracking coders
+# This is a python version of the reliability part of EyeTracking_Reliability.m that works from the raw codes of each
+# frame (EyeData.Aggregate) rather than the Intraframe_all/Interframe_all that MATLAB stored. For every trial, the
+# agreement between every pair of coders is counted once, as a coder x coder matrix for the same frame (intraframe)
+# and for the next frame (interframe). These matrices are cached per session (in analysis/summary_cache/) so the
+# reliability of any subset of coders is just a weighted average of them, which is computed for many subsets at once.
+# This means the effect of excluding a coder can be seen without rerunning MATLAB.
+#
+# As in EyeTracking_Reliability.m:
+#   Intraframe: for pairs of coders in the same condition, the proportion of frames they both coded that match
+#   Interframe: the proportion of frames where a coder's code matches another coder's code of the next frame
+# Each coder's reliability is the average of their comparisons with the other coders in the subset (for each trial and
+# then across trials). Unlike MATLAB, coders outside the subset are also compared with the coders in the subset, so
+# you can see how an excluded coder compares. The accuracy checks on EyeTrackerCalib and PosnerCuing aren't included.
+
+import os
+import numpy as np
+from summary_cache import cached_summary, CACHE_DIR
+from mat_utils import load_fields
+
+# Coders with these strings in their name are ignored by default (as in EyeTracking_Reliability.m)
+IGNORED_CODERS = ['NC', 'JO', 'Pilot']
+
+# Coders with an intraframe or interframe reliability below this are excluded
+RELIABILITY_THRESHOLD = 0.25
+
+# Increase this whenever the contents of the agreement matrices change so that old cached versions aren't used
+RELIABILITY_VERSION = 1
+
+# Which coders have any of these strings in their name (after 'Coder_', as in EyeTracking_Reliability.m)
+def match_coders(coder_names, strings):
+
+    matched = np.zeros(len(coder_names), dtype=bool)
+    for coder_counter, coder_name in enumerate(coder_names):
+        coder_name = coder_name[coder_name.find('Coder_'):] if 'Coder_' in coder_name else coder_name
+        matched[coder_counter] = any(string in coder_name for string in strings)
+
+    return matched
+
+
+# Load the raw eye tracking codes of a session. EyeData.mat is used if it exists, otherwise the EyeData stored in
+# AnalysedData.mat. Returns None if neither exist
+def load_eye_data(session_dir='.'):
+
+    behavioral_folder = os.path.join(session_dir, 'analysis/Behavioral/')
+    eye_file = behavioral_folder + 'EyeData.mat'
+    prefix = 'EyeData.'
+    if not os.path.isfile(eye_file):
+        eye_file = behavioral_folder + 'AnalysedData.mat'
+        prefix = 'AnalysedData.EyeData.'
+        if not os.path.isfile(eye_file):
+            return None
+
+    # The raw codes are big so they aren't cached (the agreement matrices are)
+    fields = load_fields(eye_file, [prefix + field for field in ['Coder_name', 'Coder_ConditionList', 'Aggregate', 'Timing']], use_cache=False)
+    if fields[prefix + 'Coder_name'] is None or fields[prefix + 'Aggregate'] is None:
+        return None
+
+    # Single elements are squeezed when loaded so make them lists again
+    coder_names = fields[prefix + 'Coder_name']
+    coder_names = [coder_names] if isinstance(coder_names, str) else coder_names
+    coder_num = len(coder_names)
+    timing = fields[prefix + 'Timing'] if fields[prefix + 'Timing'] is not None else {}
+
+    trials = {}
+    for experiment, experiment_trials in fields[prefix + 'Aggregate'].items():
+        experiment_trials = experiment_trials if isinstance(experiment_trials, list) else [experiment_trials]
+        experiment_timing = timing.get(experiment, [None] * len(experiment_trials))
+        experiment_timing = experiment_timing if isinstance(experiment_timing, list) else [experiment_timing]
+
+        # Trials without timing weren't eye tracked
+        trials[experiment] = []
+        for trial_counter, trial in enumerate(experiment_trials):
+            trial = np.asarray(trial, dtype=np.float64)
+            if trial.size == 0 or (trial_counter < len(experiment_timing) and np.size(experiment_timing[trial_counter]) == 0):
+                continue
+            trials[experiment].append(trial.reshape(coder_num, -1))
+
+    return {'coder_names': list(coder_names),
+            'conditions': np.atleast_1d(fields[prefix + 'Coder_ConditionList']).astype(int),
+            'trials': trials,
+            'eye_file': eye_file,
+            }
+
+
+# Count how often every pair of coders agree for each trial. Trials are coder x frame arrays of codes (NaN where not
+# coded). Returns trial x coder x coder arrays: the number of frames both coders coded the same (intraframe) or where
+# the first coder's code matches the second coder's code of the next frame (interframe), and how many frames were
+# compared
+def trial_agreement(trials, coder_num):
+
+    trial_num = len(trials)
+    frame_num = max([trial.shape[1] for trial in trials], default=0)
+
+    # Stack the trials, padding the end with frames that weren't coded
+    codes = np.full((trial_num, coder_num, frame_num), np.nan)
+    for trial_counter, trial in enumerate(trials):
+        codes[trial_counter, :, :trial.shape[1]] = trial
+
+    coded = (~np.isnan(codes)).astype(np.float32)
+    agreement = {'intra_match': np.zeros((trial_num, coder_num, coder_num), dtype=np.float32),
+                 'inter_match': np.zeros((trial_num, coder_num, coder_num), dtype=np.float32),
+                 'intra_count': coded @ coded.transpose(0, 2, 1),
+                 'inter_count': coded[:, :, :-1] @ coded[:, :, 1:].transpose(0, 2, 1),
+                 }
+
+    # Matches are counted for each code separately, comparing all pairs of coders at once
+    for code in np.unique(codes[~np.isnan(codes)]):
+        is_code = (codes == code).astype(np.float32)
+        agreement['intra_match'] += is_code @ is_code.transpose(0, 2, 1)
+        agreement['inter_match'] += is_code[:, :, :-1] @ is_code[:, :, 1:].transpose(0, 2, 1)
+
+    return agreement
+
+
+# Compute the agreement matrices of every experiment for a session, caching them unless use_cache is False
+def session_agreement(session_dir='.', use_cache=True):
+
+    if use_cache:
+        key = ('session_agreement', RELIABILITY_VERSION, os.path.abspath(session_dir))
+        return cached_summary(key, lambda: session_agreement(session_dir, False), os.path.join(session_dir, CACHE_DIR))
+
+    eye_data = load_eye_data(session_dir)
+    behavioral_folder = os.path.join(session_dir, 'analysis/Behavioral/')
+    sources = [behavioral_folder, behavioral_folder + 'EyeData.mat', behavioral_folder + 'AnalysedData.mat']
+    if eye_data is None:
+        return {'coder_names': [], 'conditions': np.zeros(0, dtype=int), 'experiments': {}, 'sources': sources}
+
+    coder_num = len(eye_data['coder_names'])
+    experiments = {experiment: trial_agreement(trials, coder_num) for experiment, trials in eye_data['trials'].items() if len(trials) > 0}
+
+    return {'coder_names': eye_data['coder_names'], 'conditions': eye_data['conditions'], 'experiments': experiments, 'sources': sources}
+
+
+# Every subset of coders as a subset x coder boolean array
+def all_subsets(coder_num):
+    return ((np.arange(2 ** coder_num)[:, np.newaxis] >> np.arange(coder_num)) & 1).astype(bool)
+
+
+# Average the agreement of each coder with the coders of each subset (the rows of a subset x coder boolean array). The
+# comparisons that are allowed are in a coder x coder array. Returns a subset x coder array
+def subset_average(match, count, subsets, comparisons):
+
+    # The agreement of each comparison, and whether there were any frames to compare
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(count > 0, match / count, 0) * comparisons
+    compared = (count > 0) * comparisons
+
+    # Average within trial and then across trials, ignoring trials without comparisons
+    subsets = subsets.astype(np.float32)
+    total = np.einsum('tcj,sj->stc', rate, subsets)
+    comparison_num = np.einsum('tcj,sj->stc', compared, subsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return nan_average(total / comparison_num, 1)
+
+
+# Compute the intraframe and interframe reliability of each coder for each subset of coders (a boolean array of subsets
+# x coders, or a single subset). Returns the experiments and subset x experiment x coder arrays of reliability
+def subset_reliability(agreement, subsets):
+
+    coder_num = len(agreement['coder_names'])
+    subsets = np.atleast_2d(np.asarray(subsets, dtype=bool))
+    experiments = sorted(agreement['experiments'])
+
+    # Intraframe pairs must be different coders in the same condition, whereas interframe can be any pair
+    conditions = agreement['conditions']
+    intra_pairs = (conditions[:, np.newaxis] == conditions[np.newaxis, :]) & ~np.eye(coder_num, dtype=bool)
+    inter_pairs = np.ones((coder_num, coder_num), dtype=bool)
+
+    intraframe = np.full((len(subsets), len(experiments), coder_num), np.nan)
+    interframe = np.full((len(subsets), len(experiments), coder_num), np.nan)
+    for experiment_counter, experiment in enumerate(experiments):
+        experiment_agreement = agreement['experiments'][experiment]
+        intraframe[:, experiment_counter] = subset_average(experiment_agreement['intra_match'], experiment_agreement['intra_count'], subsets, intra_pairs)
+        interframe[:, experiment_counter] = subset_average(experiment_agreement['inter_match'], experiment_agreement['inter_count'], subsets, inter_pairs)
+
+    return {'experiments': experiments, 'intraframe': intraframe, 'interframe': interframe}
+
+
+# Average ignoring NaNs, returning NaN (without a warning) where there are no values
+def nan_average(values, axis):
+
+    valid = ~np.isnan(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, values, 0).sum(axis) / valid.sum(axis)
+
+
+# Which coders pass the reliability threshold. Like EyeTracking_Reliability.m, the reliability is averaged across
+# experiments (the second last dimension) and coders without any comparisons pass
+def passes_threshold(intraframe, interframe, threshold=RELIABILITY_THRESHOLD):
+
+    with np.errstate(invalid='ignore'):
+        return ~((nan_average(intraframe, -2) < threshold) | (nan_average(interframe, -2) < threshold))
+
+
+# Compute the reliability of a session's coders if the ignored coders and any coders with excluded_coders in their
+# name are excluded. Returns a dictionary with the reliability of each coder (experiment x coder arrays) and which
+# coders would be included
+def session_reliability(session_dir='.', excluded_coders=None, use_cache=True):
+
+    agreement = session_agreement(session_dir, use_cache)
+    coder_names = agreement['coder_names']
+
+    subset = ~match_coders(coder_names, IGNORED_CODERS + list(excluded_coders or []))
+    reliability = subset_reliability(agreement, subset)
+    intraframe = reliability['intraframe'][0]
+    interframe = reliability['interframe'][0]
+
+    return {'coder_names': coder_names,
+            'experiments': reliability['experiments'],
+            'subset': subset,
+            'intraframe': intraframe,
+            'interframe': interframe,
+            'included': subset & passes_threshold(intraframe, interframe),
+            }
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+## Render the participant summary to a static HTML report without a notebook
+# This runs the same functions as participant_summary.ipynb but with the non-interactive Agg backend. The text each
+# function prints is kept and every figure it makes is saved to a PNG (and then closed so memory doesn't build up).
+# Everything is then put in a single self-contained HTML file (the images are embedded), by default:
+# analysis/summary_report/participant_summary.html
+#
+# Run this from the subject directory. Example command:
+# python scripts/render_report.py
+#
+# To plot the time courses of other voxels than EXAMPLE_VOXEL (e.g. if the volume is smaller) give their coordinates or
+# a mask, as with summarise_firstlevel:
+# python scripts/render_report.py --voxels 8,8,4 10,8,4
+# python scripts/render_report.py --mask analysis/firstlevel/functional01.feat/mask.nii.gz
+#
+# If a section can't be summarised or plotted (e.g. a run is missing a file) the error is shown in its place and the
+# rest of the report is still rendered.
+#
+# Or submit it to the cluster with `sbatch scripts/run_render_report.sh`. To render the reports of all participants
+# use `./scripts/command_all.sh sbatch scripts/run_render_report.sh` from the project directory
+
+import matplotlib
+matplotlib.use('Agg')
+
+import os
+import io
+import sys
+import html
+import base64
+import argparse
+import warnings
+import contextlib
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from participant_summary_utils import summarise_participant, SectionError, describe_section, plot_descriptives, plot_firstlevel, plot_univariate, describe_sfnr_profiles, plot_sfnr_profiles, describe_behavior, plot_behavior, describe_secondlevel, plot_secondlevel
+
+REPORT_DIR = 'analysis/summary_report/'
+
+# Run a plotting function, keeping what it prints and saving the figures it makes. If the summary couldn't be made, or
+# plotting it fails, the error is added to the text. Returns the section as a dictionary
+def render_section(title, section_name, output_dir, plot_function, summary):
+
+    text = io.StringIO()
+    output = None
+    if isinstance(summary, SectionError):
+        text.write('Could not summarise this section: %s\n' % summary.message)
+    else:
+        try:
+            with contextlib.redirect_stdout(text), warnings.catch_warnings():
+                # Agg can't show figures, which the plotting functions try to do
+                warnings.simplefilter('ignore', UserWarning)
+                output = plot_function(summary)
+        except Exception as err:
+            text.write('Could not plot this section: %s: %s\n' % (type(err).__name__, err))
+
+    # Save and close every figure that was made
+    figure_files = []
+    for figure_counter, figure_num in enumerate(plt.get_fignums()):
+        figure_file = os.path.join(output_dir, '%s_%02d.png' % (section_name, figure_counter))
+        plt.figure(figure_num).savefig(figure_file, bbox_inches='tight')
+        figure_files.append(figure_file)
+    plt.close('all')
+
+    # Interactive nilearn viewers can be embedded as they are
+    viewer_html = output.get_iframe() if hasattr(output, 'get_iframe') else None
+
+    return {'title': title, 'text': text.getvalue(), 'figures': figure_files, 'viewer': viewer_html}
+
+
+# Make the HTML for a section, embedding the figures so that the report is a single file
+def section_html(section):
+
+    lines = ['<h2>%s</h2>' % html.escape(section['title'])]
+
+    if section['text'].strip():
+        lines.append('<pre>%s</pre>' % html.escape(section['text']))
+
+    for figure_file in section['figures']:
+        with open(figure_file, 'rb') as fid:
+            encoded = base64.b64encode(fid.read()).decode('ascii')
+        lines.append('<img src="data:image/png;base64,%s" alt="%s">' % (encoded, html.escape(os.path.basename(figure_file))))
+
+    if section['viewer'] is not None:
+        lines.append(section['viewer'])
+
+    return '\n'.join(lines)
+
+
+# Render the whole participant summary. The run summaries are computed in parallel (see summarise_participant), with
+# the error of any section that fails kept in its place, and then plotted one run at a time. voxels and mask choose the
+# time courses that are plotted (see summarise_firstlevel). Returns the name of the HTML file
+def render_report(output_dir=REPORT_DIR, workers=None, use_cache=True, voxels=None, mask=None):
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Remove figures from previous reports so that old runs don't linger
+    for old_file in os.listdir(output_dir):
+        if old_file.endswith('.png'):
+            os.remove(os.path.join(output_dir, old_file))
+
+    subject = os.path.basename(os.getcwd())
+    html_sections = []
+
+    for result in summarise_participant(workers=workers, voxels=voxels, mask=mask, use_cache=use_cache, catch_errors=True):
+        func_run = result['func_run']
+        for title, plot_function, summary in [('functional%s descriptives' % func_run, plot_descriptives, result['descriptives']),
+                                              ('functional%s firstlevel' % func_run, plot_firstlevel, result['firstlevel']),
+                                              ('functional%s univariate' % func_run, plot_univariate, result['univariate'])]:
+            section_name = title.replace(' ', '_')
+            html_sections.append(section_html(render_section(title, section_name, output_dir, plot_function, summary)))
+
+    html_sections.append(section_html(render_section('SFNR profiles', 'sfnr_profiles', output_dir, plot_sfnr_profiles, describe_section(describe_sfnr_profiles, use_cache))))
+    html_sections.append(section_html(render_section('Summary across runs', 'behavior', output_dir, plot_behavior, describe_section(describe_behavior, use_cache))))
+    html_sections.append(section_html(render_section('Secondlevel', 'secondlevel', output_dir, plot_secondlevel, describe_section(describe_secondlevel, use_cache))))
+
+    report_file = os.path.join(output_dir, 'participant_summary.html')
+    with open(report_file, 'w') as fid:
+        fid.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>Participant summary: %s</title>\n' % html.escape(subject))
+        fid.write('<style>body {font-family: sans-serif;} img {max-width: 100%%; display: block; margin: 10px 0;} pre {background: #f4f4f4; padding: 5px;}</style>\n')
+        fid.write('</head>\n<body>\n<h1>Participant summary: %s</h1>\n' % html.escape(subject))
+        fid.write('\n<hr>\n'.join(html_sections))
+        fid.write('\n</body>\n</html>\n')
+
+    return report_file
+
+
+# Turn x,y,z into a voxel coordinate
+def voxel_coordinate(text):
+
+    try:
+        voxel = tuple(int(value) for value in text.split(','))
+    except ValueError:
+        voxel = ()
+
+    if len(voxel) != 3:
+        raise argparse.ArgumentTypeError('Voxels should be given as x,y,z (e.g. 32,32,18), not %s' % text)
+
+    return voxel
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Render the participant summary to a static HTML report')
+    parser.add_argument('--output_dir', default=REPORT_DIR, help='Where to save the report and figures')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes for summarising runs (default: all allocated cores)')
+    parser.add_argument('--no_cache', action='store_true', help='Recompute all summaries rather than using analysis/summary_cache/')
+    parser.add_argument('--voxels', nargs='+', type=voxel_coordinate, default=None, help='Voxels to plot the time courses of, as x,y,z (default: EXAMPLE_VOXEL)')
+    parser.add_argument('--mask', default=None, help='Plot the average time course within this mask instead')
+    args = parser.parse_args()
+
+    print('Saved report to %s' % render_report(args.output_dir, args.workers, not args.no_cache, args.voxels, args.mask))
@@ -0,0 +1,17 @@
+#!/bin/bash
+#
+# Render the participant summary to analysis/summary_report/participant_summary.html without a notebook
+# Any inputs are passed to render_report.py
+#
+# Example command:
+# sbatch scripts/run_render_report.sh
+
+#SBATCH --output=./logs/render_report-%j.out
+#SBATCH -p short
+#SBATCH -t 1:00:00
+#SBATCH --cpus-per-task 4
+#SBATCH --mem 16000
+
+source globals.sh
+
+python scripts/render_report.py --workers ${SLURM_CPUS_PER_TASK:-1} "$@"
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+## Compute the SFNR profile across the slices of every run
+# This is a python version of Analysis_SFNR_gradient.m. For each run the mean, standard deviation and distribution of
+# SFNR within the SFNR mask is computed for every slice along an axis (Y by default) with masked sums over the whole
+# volume, rather than a loop over slices, so every voxel is used (there is no need to sample 100 voxels per slice). The
+# profiles of all of the runs of a session are cached (in analysis/summary_cache/) and stacked, padding with NaN, into
+# arrays that are saved in one .npz file. scripts/sfnr_profiles.py does the same for every session in parallel.
+#
+# Run this from the subject directory to save analysis/firstlevel/sfnr_profiles.npz:
+# python $PROJ_DIR/prototype/link/scripts/sfnr_profile_utils.py
+
+import os
+import sys
+import glob
+import numpy as np
+import nibabel
+from summary_cache import cached_summary, CACHE_DIR
+
+# Where to look for the SFNR maps: the firstlevel feats and the univariate feats used by Analysis_SFNR_gradient.m
+FEAT_PATTERNS = ['analysis/firstlevel/functional*.feat/', 'analysis/firstlevel/Exploration/functional*_univariate.feat/']
+
+# Which axis the profile is along (1 is Y, as in Analysis_SFNR_gradient.m)
+PROFILE_AXIS = 1
+
+# How many bins are used for the distribution of SFNR in each slice
+DISTRIBUTION_BINS = 50
+
+# Increase this whenever the contents of the profiles change so that old cached versions aren't used
+PROFILE_VERSION = 1
+
+# Compute the mean, standard deviation (NaN for slices with fewer than 2 voxels), number of voxels and distribution
+# (proportion of voxels in each bin between 0 and the maximum SFNR) of the SFNR within the mask for each slice
+def slice_profile(sfnr_map, mask, axis=PROFILE_AXIS, bins=DISTRIBUTION_BINS):
+
+    sfnr_map = np.asarray(sfnr_map, dtype=np.float64)
+    mask = (np.asarray(mask) != 0) & np.isfinite(sfnr_map)
+    other_axes = tuple(dim for dim in range(sfnr_map.ndim) if dim != axis)
+
+    values = np.where(mask, sfnr_map, 0)
+    count = mask.sum(other_axes)
+    total = values.sum(other_axes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        deviation = np.where(mask, sfnr_map - np.expand_dims(mean, other_axes), 0)
+        std = np.where(count > 1, np.sqrt((deviation ** 2).sum(other_axes) / np.maximum(count - 1, 1)), np.nan)
+
+    # Bin every masked voxel at once, counting by slice and bin
+    max_value = values.max() if mask.any() else 0
+    bin_idxs = np.clip((values / max_value * bins).astype(int) if max_value > 0 else np.zeros(values.shape, dtype=int), 0, bins - 1)
+    slice_idxs = np.broadcast_to(np.expand_dims(np.arange(sfnr_map.shape[axis]), other_axes), sfnr_map.shape)
+    distribution = np.bincount(slice_idxs[mask] * bins + bin_idxs[mask], minlength=sfnr_map.shape[axis] * bins).reshape(-1, bins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distribution = distribution / count[:, np.newaxis]
+
+    return {'mean': mean, 'std': std, 'count': count, 'distribution': distribution, 'max_value': max_value}
+
+
+# Compute the profile of the SFNR map in a feat folder, returning None if the map or mask doesn't exist
+def run_profile(feat_folder, axis=PROFILE_AXIS):
+
+    sfnr_map_file = os.path.join(feat_folder, 'sfnr_prefiltered_func_data_st.nii.gz')
+    sfnr_mask_file = os.path.join(feat_folder, 'sfnr_mask_prefiltered_func_data_st.nii.gz')
+    if not os.path.isfile(sfnr_map_file) or not os.path.isfile(sfnr_mask_file):
+        return None
+
+    sfnr_map = np.asanyarray(nibabel.load(sfnr_map_file).dataobj)
+    mask = np.asanyarray(nibabel.load(sfnr_mask_file).dataobj)
+
+    return slice_profile(np.squeeze(sfnr_map), np.squeeze(mask), axis)
+
+
+# Stack profiles of different lengths in to a run x slice array (or run x slice x bin for the distribution), padding
+# with NaN
+def stack_profiles(profiles, key):
+
+    slice_num = max([len(profile[key]) for profile in profiles], default=0)
+    shape = (len(profiles), slice_num) + (np.shape(profiles[0][key])[1:] if len(profiles) > 0 else ())
+
+    stacked = np.full(shape, np.nan)
+    for profile_counter, profile in enumerate(profiles):
+        stacked[profile_counter, :len(profile[key])] = profile[key]
+
+    return stacked
+
+
+# Compute the profile of every run of a session (a subject directory). Returns a dictionary with the run names (the
+# feat folders) and run x slice arrays. The profiles are cached unless use_cache is False
+def session_profiles(session_dir='.', axis=PROFILE_AXIS, use_cache=True):
+
+    if use_cache:
+        key = ('session_profiles', PROFILE_VERSION, os.path.abspath(session_dir), axis)
+        return cached_summary(key, lambda: session_profiles(session_dir, axis, False), os.path.join(session_dir, CACHE_DIR))
+
+    runs = []
+    profiles = []
+    sources = []
+    for pattern in FEAT_PATTERNS:
+        sources.append(os.path.join(session_dir, os.path.dirname(pattern.rstrip('/'))))
+        for feat_folder in sorted(glob.glob(os.path.join(session_dir, pattern))):
+            sources += [feat_folder + 'sfnr_prefiltered_func_data_st.nii.gz', feat_folder + 'sfnr_mask_prefiltered_func_data_st.nii.gz']
+            profile = run_profile(feat_folder, axis)
+            if profile is not None:
+                runs.append(os.path.relpath(feat_folder, session_dir))
+                profiles.append(profile)
+
+    summary = {'runs': runs, 'max_value': np.array([profile['max_value'] for profile in profiles])}
+    for key in ['mean', 'std', 'count', 'distribution']:
+        summary[key] = stack_profiles(profiles, key)
+    summary['sources'] = sources
+
+    return summary
+
+
+# Save profiles (from session_profiles or scripts/sfnr_profiles.py) as a .npz file
+def save_profiles(profiles, output_file):
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    np.savez_compressed(output_file, **{key: np.asarray(value) for key, value in profiles.items() if key != 'sources'})
+
+
+if __name__ == '__main__':
+
+    output_file = sys.argv[1] if len(sys.argv) > 1 else 'analysis/firstlevel/sfnr_profiles.npz'
+    save_profiles(session_profiles(), output_file)
+    print('Saved %s' % output_file)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+## Calculate whole brain SFNR and TSNR without loading the whole functional
+# This is a python version of whole_brain_sfnr.m. The functional is read a chunk of TRs at a time and, for every
+# voxel, running sums of the (shifted) data weighted by a quadratic trend are accumulated. That is enough to get the
+# mean, the standard deviation (TSNR) and the standard deviation of the residuals after removing a second order
+# polynomial (SFNR; Friedman and Glover, 2006) at the end, so memory doesn't grow with the number of TRs.
+#
+# Example command (the same inputs as whole_brain_sfnr.m):
+# python $PROJ_DIR/prototype/link/scripts/sfnr_utils.py prefiltered_func_data_st.nii.gz ./ $Confound_File
+
+import os
+import sys
+import glob
+import numpy as np
+import nibabel
+from profiling_utils import profiled
+
+# How many TRs to read at a time
+CHUNK_TRS = 32
+
+# Voxels with a mean below this are given an SFNR of zero
+MIN_MEAN = 100
+
+# Which TRs are excluded according to the confound file, or None if the file can't be used. Like
+# whole_brain_sfnr.m only columns with a single 1 are used and the file must have a row for every TR
+def confound_excluded_TRs(confound_file, TR_num):
+
+    if confound_file is None or not os.path.isfile(confound_file):
+        print('%s not found, not excluding any TRs' % confound_file)
+        return None
+
+    confounds = np.loadtxt(confound_file, ndmin=2)
+
+    # Remove all columns that don't sum to one
+    confounds = confounds[:, confounds.sum(0) == 1]
+
+    if confounds.shape[0] != TR_num:
+        print("%s doesn't match length, not excluding any TRs" % confound_file)
+        return None
+
+    excluded_TRs = confounds.sum(1) == 1
+    print('Using %s to exclude %d TRs' % (confound_file, excluded_TRs.sum()))
+
+    return excluded_TRs
+
+
+# Stream through the functional and calculate the mean, TSNR and SFNR of every voxel, ignoring the excluded TRs.
+# Returns a dictionary of 3D volumes
+@profiled
+def compute_sfnr(func_file, excluded_TRs=None, chunk_TRs=CHUNK_TRS):
+
+    nii = nibabel.load(func_file, keep_file_open=True) if func_file.endswith('.gz') else nibabel.load(func_file)
+    volume_shape = nii.shape[:3]
+    TR_num = nii.shape[3]
+
+    included_TRs = np.arange(TR_num)
+    if excluded_TRs is not None:
+        included_TRs = included_TRs[~np.asarray(excluded_TRs, dtype=bool)]
+    included_num = len(included_TRs)
+
+    # The trend is fit over the included TRs numbered consecutively (as polyfit is in whole_brain_sfnr.m). Centre and
+    # scale time so that the regressors are well conditioned
+    trend = np.arange(included_num) - (included_num - 1) / 2
+    trend = trend / max(np.abs(trend).max(), 1)
+    design = np.column_stack((np.ones(included_num), trend, trend ** 2))
+
+    # Running sums: design' * y and y' * y for each voxel. The first included volume is subtracted from the data to
+    # avoid losing precision when the variance is small compared to the mean
+    shift = None
+    design_y = np.zeros((3,) + volume_shape)
+    sum_yy = np.zeros(volume_shape)
+
+    position = 0
+    for TR_start in range(0, TR_num, chunk_TRs):
+        TR_end = min(TR_start + chunk_TRs, TR_num)
+        chunk_included = included_TRs[(included_TRs >= TR_start) & (included_TRs < TR_end)] - TR_start
+        if len(chunk_included) == 0:
+            continue
+
+        chunk = np.asarray(nii.dataobj[..., TR_start:TR_end], dtype=np.float64)[..., chunk_included]
+
+        if shift is None:
+            shift = chunk[..., 0].copy()
+        chunk -= shift[..., np.newaxis]
+
+        chunk_design = design[position:position + len(chunk_included)]
+        design_y += np.tensordot(chunk_design.T, np.moveaxis(chunk, 3, 0), 1)
+        sum_yy += np.einsum('...t,...t->...', chunk, chunk)
+        position += len(chunk_included)
+
+    # Least squares fit of the trend, the residual sum of squares is y'y - b' X'y
+    coefs = np.tensordot(np.linalg.inv(design.T @ design), design_y, 1)
+    residual_ss = sum_yy - (coefs * design_y).sum(0)
+
+    shifted_mean = design_y[0] / included_num
+    total_ss = sum_yy - included_num * shifted_mean ** 2
+
+    mean_map = shifted_mean + shift
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sfnr_map = mean_map / np.sqrt(np.maximum(residual_ss, 0) / (included_num - 1))
+        tsnr_map = mean_map / np.sqrt(np.maximum(total_ss, 0) / (included_num - 1))
+
+    # If the mean is very low then assume the SFNR should be zero (as in whole_brain_sfnr.m)
+    sfnr_map[mean_map < MIN_MEAN] = 0
+
+    return {'mean': mean_map, 'sfnr': sfnr_map, 'tsnr': tsnr_map, 'included_num': included_num}
+
+
+# Find the local maxima of a histogram. Flat peaks are counted once, at their first bin (as with findpeaks in matlab)
+def histogram_peaks(binval):
+
+    peak_idxs = []
+    for bin_counter in range(1, len(binval) - 1):
+        if binval[bin_counter] > binval[bin_counter - 1]:
+
+            # Look past any flat section for the next different value
+            next_counter = bin_counter + 1
+            while next_counter < len(binval) - 1 and binval[next_counter] == binval[bin_counter]:
+                next_counter += 1
+
+            if binval[next_counter] < binval[bin_counter]:
+                peak_idxs.append(bin_counter)
+
+    return np.array(peak_idxs, dtype=int)
+
+
+# Find the SFNR value that separates brain from non brain. This is the minimum of the histogram between its two
+# highest peaks (if the histogram isn't bimodal then the threshold is 0)
+def sfnr_threshold(sfnr_map, bin_num=100):
+
+    values = sfnr_map[np.isfinite(sfnr_map)]
+    binval, edges = np.histogram(values, bin_num)
+    bins = (edges[:-1] + edges[1:]) / 2
+
+    # Zero pad the values so that if the first peak is near zero then you will still catch it
+    bins = np.concatenate((np.zeros(5), bins))
+    binval = np.concatenate((np.zeros(5), binval))
+
+    peak_idxs = histogram_peaks(binval)
+    if len(peak_idxs) < 2:
+        return 0
+
+    # Take the two highest peaks and find the lowest bin between them
+    highest = np.sort(peak_idxs[np.argsort(-binval[peak_idxs], kind='stable')[:2]])
+    between = binval[highest[0]:highest[1] + 1]
+
+    return bins[highest[0] + np.argmin(between)]
+
+
+# Save a volume using the header of the functional
+def save_volume(volume, reference_nii, output_file):
+
+    header = reference_nii.header.copy()
+    header.set_data_dtype(np.float32)
+    header['cal_max'] = np.nanmax(volume)
+    header['cal_min'] = np.nanmin(volume)
+
+    nibabel.save(nibabel.Nifti1Image(volume.astype(np.float32), reference_nii.affine, header), output_file)
+
+
+# Calculate the SFNR map and mask for each functional that matches input_file and save them to output_dir as
+# sfnr_$NAME and sfnr_mask_$NAME (also saving tsnr_$NAME). If confound_file isn't supplied then the
+# MotionConfounds file for the run in the subject directory is used
+@profiled
+def whole_brain_sfnr(input_file='data/nifti/*functional*.nii.gz', output_dir='data/qa/', confound_file=None):
+
+    for func_file in sorted(glob.glob(input_file)):
+
+        print('Loading %s' % func_file)
+        nii = nibabel.load(func_file)
+
+        run_confound_file = confound_file
+        if run_confound_file is None:
+            func_name = os.path.basename(func_file)
+            run = func_name[func_name.find('functional'):func_name.find('functional') + 12]
+            run_confound_file = 'analysis/firstlevel/Confounds/MotionConfounds_%s.txt' % run
+
+        excluded_TRs = confound_excluded_TRs(run_confound_file, nii.shape[3])
+        maps = compute_sfnr(func_file, excluded_TRs)
+
+        threshold = sfnr_threshold(maps['sfnr'])
+        mask = maps['sfnr'] > threshold
+
+        # Save the mask before the map since other scripts wait for the map to exist
+        mask_file = os.path.join(output_dir, 'sfnr_mask_' + os.path.basename(func_file))
+        save_volume(mask.astype(np.float32), nii, mask_file)
+        save_volume(maps['tsnr'], nii, os.path.join(output_dir, 'tsnr_' + os.path.basename(func_file)))
+        save_volume(maps['sfnr'], nii, os.path.join(output_dir, 'sfnr_' + os.path.basename(func_file)))
+
+        print('Saving %s, threshold is %0.02f' % (mask_file, threshold))
+
+
+if __name__ == '__main__':
+    whole_brain_sfnr(*sys.argv[1:])
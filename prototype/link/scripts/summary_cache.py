@@ -0,0 +1,122 @@
+## Cache the summaries computed for participant_summary.ipynb
+# Each summary is stored as a pickle in CACHE_DIR (relative to the subject directory) along with the size and
+# modification time of every file and folder that was used to make it. When the summary is requested again it is only
+# recomputed if one of those sources has changed (folders are included so that files being added or removed are
+# noticed). The cache is capped at max_bytes, with the least recently used summaries deleted first.
+
+import os
+import glob
+import pickle
+import hashlib
+import numpy as np
+
+CACHE_DIR = 'analysis/summary_cache/'
+MAX_CACHE_BYTES = 1024 ** 3
+
+# Record the modification time and size of each source. Files that don't exist are recorded as such so that they
+# invalidate the summary if they appear (sources that are None are ignored)
+def source_signature(sources):
+
+    signature = []
+    for source in sorted(set(source for source in sources if source is not None)):
+        try:
+            info = os.stat(source)
+            signature.append((source, info.st_mtime_ns, info.st_size))
+        except OSError:
+            signature.append((source, None, None))
+
+    return signature
+
+
+# What file is this key stored in. Arrays (e.g. masks) in the key are hashed by their contents
+def cache_file(key, cache_dir=CACHE_DIR):
+
+    key_hash = hashlib.sha1()
+    for item in key:
+        if isinstance(item, np.ndarray):
+            key_hash.update(item.tobytes())
+            key_hash.update(str((item.shape, item.dtype)).encode())
+        else:
+            key_hash.update(repr(item).encode())
+
+    return os.path.join(cache_dir, key_hash.hexdigest() + '.pkl')
+
+
+# Return the cached summary, or None if it isn't stored or any of its sources have changed
+def load_summary(key, cache_dir=CACHE_DIR):
+
+    file_name = cache_file(key, cache_dir)
+
+    try:
+        with open(file_name, 'rb') as fid:
+            entry = pickle.load(fid)
+    except Exception:
+        # Missing, partially written or from an incompatible version; either way it needs to be remade
+        return None
+
+    if entry['signature'] != source_signature([source for source, _, _ in entry['signature']]):
+        return None
+
+    # Mark it as recently used
+    os.utime(file_name)
+
+    return entry['summary']
+
+
+# Store a summary along with the signature of the sources it was made from
+def save_summary(key, summary, sources, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    entry = {'summary': summary, 'signature': source_signature(sources)}
+
+    # Write to a temporary file first so that other processes never read half a file
+    file_name = cache_file(key, cache_dir)
+    temp_file = '%s.%d.tmp' % (file_name, os.getpid())
+    with open(temp_file, 'wb') as fid:
+        pickle.dump(entry, fid, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, file_name)
+
+    evict(cache_dir, max_bytes)
+
+
+# Delete the least recently used summaries until the cache is below max_bytes
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    entries = []
+    for file_name in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        try:
+            info = os.stat(file_name)
+            entries.append((info.st_mtime, info.st_size, file_name))
+        except OSError:
+            pass
+
+    total_bytes = sum(entry[1] for entry in entries)
+    for _, size, file_name in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
+        total_bytes -= size
+
+
+# Return the summary for this key, only calling compute if there is no valid cached version.
+# compute must return a dictionary with a 'sources' entry listing the files and folders it used
+def cached_summary(key, compute, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+
+    summary = load_summary(key, cache_dir)
+
+    if summary is None:
+        summary = compute()
+        save_summary(key, summary, summary['sources'], cache_dir, max_bytes)
+
+    return summary
+
+
+# Remove all of the cached summaries
+def clear_cache(cache_dir=CACHE_DIR):
+
+    for file_name in glob.glob(os.path.join(cache_dir, '*.pkl')):
+        os.remove(file_name)
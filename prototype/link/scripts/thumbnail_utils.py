@@ -0,0 +1,99 @@
+## Combine galleries of PNGs into a single downsampled mosaic
+# Rather than decoding and plotting every full resolution image (e.g. the Excluded_TRs_functional??_*.png plots) the
+# images are shrunk and tiled into one PNG with at most max_pixels pixels. The mosaic is stored in a thumbnails/ folder
+# next to the images and records the size and modification time of each image it was made from, so it is only remade
+# when one of those images changes. Pillow is only imported when a mosaic is checked or made so that importing this
+# (e.g. from participant_summary_core.py) stays quick.
+
+import os
+import json
+import numpy as np
+from profiling_utils import profiled
+
+# The most pixels a mosaic can have
+MAX_MOSAIC_PIXELS = 2000000
+
+# Where the mosaic for these images should be stored
+def mosaic_file_name(image_files, mosaic_name):
+    return os.path.join(os.path.dirname(image_files[0]), 'thumbnails', mosaic_name + '.png')
+
+
+# Describe the images the mosaic was made from
+def mosaic_signature(image_files):
+
+    signature = []
+    for image_file in image_files:
+        info = os.stat(image_file)
+        signature.append([image_file, info.st_mtime_ns, info.st_size])
+
+    return json.dumps(signature)
+
+
+# Tile the images in to a grid, shrinking them so that the mosaic has no more than max_pixels pixels, and save it
+def make_mosaic(image_files, mosaic_file, max_pixels=MAX_MOSAIC_PIXELS):
+
+    from PIL import Image, PngImagePlugin
+
+    signature = mosaic_signature(image_files)
+
+    # Make the grid as square as possible
+    image_num = len(image_files)
+    col_num = int(np.ceil(np.sqrt(image_num)))
+    row_num = int(np.ceil(image_num / col_num))
+
+    # Each tile has the aspect ratio of the first image and the tiles share the pixel budget
+    with Image.open(image_files[0]) as img:
+        aspect = img.size[0] / img.size[1]
+    tile_height = max(int(np.sqrt(max_pixels / (col_num * row_num) / aspect)), 1)
+    tile_width = max(int(tile_height * aspect), 1)
+
+    mosaic = Image.new('RGB', (tile_width * col_num, tile_height * row_num), (255, 255, 255))
+
+    for image_counter, image_file in enumerate(image_files):
+        with Image.open(image_file) as img:
+
+            # Only decode at the size that is needed
+            img.draft('RGB', (tile_width, tile_height))
+            img.thumbnail((tile_width, tile_height))
+            img = img.convert('RGBA')
+
+            # Centre the image in its tile
+            row, col = divmod(image_counter, col_num)
+            left = col * tile_width + (tile_width - img.size[0]) // 2
+            top = row * tile_height + (tile_height - img.size[1]) // 2
+            mosaic.paste(img, (left, top), img)
+
+    # Store the signature in the PNG so the mosaic can be checked without another file
+    metadata = PngImagePlugin.PngInfo()
+    metadata.add_text('sources', signature)
+
+    os.makedirs(os.path.dirname(mosaic_file), exist_ok=True)
+    temp_file = '%s.%d.tmp' % (mosaic_file, os.getpid())
+    mosaic.save(temp_file, format='PNG', pnginfo=metadata)
+    os.replace(temp_file, mosaic_file)
+
+    return mosaic_file
+
+
+# Return the mosaic of these images, only remaking it if the images have changed since it was made.
+# Returns None if there are no images
+@profiled
+def cached_mosaic(image_files, mosaic_name, max_pixels=MAX_MOSAIC_PIXELS):
+
+    if len(image_files) == 0:
+        return None
+
+    from PIL import Image
+
+    image_files = sorted(image_files)
+    mosaic_file = mosaic_file_name(image_files, mosaic_name)
+
+    if os.path.isfile(mosaic_file):
+        try:
+            with Image.open(mosaic_file) as mosaic:
+                if mosaic.info.get('sources') == mosaic_signature(image_files):
+                    return mosaic_file
+        except (OSError, SyntaxError):
+            pass
+
+    return make_mosaic(image_files, mosaic_file, max_pixels)
@@ -11,6 +11,10 @@
 % than 36 months. Note that some critiera, like 'included sessions', it accepts a cell
 % which can list multiple strings to match for
 %
+% scripts/participant_catalogue.py does the same search from python using a
+% catalogue of the sessions that is only rescanned when files change, which
+% is much faster than scanning every session each time
+%
 % Note that with adult participants in this directory, the age
 % functionality still works, it is just a little clunky to report an
 % adult's age in months.
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+## Aggregate the FIR analyses for runs/sessions that meet certain criteria
+# This is a python version of Aggregate_FIR.m. The FIR data of each run (FIR_data_Masktype_$MASKTYPE.mat in
+# analysis/firstlevel/Exploration/functional*_fir.feat/) is reduced to the mean time courses that are averaged and
+# cached (in results/Aggregate_FIR/cache/) so each mat file is only read once, until it changes. Participants are
+# loaded in parallel and each participant's block weighted average is added to a running mean and variance as it
+# arrives, so only these reduced time courses (never the FIR data of every run) are held in memory. Changing the experiment,
+# min_blocks or the participant criteria only needs the cached summaries. As in Aggregate_FIR.m, the mean ignores NaNs
+# and the standard error is the nanstd divided by the square root of the number of participants (including any that are
+# NaN at that TR). Runs that are shorter than a participant's first run, and participants that are shorter than the
+# first participant, are reported and left out (Aggregate_FIR.m fails on the former).
+#
+# Run this from the root directory ($PROJ_DIR). Example command (use the V1_mask, take only FIR from StatLearning
+# blocks and ignore any participants with fewer than 6 blocks):
+# python scripts/aggregate_fir.py V1_mask StatLearning 6 --max_age 36
+
+import os
+import sys
+import argparse
+import functools
+import concurrent.futures
+import numpy as np
+from scipy.io import loadmat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from summary_cache import cached_summary
+from participant_catalogue import refresh_catalogue, find_sessions
+from participant_summary_core import default_workers
+
+EXPLORATION_DIR = 'analysis/firstlevel/Exploration/'
+OUTPUT_DIR = 'results/Aggregate_FIR/'
+CACHE_DIR = OUTPUT_DIR + 'cache/'
+
+# Increase this whenever the contents of the run summaries change so that old cached summaries aren't used
+FIR_VERSION = 1
+
+# The dependent variables that are averaged: (key, name used in the output files, y limits of the plot)
+DVS = [('psc_pe', '_psc_pe', (-2, 2)), ('pe', '_pe', (-8, 8)), ('averaged', '_av', (600, 800))]
+
+# Reduce the FIR data of one run to the time courses that are aggregated
+def summarise_fir_run(participant_dir, func_run, fir_file):
+
+    fir_data = loadmat(fir_file, variable_names=['pe_z', 'masked_pe', 'masked_averaged', 'masked_psc_pe', 'design'])
+
+    # How many blocks were in this run and which timing files does it have
+    timing_file = os.path.join(participant_dir, EXPLORATION_DIR, 'functional%s.txt' % func_run)
+    timing_dir = os.path.join(participant_dir, 'analysis/firstlevel/Timing/')
+    timing_mat = np.loadtxt(timing_file, ndmin=2)
+    timing_names = [name for name in sorted(os.listdir(timing_dir)) if name.startswith('functional%s_' % func_run)] if os.path.isdir(timing_dir) else []
+
+    return {'func_run': func_run,
+            'pe_z': np.ravel(fir_data['pe_z']),
+            'pe': np.mean(np.atleast_2d(fir_data['masked_pe']), 0),
+            'averaged': np.mean(np.atleast_2d(fir_data['masked_averaged']), 0),
+            'psc_pe': np.mean(np.atleast_2d(fir_data['masked_psc_pe']), 0),
+            'design': np.ravel(fir_data['design']),
+            'blocks': float(np.sum(timing_mat[:, 2])),
+            'timing_names': timing_names,
+            'sources': [fir_file, timing_file, timing_dir],
+            }
+
+
+# Find and summarise (using the cache) every FIR run of a participant for this mask. This is run by each worker
+def load_participant_fir(participant, masktype, use_cache=True, subjects_dir='subjects/', cache_dir=CACHE_DIR):
+
+    participant_dir = os.path.join(subjects_dir, participant)
+    exploration_dir = os.path.join(participant_dir, EXPLORATION_DIR)
+    fir_folders = [name for name in sorted(os.listdir(exploration_dir)) if name.startswith('functional') and name.endswith('_fir.feat')] if os.path.isdir(exploration_dir) else []
+
+    runs = []
+    for fir_folder in fir_folders:
+        fir_file = os.path.join(exploration_dir, fir_folder, 'FIR_data_Masktype_%s.mat' % masktype)
+        if not os.path.isfile(fir_file):
+            continue
+
+        func_run = fir_folder[len('functional'):-len('_fir.feat')]
+        if use_cache:
+            key = ('fir_run', FIR_VERSION, os.path.abspath(fir_file))
+            runs.append(cached_summary(key, functools.partial(summarise_fir_run, participant_dir, func_run, fir_file), cache_dir))
+        else:
+            runs.append(summarise_fir_run(participant_dir, func_run, fir_file))
+
+    return participant, runs
+
+
+# Should this run be used for this experiment: either an experiment name (which the timing files at first level must
+# match) or the number of evs that are being modelled
+def use_run(run, experiment):
+
+    if str(experiment).isdigit():
+        return int(experiment) == len(run['pe_z'])
+
+    return any(name.startswith('functional%s_%s' % (run['func_run'], experiment)) for name in run['timing_names'])
+
+
+# Weight each run's time course by its number of blocks to make the participant's average (truncating the runs to the
+# length of the first run, as in Aggregate_FIR.m). Returns None if the participant has no blocks
+def participant_average(runs, key):
+
+    length = len(runs[0][key])
+    runs = [run for run in runs if len(run[key]) >= length]
+    blocks = np.array([run['blocks'] for run in runs])
+    if blocks.sum() == 0:
+        return None
+
+    return (np.array([run[key][:length] for run in runs]) * (blocks / blocks.sum())[:, np.newaxis]).sum(0)
+
+
+# Start a running mean and variance (Welford's algorithm, ignoring NaNs). rows counts every time course that is added,
+# whether or not it is NaN
+def accumulator(length):
+    return {'count': np.zeros(length), 'mean': np.zeros(length), 'm2': np.zeros(length), 'rows': 0}
+
+
+# Add one participant's time course to the running mean and variance
+def accumulate(acc, values):
+
+    values = np.asarray(values, dtype=np.float64)[:len(acc['mean'])]
+    valid = np.isfinite(values)
+
+    acc['rows'] += 1
+    acc['count'][valid] += 1
+    delta = np.where(valid, values - acc['mean'], 0)
+    acc['mean'][valid] += delta[valid] / acc['count'][valid]
+    acc['m2'][valid] += (delta * np.where(valid, values - acc['mean'], 0))[valid]
+
+
+# The mean and standard error of the accumulated time courses. Like Aggregate_FIR.m (nanstd(x) / sqrt(size(x, 1))),
+# the standard deviation ignores NaNs (and is 0 for a single value) but it is divided by the square root of the number
+# of time courses
+def accumulator_result(acc):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(acc['m2'] / np.maximum(acc['count'] - 1, 1))
+        std[acc['count'] == 0] = np.nan
+        return np.where(acc['count'] > 0, acc['mean'], np.nan), std / np.sqrt(acc['rows'])
+
+
+# Average the FIR data across participants. Participants are included if they have at least min_blocks blocks in the
+# runs that match the experiment. Returns a dictionary with the mean and standard error of each dependent variable,
+# plus the participant averages that were included (for plotting)
+def aggregate_fir(participants, masktype, experiment='', min_blocks=0, workers=None, use_cache=True, subjects_dir='subjects/'):
+
+    if workers is None:
+        workers = default_workers()
+
+    results = {key: {'acc': None, 'participant_means': [], 'participants': []} for key, _, _ in DVS}
+    design_acc = None
+    blocks_per_participant = {}
+
+    load_func = functools.partial(load_participant_fir, masktype=masktype, use_cache=use_cache, subjects_dir=subjects_dir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+
+        # The workers reduce each run to a few time courses and participants are added as they arrive
+        for participant, runs in executor.map(load_func, participants):
+
+            runs = [run for run in runs if use_run(run, experiment)]
+            if len(runs) == 0:
+                continue
+
+            # Runs with fewer evs than the first run can't be truncated to its length
+            for run in runs[1:]:
+                if len(run['pe_z']) < len(runs[0]['pe_z']):
+                    print('Not using run %s of %s because it is shorter than the first run: %d < %d' % (run['func_run'], participant, len(run['pe_z']), len(runs[0]['pe_z'])))
+            runs = [run for run in runs if len(run['pe_z']) >= len(runs[0]['pe_z'])]
+
+            total_blocks = sum(run['blocks'] for run in runs)
+            blocks_per_participant[participant] = total_blocks
+            if total_blocks < float(min_blocks):
+                print('Not including %s because insufficient blocks: %d' % (participant, total_blocks))
+                continue
+
+            included = False
+            for key, _, _ in DVS:
+                participant_mean = participant_average(runs, key)
+                if participant_mean is None:
+                    continue
+
+                # The first participant sets the length and shorter participants are skipped
+                result = results[key]
+                if result['acc'] is None:
+                    result['acc'] = accumulator(len(participant_mean))
+                elif len(participant_mean) < len(result['acc']['mean']):
+                    print('Not including %s in %s because it is shorter than the first participant: %d < %d' % (participant, key, len(participant_mean), len(result['acc']['mean'])))
+                    continue
+
+                accumulate(result['acc'], participant_mean)
+                result['participant_means'].append(participant_mean[:len(result['acc']['mean'])])
+                result['participants'].append(participant)
+                included = True
+
+            if not included:
+                continue
+
+            design = participant_average(runs, 'design')
+            if design is not None:
+                if design_acc is None:
+                    design_acc = accumulator(len(design))
+                if len(design) >= len(design_acc['mean']):
+                    accumulate(design_acc, design)
+
+            print('Including %s with %d blocks across %d runs' % (participant, total_blocks, len(runs)))
+
+    aggregate = {'masktype': masktype, 'experiment': experiment, 'min_blocks': min_blocks, 'blocks_per_participant': blocks_per_participant,
+                 'design': None if design_acc is None else accumulator_result(design_acc)[0]}
+    for key, _, _ in DVS:
+        result = results[key]
+        if result['acc'] is None:
+            aggregate[key] = None
+            continue
+        mean, sem = accumulator_result(result['acc'])
+        aggregate[key] = {'mean': mean, 'sem': sem, 'participants': result['participants'], 'participant_means': np.array(result['participant_means'])}
+
+    return aggregate
+
+
+# Save the aggregate as a .npz and plot each dependent variable (as Aggregate_FIR.m does)
+def save_aggregate(aggregate, savename):
+
+    from matplotlib.figure import Figure
+
+    os.makedirs(os.path.dirname(savename), exist_ok=True)
+
+    arrays = {'design': aggregate['design'] if aggregate['design'] is not None else np.array([])}
+    for key, dv_name, y_range in DVS:
+        dv = aggregate[key]
+        if dv is None:
+            continue
+        arrays.update({key + '_mean': dv['mean'], key + '_sem': dv['sem'], key + '_participant_means': dv['participant_means'], key + '_participants': np.array(dv['participants'])})
+
+        fig = Figure()
+        ax = fig.subplots()
+        ax.errorbar(np.arange(1, len(dv['mean']) + 1), dv['mean'], dv['sem'], color='r', linewidth=4)
+        ax.plot(np.arange(1, len(dv['mean']) + 1), dv['participant_means'].T, 'k')
+
+        # Scale the design to the peak of the response
+        if aggregate['design'] is not None:
+            design = aggregate['design'] - aggregate['design'][0]
+            ax.plot(np.arange(1, len(design) + 1), design / np.max(design) * np.nanmax(dv['mean']), 'g')
+
+        ax.set_title('Averaged PE, MaskType=%s N=%d' % (aggregate['masktype'], len(dv['participants'])))
+        ax.set_ylim(y_range)
+        ax.set_ylabel('Evoked response')
+        ax.set_xlabel('TRs from block onset')
+        fig.savefig(savename + dv_name + '.eps')
+
+    np.savez_compressed(savename + '.npz', **arrays)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Aggregate the FIR analyses for runs/sessions that meet certain criteria')
+    parser.add_argument('masktype', nargs='?', default='2', help='Suffix of the FIR files (FIR_data_Masktype_$MASKTYPE.mat)')
+    parser.add_argument('experiment', nargs='?', default='', help='Experiment name, or the number of evs modelled')
+    parser.add_argument('min_blocks', nargs='?', default='0', help='Minimum number of blocks for a participant to be included')
+    parser.add_argument('--included_sessions', nargs='+', default=None, help='Only include sessions containing these strings')
+    parser.add_argument('--excluded_sessions', nargs='+', default=None, help='Exclude sessions containing these strings')
+    parser.add_argument('--min_age', type=float, default=0, help='Minimum age in months')
+    parser.add_argument('--max_age', type=float, default=np.inf, help='Maximum age in months')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all allocated cores)')
+    parser.add_argument('--no_cache', action='store_true', help='Reload every FIR file rather than using the cache')
+    args = parser.parse_args()
+
+    # Identify the participants
+    refresh_catalogue()
+    participants = list(find_sessions(args.included_sessions, args.excluded_sessions, args.min_age, args.max_age)['session'])
+
+    # Make the output name from the criteria
+    output_name = ''
+    for criterion in ['included_sessions', 'excluded_sessions', 'min_age', 'max_age']:
+        value = getattr(args, criterion)
+        if value is not None and value != parser.get_default(criterion):
+            output_name += '_' + '_'.join([criterion] + [str(item) for item in np.atleast_1d(value)])
+    print('Output name will be: %s' % output_name)
+
+    aggregate = aggregate_fir(participants, args.masktype, args.experiment, args.min_blocks, args.workers, not args.no_cache)
+
+    if aggregate['psc_pe'] is None:
+        print('No files found with the name: %s/functional*_fir.feat/FIR_data_Masktype_%s.mat' % (EXPLORATION_DIR, args.masktype))
+    else:
+        savename = '%sFIR_average_%s_blocks_%s_%s%s' % (OUTPUT_DIR, args.experiment, args.min_blocks, args.masktype, output_name)
+        save_aggregate(aggregate, savename)
+        print('Saved %s.npz' % savename)
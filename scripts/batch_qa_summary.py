@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+## Summarise the QA of every participant in subjects/ into a single table
+# This runs the numeric parts of generate_descriptives, summarise_firstlevel, summarise_behavior and
+# summarise_secondlevel (the describe_* functions in prototype/link/scripts/participant_summary_core.py, which doesn't
+# import matplotlib, and is run with images=False so that no mosaics are made) for each participant in parallel and stores the
+# results as one row per run in a Parquet (.parquet) or HDF5 (.h5) table. Participant level information (behavior and
+# secondlevel) is repeated on each of that participant's rows. Participants or runs that couldn't be summarised have the
+# reason stored in the error column.
+#
+# Run this from the root directory ($PROJ_DIR). Example command:
+# python scripts/batch_qa_summary.py --output results/qa_summary.parquet --workers 16
+#
+# Use --qa_only to just collect every metric in the BXH QA files (data/qa/qa_events_*.bxh.xml) for each run
+#
+# Use --profile results/qa_summary_profile.jsonl to record the time, reads and memory of each summary stage of every
+# participant (see prototype/link/scripts/profiling_utils.py)
+#
+# Or submit it to the cluster with:
+# sbatch ./scripts/run_batch_qa_summary.sh
+
+import os
+import sys
+import glob
+import argparse
+import concurrent.futures
+import numpy as np
+import pandas as pd
+
+# The summary functions are stored in the linked scripts of the prototype
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from participant_summary_core import find_runs, describe_run, describe_firstlevel, describe_behavior, describe_secondlevel, default_workers
+from qa_parsers import parse_qa_files
+from profiling_utils import enable_profiling, load_profile, aggregate_profile, print_profile
+
+# Make a column name out of a label
+def column_name(*labels):
+    return '_'.join(str(label) for label in labels).replace(' ', '_').replace('/', '_')
+
+
+# Make a column for each QA metric. Metrics that appear more than once in the file (arrays) are stored as their mean
+# and maximum, and repeated text as the first value, so that every cell of the table is a scalar
+def qa_columns(metrics):
+
+    columns = {}
+    for qa_metric, qa_value in metrics.items():
+        if isinstance(qa_value, np.ndarray):
+            columns[column_name('qa', qa_metric, 'mean')] = float(qa_value.mean())
+            columns[column_name('qa', qa_metric, 'max')] = float(qa_value.max())
+        elif isinstance(qa_value, list):
+            columns[column_name('qa', qa_metric)] = qa_value[0]
+        else:
+            columns[column_name('qa', qa_metric)] = qa_value
+
+    return columns
+
+
+# Pull the numbers out of the describe_run summary
+def flatten_descriptives(summary):
+
+    row = {'TR_num': summary['TR_num']}
+    row.update(qa_columns(summary['qa_metrics'] or {}))
+
+    if summary['excluded_TRs'] is not None:
+        row['excluded_TR_num'] = int(np.sum(summary['excluded_TRs']))
+        row['excluded_TR_proportion'] = float(np.mean(summary['excluded_TRs']))
+
+    return row
+
+
+# Pull the numbers out of the describe_firstlevel summary
+def flatten_firstlevel(summary):
+
+    row = {'excluded_run': summary['excluded_run'], 'feat_exists': summary['feat_exists']}
+
+    for block_name, included_num, excluded_num in summary['blocks']:
+        row[column_name('blocks_included', block_name)] = int(included_num)
+        row[column_name('blocks_excluded', block_name)] = int(excluded_num)
+
+    if summary['feat_exists']:
+
+        if summary['sfnr'] is not None:
+            for stat in ['mean', 'std', 'max']:
+                row[column_name('sfnr', stat)] = float(summary['sfnr'][stat])
+
+        row['component_num'] = summary['component_num']
+        row['excluded_components'] = summary['excluded_components']
+        row['manual_reg'] = summary['manual_reg']
+        row['reg_exists'] = summary['reg_exists']
+
+    return row
+
+
+# Pull the numbers out of the describe_behavior summary
+def flatten_behavior(summary):
+
+    row = {}
+
+    if summary['analysis_timing'] is not None:
+        row['behavior_TR_mismatch'] = summary['analysis_timing']['TR_mismatch']
+        row['behavior_included_run_num'] = int(np.sum(summary['analysis_timing']['included_runs'] == 1))
+
+    if summary['coders'] is not None:
+        row['behavior_coder_num'] = len(summary['coders']['names'])
+        row['behavior_included_coder_num'] = len(summary['coders']['included'])
+
+        # Reliability of the included coders
+        for attribute, Intraframe, Interframe in summary['reliability'] or []:
+            included_coders = summary['coders']['included']
+            row[column_name('reliability', attribute, 'intraframe')] = float(np.nanmean(Intraframe[included_coders]))
+            row[column_name('reliability', attribute, 'interframe')] = float(np.nanmean(Interframe[included_coders]))
+
+    return row
+
+
+# Pull the numbers out of the describe_secondlevel summary
+def flatten_secondlevel(summary):
+
+    row = {'secondlevel_registration': summary['registration'],
+           'secondlevel_manual_reg': summary['manual_reg'],
+           'secondlevel_highres_exists': summary['highres_exists'],
+           }
+
+    for experiment_folder, blocks in summary['experiments']:
+        experiment = os.path.basename(experiment_folder)
+        for timing_file, included_num, excluded_num in blocks:
+            timing_name = os.path.basename(timing_file)[:-len('.txt')]
+            row[column_name(experiment, timing_name, 'included')] = int(included_num)
+            row[column_name(experiment, timing_name, 'excluded')] = int(excluded_num)
+
+    if summary['stacked_data'] is not None:
+        for label, minutes in zip(summary['stacked_data']['labels'], summary['stacked_data']['data']):
+            row[column_name('scan_minutes', label)] = float(np.squeeze(minutes))
+
+    return row
+
+
+# Summarise a single participant, returning a list of rows (one per run). This is run by each worker
+def summarise_subject(subject_dir, use_cache=True):
+
+    subject = os.path.basename(os.path.normpath(subject_dir))
+
+    try:
+        # All of the summary functions assume they are run from the subject directory
+        os.chdir(subject_dir)
+
+        participant_row = {}
+        participant_row.update(flatten_behavior(describe_behavior(use_cache, images=False)))
+        participant_row.update(flatten_secondlevel(describe_secondlevel(use_cache)))
+        func_runs = find_runs()
+    except Exception as err:
+        return [{'subject': subject, 'error': '%s: %s' % (type(err).__name__, err)}]
+
+    rows = []
+    for func_run in func_runs:
+        row = {'subject': subject, 'func_run': func_run}
+        try:
+            row.update(flatten_descriptives(describe_run(func_run, use_cache, images=False)))
+            row.update(flatten_firstlevel(describe_firstlevel(func_run, use_cache=use_cache, images=False)))
+        except Exception as err:
+            row['error'] = '%s: %s' % (type(err).__name__, err)
+        row.update(participant_row)
+        rows.append(row)
+
+    # Still list participants without any runs
+    if len(rows) == 0:
+        participant_row['subject'] = subject
+        rows.append(participant_row)
+
+    return rows
+
+
+# Summarise all of the participants in parallel and return a table with one row per run
+def summarise_subjects(subject_dirs, workers=None, use_cache=True):
+
+    if workers is None:
+        workers = default_workers()
+
+    subject_dirs = [os.path.abspath(subject_dir) for subject_dir in subject_dirs]
+
+    rows = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for subject_rows in executor.map(summarise_subject, subject_dirs, [use_cache] * len(subject_dirs)):
+            rows += subject_rows
+
+    table = pd.DataFrame(rows)
+
+    # Put the identifiers first
+    first_columns = [column for column in ['subject', 'func_run', 'error'] if column in table.columns]
+    return table[first_columns + [column for column in table.columns if column not in first_columns]]
+
+
+# Parse every QA file of every participant into a table with one row per QA file. This only reads data/qa/ so is
+# much faster than summarise_subjects
+def qa_metrics_table(subject_dirs, workers=None):
+
+    qa_files = []
+    for subject_dir in subject_dirs:
+        qa_files += sorted(glob.glob(os.path.join(subject_dir, 'data/qa/qa_events_*_functional*.bxh.xml')))
+
+    rows = []
+    for record in parse_qa_files(qa_files, workers):
+        row = {'subject': os.path.basename(os.path.normpath(record.file_name.split('/data/qa/')[0])), 'func_run': record.func_run}
+        row.update(qa_columns(record.metrics))
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+# Save the table as Parquet or HDF5 depending on the file extension
+def save_table(table, output_file):
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+    if output_file.endswith('.parquet'):
+        table.to_parquet(output_file, index=False)
+    elif output_file.endswith('.h5') or output_file.endswith('.hdf5'):
+        table.to_hdf(output_file, key='qa_summary', mode='w')
+    else:
+        raise ValueError('Unrecognised output format for %s, use .parquet or .h5' % output_file)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Summarise the QA for all participants into one table')
+    parser.add_argument('subjects', nargs='*', help='Participants to summarise (default: everyone in subjects/)')
+    parser.add_argument('--output', default='results/qa_summary.parquet', help='Where to save the table (.parquet or .h5)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all allocated cores)')
+    parser.add_argument('--no_cache', action='store_true', help='Recompute all summaries rather than using analysis/summary_cache/')
+    parser.add_argument('--qa_only', action='store_true', help='Only collect the metrics in the BXH QA files (data/qa/)')
+    parser.add_argument('--profile', default=None, help='Record the time, reads and memory of each stage in this JSON lines file')
+    args = parser.parse_args()
+
+    if len(args.subjects) > 0:
+        subject_dirs = [os.path.join('subjects', subject) for subject in args.subjects]
+    else:
+        subject_dirs = sorted(subject_dir for subject_dir in glob.glob('subjects/*') if os.path.isdir(subject_dir))
+
+    output_file = os.path.abspath(args.output)
+
+    # Workers inherit the profile file so every participant is recorded in it
+    if args.profile is not None:
+        enable_profiling(args.profile)
+
+    if args.qa_only:
+        table = qa_metrics_table(subject_dirs, args.workers)
+    else:
+        table = summarise_subjects(subject_dirs, args.workers, not args.no_cache)
+    save_table(table, output_file)
+
+    print('Summarised %d runs from %d participants into %s' % (len(table), len(subject_dirs), output_file))
+
+    if args.profile is not None and os.path.isfile(os.path.abspath(args.profile)):
+        print_profile(aggregate_profile(load_profile(os.path.abspath(args.profile))))
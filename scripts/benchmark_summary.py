@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+## Benchmark the participant summary on synthetic subject directories
+# Real data can't leave the cluster so this makes subject directories with the layout that
+# prototype/link/scripts/participant_summary_utils.py expects (functionals, QA files, confounds, timing files, firstlevel
+# and univariate feat folders, SFNR maps, registration, AnalysedData.mat with eye tracking codes and secondlevel
+# folders) filled with random data, at several scales of run length and matrix size. Each summariser is then timed on
+# every scale, both without the cache (cold) and with it (warm), and the wall time, CPU time, bytes read and peak
+# memory (see prototype/link/scripts/profiling_utils.py) are stored with one row per scale, summariser and mode.
+# Compare the output between releases to catch slowdowns.
+#
+# Scales are named (small, medium, large) or given as TRs:XxYxZ. Example command:
+# python scripts/benchmark_summary.py --scales small medium 300:64x64x36 --output results/benchmark_summary.csv
+
+import os
+import io
+import sys
+import glob
+import shutil
+import argparse
+import functools
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import nibabel
+from PIL import Image
+from scipy.io import savemat
+
+# Plot without a display
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+import participant_summary_utils as summary_utils
+from summary_cache import CACHE_DIR, clear_cache
+from profiling_utils import profile_stage, enable_profiling, disable_profiling, load_profile
+
+# The named scales: (number of TRs, matrix size)
+SCALES = {'small': (60, (32, 32, 18)),
+          'medium': (150, (64, 64, 36)),
+          'large': (300, (64, 64, 36)),
+          }
+
+# Make the list of summarisers to time: (name, function, whether it is run for each run, whether it plots). The
+# firstlevel time course is taken from the middle voxel since the example voxel may be outside of small matrices
+def summariser_list(matrix):
+
+    voxels = tuple(dim // 2 for dim in matrix)
+
+    return [('describe_run', summary_utils.describe_run, True, False),
+            ('describe_firstlevel', functools.partial(summary_utils.describe_firstlevel, voxels=voxels), True, False),
+            ('describe_univariate', summary_utils.describe_univariate, True, False),
+            ('describe_behavior', summary_utils.describe_behavior, False, False),
+            ('describe_secondlevel', summary_utils.describe_secondlevel, False, False),
+            ('describe_sfnr_profiles', summary_utils.describe_sfnr_profiles, False, False),
+            ('generate_descriptives', summary_utils.generate_descriptives, True, True),
+            ('summarise_firstlevel', functools.partial(summary_utils.summarise_firstlevel, voxels=voxels), True, True),
+            ('summarise_univariate', summary_utils.summarise_univariate, True, True),
+            ('summarise_behavior', summary_utils.summarise_behavior, False, True),
+            ('summarise_secondlevel', summary_utils.summarise_secondlevel, False, True),
+            ('summarise_sfnr_profiles', summary_utils.summarise_sfnr_profiles, False, True),
+            ('summarise_coder_reliability', summary_utils.summarise_coder_reliability, False, True),
+            ]
+
+
+# Parse a scale name or TRs:XxYxZ
+def parse_scale(scale):
+
+    if scale in SCALES:
+        return SCALES[scale]
+
+    TR_num, matrix = scale.split(':')
+    return int(TR_num), tuple(int(dim) for dim in matrix.split('x'))
+
+
+# Save a volume as a float32 NIfTI
+def save_nifti(volume, file_name):
+
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    nibabel.save(nibabel.Nifti1Image(volume.astype(np.float32), np.eye(4)), file_name)
+
+
+# Save a random image as a PNG (the size of a typical plot)
+def save_png(file_name, rng, size=(640, 480)):
+
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(file_name)
+
+
+# Save a text file
+def save_text(text, file_name):
+
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, 'w') as fid:
+        fid.write(text)
+
+
+# Make the eye tracking codes: every coder codes the same frames with some disagreement and missing frames
+def make_eye_data(rng, coder_num, trial_num=20, frame_num=100):
+
+    aggregate = np.empty((1, trial_num), dtype=object)
+    timing = np.empty((1, trial_num), dtype=object)
+    for trial_counter in range(trial_num):
+        codes = np.tile(rng.integers(0, 4, frame_num), (coder_num, 1)).astype(float)
+        disagree = rng.random(codes.shape) < 0.1
+        codes[disagree] = rng.integers(0, 4, disagree.sum())
+        codes[rng.random(codes.shape) < 0.05] = np.nan
+        aggregate[0, trial_counter] = codes
+        timing[0, trial_counter] = np.cumsum(rng.random((frame_num, 2)), 0)
+
+    coder_names = np.empty((1, coder_num), dtype=object)
+    for coder_counter in range(coder_num):
+        coder_names[0, coder_counter] = 'Coder_%s_1.mat' % (chr(ord('A') + coder_counter) * 2)
+
+    reliability = {'Experiment': {'Intraframe_all': rng.random((1, coder_num)), 'Interframe_all': rng.random((1, coder_num))}}
+
+    return {'Coder_name': coder_names,
+            'Coder_ConditionList': np.ones((1, coder_num)),
+            'IncludedCoders': np.arange(1, coder_num + 1)[np.newaxis],
+            'Reliability': reliability,
+            'Aggregate': {'Experiment': aggregate},
+            'Timing': {'Experiment': timing},
+            }
+
+
+# Make a synthetic subject directory with run_num runs of TR_num TRs and the given matrix size
+def make_subject(subject_dir, TR_num=60, matrix=(64, 64, 36), run_num=2, coder_num=3, seed=0):
+
+    rng = np.random.default_rng(seed)
+    subject = os.path.basename(os.path.normpath(subject_dir))
+    anatomical_matrix = tuple(int(dim * 1.5) for dim in matrix)
+
+    brain_mask = np.zeros(matrix)
+    brain_mask[matrix[0] // 6:-matrix[0] // 6, matrix[1] // 6:-matrix[1] // 6, matrix[2] // 6:-matrix[2] // 6] = 1
+
+    for run_counter in range(1, run_num + 1):
+        func_run = '%02d' % run_counter
+        functional = rng.random(matrix + (TR_num,), dtype=np.float32) * 100 + 1000
+        save_nifti(functional, '%s/data/nifti/%s_functional%s.nii.gz' % (subject_dir, subject, func_run))
+
+        save_text('<?xml version="1.0"?>\n<events>\n <event>\n  <value name="mean_snr_middle_slice">%0.2f</value>\n'
+                  '  <value name="mean_sfnr_middle_slice">%0.2f</value>\n  <value name="count_spikes">%d</value>\n </event>\n</events>\n'
+                  % (rng.random() * 100, rng.random() * 100, rng.integers(10)),
+                  '%s/data/qa/qa_events_%s_functional%s.bxh.xml' % (subject_dir, subject, func_run))
+
+        # Exclude 5% of TRs
+        confound_folder = '%s/analysis/firstlevel/Confounds/' % subject_dir
+        excluded_TRs = np.sort(rng.choice(TR_num, max(TR_num // 20, 1), replace=False))
+        confounds = np.zeros((TR_num, len(excluded_TRs)))
+        confounds[excluded_TRs, np.arange(len(excluded_TRs))] = 1
+        os.makedirs(confound_folder, exist_ok=True)
+        np.savetxt('%sMotionConfounds_functional%s.txt' % (confound_folder, func_run), confounds, fmt='%d')
+        for png_counter in range(3):
+            save_png('%sExcluded_TRs_functional%s_%d.png' % (confound_folder, func_run, png_counter), rng)
+        save_png('%sMotionMetric_fslmotion_3_functional%s.png' % (confound_folder, func_run), rng)
+        save_png('%sMotionPosition_functional%s.png' % (confound_folder, func_run), rng)
+
+        block_starts = np.arange(0, TR_num * 2, 30)
+        timing = np.column_stack((block_starts, np.full(len(block_starts), 12), rng.integers(0, 2, len(block_starts))))
+        os.makedirs('%s/analysis/firstlevel/Timing/' % subject_dir, exist_ok=True)
+        np.savetxt('%s/analysis/firstlevel/Timing/functional%s_Experiment.txt' % (subject_dir, func_run), timing, fmt='%d')
+
+        # The firstlevel feat folder
+        feat_folder = '%s/analysis/firstlevel/functional%s.feat/' % (subject_dir, func_run)
+        for func_name in ['prefiltered_func_data_raw', 'prefiltered_func_data_mcf', 'prefiltered_func_data_intnorm', 'filtered_func_data']:
+            save_nifti(functional + rng.random(functional.shape, dtype=np.float32), feat_folder + func_name + '.nii.gz')
+        save_nifti(brain_mask, feat_folder + 'sfnr_mask_prefiltered_func_data_st.nii.gz')
+        save_nifti(brain_mask * rng.random(matrix) * 200, feat_folder + 'sfnr_prefiltered_func_data_st.nii.gz')
+        save_png(feat_folder + 'filtered_func_data.ica/report/EVplot.png', rng)
+        for component_counter in range(10):
+            save_png(feat_folder + 'filtered_func_data.ica/report/IC_%d_prob.png' % component_counter, rng, (200, 150))
+        save_text('Components=1,3\n', feat_folder + 'feat_ICA-1.out')
+        save_nifti(rng.random(anatomical_matrix), feat_folder + 'reg/example_func2highres.nii.gz')
+        save_nifti(rng.random(anatomical_matrix), feat_folder + 'reg/highres.nii.gz')
+
+        # The univariate feat folder
+        univariate_folder = '%s/analysis/firstlevel/Exploration/functional%s_univariate.feat/' % (subject_dir, func_run)
+        save_png(univariate_folder + 'design.png', rng)
+        save_png(univariate_folder + 'Motion_TaskCorrelation.png', rng)
+        save_nifti(rng.standard_normal(matrix), univariate_folder + 'stats/zstat1.nii.gz')
+
+    # Behavioral files
+    behavioral_folder = '%s/analysis/Behavioral/' % subject_dir
+    for png_counter in range(4):
+        save_png('%sExperiment_%d.png' % (behavioral_folder, png_counter), rng)
+    analysed_data = {'FunctionalLength': np.full((1, run_num), (TR_num - 3) * 2.0),
+                     'FunctionalLength_Actual': np.full((1, run_num), float(TR_num)),
+                     'TR': np.full((1, run_num), 2.0),
+                     'BurnInTRNumber': np.array([[3.0]]),
+                     'Include_Run': np.ones((1, run_num)),
+                     'EyeData': make_eye_data(rng, coder_num),
+                     }
+    savemat(behavioral_folder + 'AnalysedData.mat', {'AnalysedData': analysed_data})
+
+    stacked_data = np.empty((1, 2), dtype=object)
+    stacked_labels = np.empty((1, 2), dtype=object)
+    for experiment_counter in range(2):
+        stacked_data[0, experiment_counter] = np.array([[rng.random() * 10]])
+        stacked_labels[0, experiment_counter] = 'Experiment_%d' % experiment_counter
+    savemat(behavioral_folder + 'ppt_stacked_data.mat', {'ppt_stacked_data': stacked_data, 'stacked_labels': stacked_labels})
+
+    # Secondlevel files
+    save_nifti(rng.random(anatomical_matrix), '%s/analysis/secondlevel/registration_ANTs/highres2standard.nii.gz' % subject_dir)
+    save_text('', '%s/analysis/secondlevel/FunctionalSplitter_Log' % subject_dir)
+    os.makedirs('%s/analysis/secondlevel_Experiment/default/Timing/' % subject_dir, exist_ok=True)
+    np.savetxt('%s/analysis/secondlevel_Experiment/default/Timing/Experiment_Only.txt' % subject_dir, timing, fmt='%d')
+
+
+# Remove everything that is cached (summaries, mosaics and MAT fields) so that the next run is cold. Files will still
+# be in the page cache
+def clear_caches():
+
+    clear_cache(CACHE_DIR)
+    for cache_folder in glob.glob('analysis/**/thumbnails/', recursive=True) + glob.glob('analysis/**/mat_fields/', recursive=True):
+        shutil.rmtree(cache_folder)
+
+
+# Time each summariser on the subject directory (the current directory), returning a list of rows
+def time_summarisers(scale_name, TR_num, matrix, repeats=1, plots=True, profile_file='benchmark_profile.jsonl'):
+
+    runs = summary_utils.find_runs()
+    summarisers = [(name, function, runs if per_run else [None]) for name, function, per_run, plotting in summariser_list(matrix) if plots or not plotting]
+
+    # Profiling appends, so start a new file to avoid counting the records of an earlier benchmark of this directory
+    if os.path.isfile(profile_file):
+        os.remove(profile_file)
+
+    enable_profiling(profile_file)
+    try:
+        for repeat in range(repeats):
+            for name, function, func_runs in summarisers:
+
+                # Run once without the cache and then again with the cache that run made
+                clear_caches()
+                for mode, use_cache in [('cold', False), ('warm', True)]:
+                    if mode == 'warm':
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            for func_run in func_runs:
+                                function(func_run, use_cache=True) if func_run is not None else function(use_cache=True)
+
+                    with profile_stage('benchmark', scale=scale_name, summariser=name, mode=mode, repeat=repeat, run_num=len(runs)):
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            for func_run in func_runs:
+                                function(func_run, use_cache=use_cache) if func_run is not None else function(use_cache=use_cache)
+                    plt.close('all')
+    finally:
+        disable_profiling()
+
+    rows = []
+    for record in load_profile(profile_file):
+        if record['stage'] != 'benchmark':
+            continue
+        row = dict(record['labels'])
+        row.update({'TR_num': TR_num, 'matrix': 'x'.join(str(dim) for dim in matrix)})
+        row.update({measure: record[measure] for measure in ['wall_time', 'cpu_time', 'bytes_read', 'peak_memory', 'max_rss', 'files_opened', 'globs']})
+        rows.append(row)
+
+    return rows
+
+
+# Make a subject directory for each scale in work_dir and time the summarisers on it. Returns a table with a row for
+# each scale, summariser, mode and repeat
+def benchmark(scales, work_dir, run_num=2, repeats=1, plots=True, keep=False):
+
+    rows = []
+    start_dir = os.getcwd()
+    for scale in scales:
+        TR_num, matrix = parse_scale(scale)
+        subject_dir = os.path.abspath(os.path.join(work_dir, 'sub-%s' % scale.replace(':', '_')))
+
+        print('Making %s: %d runs of %d TRs with a %s matrix' % (subject_dir, run_num, TR_num, 'x'.join(str(dim) for dim in matrix)))
+        make_subject(subject_dir, TR_num, matrix, run_num)
+
+        try:
+            os.chdir(subject_dir)
+            scale_rows = time_summarisers(scale, TR_num, matrix, repeats, plots)
+        finally:
+            os.chdir(start_dir)
+
+        if not keep:
+            shutil.rmtree(subject_dir)
+
+        for row in scale_rows:
+            row['voxel_TRs_per_second'] = row['run_num'] * TR_num * np.prod(matrix) / row['wall_time']
+            print('%-10s %-28s %-5s %8.3f s' % (scale, row['summariser'], row['mode'], row['wall_time']))
+        rows += scale_rows
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time the participant summary on synthetic subject directories')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], help='Named scales (%s) or TRs:XxYxZ' % ', '.join(SCALES))
+    parser.add_argument('--runs', type=int, default=2, help='Number of runs per subject')
+    parser.add_argument('--repeats', type=int, default=1, help='How many times to time each summariser')
+    parser.add_argument('--no_plots', action='store_true', help='Only time the describe_* functions (no plotting)')
+    parser.add_argument('--work_dir', default=None, help='Where to make the subject directories (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help="Don't delete the subject directories")
+    parser.add_argument('--output', default='results/benchmark_summary.csv', help='Where to save the timings (.csv or .parquet)')
+    args = parser.parse_args()
+
+    output_file = os.path.abspath(args.output)
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='benchmark_summary_')
+
+    try:
+        table = benchmark(args.scales, work_dir, args.runs, args.repeats, not args.no_plots, args.keep or args.work_dir is not None)
+    finally:
+        if args.work_dir is None and not args.keep:
+            shutil.rmtree(work_dir)
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    if output_file.endswith('.parquet'):
+        table.to_parquet(output_file, index=False)
+    else:
+        table.to_csv(output_file, index=False)
+    print('Saved %d timings to %s' % (len(table), output_file))
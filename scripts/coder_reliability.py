@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+## What-if analysis of excluding eye tracking coders across participants
+# Recompute the intraframe and interframe reliability of every coder in every session as if some coders were
+# excluded, rather than rerunning EyeTracking_Reliability.m for each participant. The agreement between every pair of
+# coders is cached per session (see prototype/link/scripts/reliability_utils.py) so, after the first run, changing the
+# excluded coders only takes a few array operations per session. The output is a table with a row for each session,
+# experiment and coder, like the aggregation in Aggregate_EyeData.m.
+#
+# Run this from the root directory ($PROJ_DIR). Example command (what would the reliability be without coder AB):
+# python scripts/coder_reliability.py --excluded_coders AB --output results/coder_reliability_without_AB.csv
+
+import os
+import sys
+import argparse
+import functools
+import concurrent.futures
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from reliability_utils import session_reliability
+from participant_catalogue import refresh_catalogue, find_sessions
+from participant_summary_core import default_workers
+
+# Get the initials of a coder from their file name (e.g. Coder_AB_1.mat), as Aggregate_EyeData.m does
+def coder_initials(coder_name):
+
+    if 'Coder_' not in coder_name:
+        return coder_name
+    return coder_name[coder_name.find('Coder_') + 6:coder_name.find('Coder_') + 8]
+
+
+# Make a table of the reliability of each coder in a session. This is run by each worker
+def session_table(session, excluded_coders=None, use_cache=True, subjects_dir='subjects/'):
+
+    reliability = session_reliability(os.path.join(subjects_dir, session), excluded_coders, use_cache)
+
+    rows = []
+    for experiment_counter, experiment in enumerate(reliability['experiments']):
+        for coder_counter, coder_name in enumerate(reliability['coder_names']):
+            rows.append({'session': session,
+                         'experiment': experiment,
+                         'coder': coder_initials(coder_name),
+                         'coder_name': coder_name,
+                         'in_subset': bool(reliability['subset'][coder_counter]),
+                         'included': bool(reliability['included'][coder_counter]),
+                         'intraframe': reliability['intraframe'][experiment_counter, coder_counter],
+                         'interframe': reliability['interframe'][experiment_counter, coder_counter],
+                         })
+
+    return rows
+
+
+# Compute the reliability of every coder in each session, excluding the coders with any of excluded_coders in their
+# names (as well as the ignored coders). Sessions are processed in parallel
+def reliability_what_if(sessions, excluded_coders=None, workers=None, use_cache=True, subjects_dir='subjects/'):
+
+    if workers is None:
+        workers = default_workers()
+
+    table_func = functools.partial(session_table, excluded_coders=excluded_coders, use_cache=use_cache, subjects_dir=subjects_dir)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        rows = [row for session_rows in executor.map(table_func, sessions) for row in session_rows]
+
+    return pd.DataFrame(rows, columns=['session', 'experiment', 'coder', 'coder_name', 'in_subset', 'included', 'intraframe', 'interframe'])
+
+
+# Summarise the table for each coder across sessions
+def coder_summary(table):
+
+    summary = table.groupby('coder').agg(sessions=('session', 'nunique'), intraframe=('intraframe', 'mean'), interframe=('interframe', 'mean'))
+    summary.insert(1, 'included_sessions', table[table['included']].groupby('coder')['session'].nunique().reindex(summary.index, fill_value=0))
+
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Recompute the eye tracking coder reliability as if some coders were excluded')
+    parser.add_argument('--excluded_coders', nargs='+', default=None, help='Exclude coders with these strings in their names (e.g. initials)')
+    parser.add_argument('--included_sessions', nargs='+', default=None, help='Only include sessions containing these strings')
+    parser.add_argument('--excluded_sessions', nargs='+', default=None, help='Exclude sessions containing these strings')
+    parser.add_argument('--output', default=None, help='Where to save the table of reliabilities (.csv or .parquet)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all allocated cores)')
+    parser.add_argument('--no_cache', action='store_true', help='Recount the coder agreement rather than using the cache')
+    args = parser.parse_args()
+
+    # Identify the participants
+    refresh_catalogue()
+    sessions = list(find_sessions(args.included_sessions, args.excluded_sessions)['session'])
+
+    table = reliability_what_if(sessions, args.excluded_coders, args.workers, not args.no_cache)
+    print(coder_summary(table).to_string())
+
+    if args.output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        if args.output.endswith('.parquet'):
+            table.to_parquet(args.output, index=False)
+        else:
+            table.to_csv(args.output, index=False)
+        print('Saved the reliability of %d coders from %d sessions to %s' % (table['coder'].nunique(), len(sessions), args.output))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+## Compute the DICE and Jaccard similarity of every label in two label volumes
+# Both volumes are loaded once and a confusion matrix of labels (how many voxels have label i in the first volume and
+# label j in the second) is counted in a single pass with bincount. The overlap of every label, and of a range of
+# labels, is then read off the confusion matrix. Many pairs of volumes (e.g. segmentations from different coders or
+# participants) can be compared in parallel and stored as a table with one row per pair and label.
+#
+# As with compute_DICE.sh, if a single number is provided as a third argument the DICE for only that label is
+# printed, and if a fourth number is provided the third and fourth arguments are used as a range of labels. A single
+# pair prints the same line as compute_DICE.sh (truncated to 3 decimals, as bc does) unless --labels is used to print
+# the overlap of each label as well. Example command:
+# python scripts/compute_overlap.py group/MTL_practice/sub-02_t2_avg_brain-CE.nii.gz group/MTL_practice/sub-02_t2_avg_brain-BS.nii.gz 2
+#
+# To compare many pairs, list them (two file names per line) in a text file:
+# python scripts/compute_overlap.py --pairs group/MTL_practice/pairs.txt --output results/MTL_overlap.csv --workers 8
+
+import os
+import sys
+import argparse
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import nibabel
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from participant_summary_core import default_workers
+
+# Load a label volume. The values aren't rounded (like fslmaths -thr/-uthr) but are stored as integers if they all are
+def load_labels(label_file):
+
+    labels = np.asanyarray(nibabel.load(label_file).dataobj).ravel()
+    if labels.dtype.kind == 'f' and np.all(np.mod(labels, 1) == 0):
+        labels = labels.astype(np.int64)
+
+    return labels
+
+
+# Count how many voxels have each pair of labels, returning the confusion matrix (first volume by second volume) and
+# the label that each row/column corresponds to
+def label_confusion(labels_1, labels_2):
+
+    labels_1 = np.asarray(labels_1).ravel()
+    labels_2 = np.asarray(labels_2).ravel()
+
+    if labels_1.shape != labels_2.shape:
+        raise ValueError('Volumes have different numbers of voxels (%d and %d)' % (len(labels_1), len(labels_2)))
+
+    # Index the labels that are in either volume
+    label_values, label_idxs = np.unique(np.concatenate((labels_1, labels_2)), return_inverse=True)
+    label_num = len(label_values)
+    idxs_1 = label_idxs[:len(labels_1)]
+    idxs_2 = label_idxs[len(labels_1):]
+
+    confusion = np.bincount(idxs_1 * label_num + idxs_2, minlength=label_num ** 2).reshape(label_num, label_num)
+
+    return confusion, label_values
+
+
+# Which labels are between lower_thr and upper_thr (inclusive). Zero is never a label, as fslmaths -bin ignores it
+def included_labels(label_values, lower_thr=1, upper_thr=None):
+
+    included = (label_values >= lower_thr) & (label_values != 0)
+    if upper_thr is not None:
+        included &= label_values <= upper_thr
+
+    return included
+
+
+# Calculate the overlap of each label (ignoring labels below lower_thr or above upper_thr) from the confusion matrix.
+# Returns a table with a row per label
+def label_overlap(confusion, label_values, lower_thr=1, upper_thr=None):
+
+    count_1 = confusion.sum(1)
+    count_2 = confusion.sum(0)
+    intersection = np.diag(confusion)
+    union = count_1 + count_2 - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table = pd.DataFrame({'label': label_values,
+                              'vol_1_count': count_1,
+                              'vol_2_count': count_2,
+                              'intersection': intersection,
+                              'dice': 2 * intersection / (count_1 + count_2),
+                              'jaccard': intersection / union,
+                              })
+
+    return table[included_labels(label_values, lower_thr, upper_thr)].reset_index(drop=True)
+
+
+# Calculate the overlap of all of the labels in a range taken together, like compute_DICE.sh: a voxel matches if it has
+# the same label in both volumes and that label is in the range. The voxel counts are returned too
+def range_overlap(confusion, label_values, lower_thr=1, upper_thr=None):
+
+    included = included_labels(label_values, lower_thr, upper_thr)
+
+    count_1 = confusion[included].sum()
+    count_2 = confusion[:, included].sum()
+    intersection = np.diag(confusion)[included].sum()
+    total = count_1 + count_2
+
+    return {'vol_1_count': count_1,
+            'vol_2_count': count_2,
+            'intersection': intersection,
+            'dice': 2 * intersection / total if total > 0 else np.nan,
+            'jaccard': intersection / (total - intersection) if total > 0 else np.nan,
+            }
+
+
+# Format the DICE of a range the way compute_DICE.sh did with bc (scale=3): truncated rather than rounded, without a
+# leading zero (e.g. .899) and empty if there are no labelled voxels (bc fails to divide by zero)
+def legacy_dice(overlap, scale=3):
+
+    total = overlap['vol_1_count'] + overlap['vol_2_count']
+    if total == 0:
+        return ''
+
+    truncated = int(2 * overlap['intersection'] * 10 ** scale // total)
+    if truncated == 0:
+        return '0'
+
+    dice = '%d.%0*d' % (truncated // 10 ** scale, scale, truncated % 10 ** scale)
+    return dice[1:] if dice.startswith('0') else dice
+
+
+# Compute the overlap of every label for a pair of volumes. This is run by each worker
+def compare_volumes(vol_1, vol_2, lower_thr=1, upper_thr=None):
+
+    confusion, label_values = label_confusion(load_labels(vol_1), load_labels(vol_2))
+    table = label_overlap(confusion, label_values, lower_thr, upper_thr)
+
+    table.insert(0, 'vol_2', vol_2)
+    table.insert(0, 'vol_1', vol_1)
+
+    return table
+
+
+# Compare each pair of volumes in parallel and return a table with a row for each pair and label
+def compare_pairs(pairs, lower_thr=1, upper_thr=None, workers=None):
+
+    if workers is None:
+        workers = default_workers()
+
+    vols_1 = [pair[0] for pair in pairs]
+    vols_2 = [pair[1] for pair in pairs]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        tables = list(executor.map(compare_volumes, vols_1, vols_2, [lower_thr] * len(pairs), [upper_thr] * len(pairs)))
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=['vol_1', 'vol_2', 'label', 'vol_1_count', 'vol_2_count', 'intersection', 'dice', 'jaccard'])
+
+    return pd.concat(tables, ignore_index=True)
+
+
+# Read the pairs of volumes to compare from a text file with two file names per line
+def read_pairs(pairs_file):
+
+    pairs = []
+    with open(pairs_file) as fid:
+        for line in fid:
+            if len(line.split()) == 2:
+                pairs.append(tuple(line.split()))
+
+    return pairs
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute the DICE and Jaccard similarity of each label in pairs of label volumes')
+    parser.add_argument('volumes', nargs='*', help='Two volumes, optionally followed by a label or the lower and upper label of a range')
+    parser.add_argument('--pairs', default=None, help='Text file listing pairs of volumes to compare (two per line)')
+    parser.add_argument('--output', default=None, help='Where to save the table of overlaps (.csv or .parquet)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all allocated cores)')
+    parser.add_argument('--labels', action='store_true', help='For a single pair, also print the overlap of each label')
+    args = parser.parse_args()
+
+    # Is there one label, or a range of labels, that you want to consider and ignore the rest?
+    lower_thr = 1
+    upper_thr = None
+    if args.pairs is not None:
+        pairs = read_pairs(args.pairs)
+        thresholds = args.volumes
+    else:
+        pairs = [tuple(args.volumes[:2])]
+        thresholds = args.volumes[2:]
+    if len(thresholds) > 0:
+        lower_thr = float(thresholds[0])
+        upper_thr = float(thresholds[-1])
+
+    # A single pair is printed like compute_DICE.sh
+    if len(pairs) == 1 and args.output is None:
+        confusion, label_values = label_confusion(load_labels(pairs[0][0]), load_labels(pairs[0][1]))
+        if args.labels:
+            print(label_overlap(confusion, label_values, lower_thr, upper_thr).to_string(index=False))
+        print('DICE similarity between is %s' % legacy_dice(range_overlap(confusion, label_values, lower_thr, upper_thr)))
+
+    else:
+        table = compare_pairs(pairs, lower_thr, upper_thr, args.workers)
+
+        if args.output is None:
+            print(table.to_string(index=False))
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            if args.output.endswith('.parquet'):
+                table.to_parquet(args.output, index=False)
+            else:
+                table.to_csv(args.output, index=False)
+            print('Saved the overlap of %d labels from %d pairs to %s' % (len(table), len(pairs), args.output))
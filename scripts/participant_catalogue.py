@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+## Keep a catalogue of every session in subjects/ in a SQLite database
+# Participant_Index.m and the summary scripts find sessions, runs and QA by listing folders and globbing on every call,
+# which is slow on a shared filesystem. Instead, this scans each session once and stores the age (from
+# scripts/Participant_Data.txt), experiments (analysis/secondlevel_*), runs (with their TR number, QA SNR/SFNR, whether
+# the run was excluded and how many TRs were excluded) and blocks (from the timing files, with how many were included
+# and excluded) in results/participant_catalogue.sqlite. When it is refreshed, a session is only rescanned if one of
+# the files or folders it was built from has changed size or modification time.
+#
+# Run this from the root directory ($PROJ_DIR). To refresh the catalogue and list the sessions that meet criteria
+# (like Participant_Index.m):
+# python scripts/participant_catalogue.py --included_sessions dev --max_age 36 --min_included_blocks 2
+#
+# Or from python:
+# from participant_catalogue import refresh_catalogue, find_sessions
+# refresh_catalogue()
+# find_sessions(included_sessions=['dev'], max_age=36, min_included_blocks=2)
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+import nibabel
+
+# Reuse the readers of the summary scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from summary_cache import source_signature
+from qa_parsers import parse_qa_xml, first_metric
+from confound_utils import load_confounds
+
+CATALOGUE_FILE = 'results/participant_catalogue.sqlite'
+PARTICIPANT_DATA = 'scripts/Participant_Data.txt'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, age REAL, info TEXT, run_num INTEGER, signature TEXT);
+CREATE TABLE IF NOT EXISTS experiments (session TEXT, experiment TEXT);
+CREATE TABLE IF NOT EXISTS runs (session TEXT, func_run TEXT, nifti_file TEXT, TR_num INTEGER, qa_file TEXT, snr REAL,
+                                 sfnr REAL, excluded_run INTEGER, excluded_TR_num INTEGER);
+CREATE TABLE IF NOT EXISTS blocks (session TEXT, func_run TEXT, block_name TEXT, included INTEGER, excluded INTEGER);
+CREATE INDEX IF NOT EXISTS experiments_session ON experiments (session);
+CREATE INDEX IF NOT EXISTS runs_session ON runs (session);
+CREATE INDEX IF NOT EXISTS blocks_session ON blocks (session);
+'''
+
+# Open the catalogue, making it if it doesn't exist
+def connect(catalogue_file=CATALOGUE_FILE):
+
+    os.makedirs(os.path.dirname(os.path.abspath(catalogue_file)), exist_ok=True)
+    connection = sqlite3.connect(catalogue_file)
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+# List the names in a folder (an empty list if it doesn't exist)
+def list_folder(folder):
+
+    try:
+        return sorted(os.listdir(folder))
+    except OSError:
+        return []
+
+
+# Read the name, information and age (in months) of each session from Participant_Data.txt
+def read_participant_data(participant_data=PARTICIPANT_DATA):
+
+    participant_data_dict = {}
+    if not os.path.isfile(participant_data):
+        return participant_data_dict
+
+    with open(participant_data) as fid:
+        for line in fid:
+            words = line.split()
+            if len(words) >= 3:
+                try:
+                    participant_data_dict[words[0]] = (words[1], float(words[2]))
+                except ValueError:
+                    participant_data_dict[words[0]] = (words[1], None)
+
+    return participant_data_dict
+
+
+# Scan a session folder, returning the rows for each table and the files and folders that were used. Each folder is
+# listed once rather than globbed for each pattern
+def scan_session(session_dir):
+
+    session = os.path.basename(os.path.normpath(session_dir))
+    nifti_dir = os.path.join(session_dir, 'data/nifti/')
+    qa_dir = os.path.join(session_dir, 'data/qa/')
+    analysis_dir = os.path.join(session_dir, 'analysis/')
+    firstlevel_dir = os.path.join(analysis_dir, 'firstlevel/')
+    pseudorun_dir = os.path.join(firstlevel_dir, 'pseudorun/')
+    timing_dir = os.path.join(firstlevel_dir, 'Timing/')
+    confound_dir = os.path.join(firstlevel_dir, 'Confounds/')
+    sources = [session_dir, nifti_dir, qa_dir, analysis_dir, firstlevel_dir, pseudorun_dir, timing_dir, confound_dir]
+
+    # What experiments did this session do
+    experiments = [(session, name[len('secondlevel_'):]) for name in list_folder(analysis_dir) if name.startswith('secondlevel_')]
+
+    # Find the runs and pseudoruns
+    func_files = [nifti_dir + name for name in list_folder(nifti_dir) if name.find('_functional') > -1 and name.endswith('.nii.gz')]
+    func_files += [pseudorun_dir + name for name in list_folder(pseudorun_dir) if name.endswith('.nii.gz')]
+
+    qa_names = set(list_folder(qa_dir))
+    firstlevel_names = set(list_folder(firstlevel_dir))
+    timing_names = list_folder(timing_dir)
+    confound_names = set(list_folder(confound_dir))
+
+    runs = []
+    blocks = []
+    for func_file in func_files:
+        func_name = os.path.basename(func_file)
+        func_run = func_name[func_name.find('functional') + 10:func_name.find('.nii.gz')]
+        sources.append(func_file)
+
+        TR_num = nibabel.load(func_file).shape[3]
+
+        # Get the QA (using the first part if the run was split)
+        qa_file = None
+        snr = sfnr = None
+        for qa_name in ['qa_events_%s_functional%s.bxh.xml' % (session, func_run), 'qa_events_%s_functional%s_part1.bxh.xml' % (session, func_run)]:
+            if qa_name in qa_names:
+                qa_file = qa_dir + qa_name
+                metrics = parse_qa_xml(qa_file).metrics
+                snr = first_metric(metrics, 'mean_snr_middle_slice')
+                sfnr = first_metric(metrics, 'mean_sfnr_middle_slice')
+                sources.append(qa_file)
+                break
+
+        # How many TRs were excluded
+        excluded_TR_num = None
+        confound_name = 'MotionConfounds_functional%s.txt' % func_run
+        if confound_name in confound_names:
+            confound_mat = load_confounds(confound_dir + confound_name, TR_num)
+            excluded_TR_num = int((confound_mat.sum(1) > 0).sum())
+            sources.append(confound_dir + confound_name)
+
+        excluded_run = 'functional%s_excluded_run.fsf' % func_run in firstlevel_names
+        runs.append((session, func_run, func_file, TR_num, qa_file, snr, sfnr, int(excluded_run), excluded_TR_num))
+
+        # Count how many blocks were included and excluded in each timing file (ignoring event and condition files)
+        prefix = 'functional%s_' % func_run
+        for timing_name in timing_names:
+            if timing_name.startswith(prefix) and timing_name.endswith('.txt') and timing_name.find('Event') == -1 and timing_name.find('Condition') == -1:
+                timing_mat = np.loadtxt(timing_dir + timing_name, ndmin=2)
+                block_name = timing_name[len(prefix):-len('.txt')]
+                blocks.append((session, func_run, block_name, int(np.sum(timing_mat[:, 2] == 1)), int(np.sum(timing_mat[:, 2] == 0))))
+                sources.append(timing_dir + timing_name)
+
+    return {'session': session, 'experiments': experiments, 'runs': runs, 'blocks': blocks, 'sources': sources}
+
+
+# Has anything this session was built from changed since it was stored
+def session_changed(stored_signature):
+
+    if stored_signature is None:
+        return True
+
+    stored_signature = [tuple(entry) for entry in json.loads(stored_signature)]
+    return stored_signature != source_signature([source for source, _, _ in stored_signature])
+
+
+# Update the catalogue with the sessions in subjects_dir, only rescanning the sessions that have changed (or all of
+# them if full is True). Sessions that no longer exist are removed. Returns the number of sessions that were scanned
+def refresh_catalogue(subjects_dir='subjects/', catalogue_file=CATALOGUE_FILE, participant_data=PARTICIPANT_DATA, full=False):
+
+    participant_data_dict = read_participant_data(participant_data)
+    session_dirs = [os.path.join(subjects_dir, name) for name in list_folder(subjects_dir) if not name.startswith('.') and os.path.isdir(os.path.join(subjects_dir, name))]
+
+    scanned_num = 0
+    with contextlib.closing(connect(catalogue_file)) as connection, connection:
+
+        stored = dict(connection.execute('SELECT session, signature FROM sessions'))
+
+        for session_dir in session_dirs:
+            session = os.path.basename(session_dir)
+            info, age = participant_data_dict.get(session, (None, None))
+
+            if full or session not in stored or session_changed(stored[session]):
+                scan = scan_session(session_dir)
+                signature = json.dumps(source_signature(scan['sources']))
+
+                for table in ['experiments', 'runs', 'blocks']:
+                    connection.execute('DELETE FROM %s WHERE session = ?' % table, (session,))
+                connection.executemany('INSERT INTO experiments VALUES (?, ?)', scan['experiments'])
+                connection.executemany('INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', scan['runs'])
+                connection.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?, ?)', scan['blocks'])
+                connection.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)', (session, age, info, len(scan['runs']), signature))
+                scanned_num += 1
+            else:
+                # The ages are always updated since Participant_Data.txt is cheap to read
+                connection.execute('UPDATE sessions SET age = ?, info = ? WHERE session = ?', (age, info, session))
+
+        # Remove sessions that have been deleted
+        removed = set(stored) - set(os.path.basename(session_dir) for session_dir in session_dirs)
+        for session in removed:
+            for table in ['sessions', 'experiments', 'runs', 'blocks']:
+                connection.execute('DELETE FROM %s WHERE session = ?' % table, (session,))
+
+    return scanned_num
+
+
+# Run a SQL query on the catalogue and return a table
+def query(sql, params=(), catalogue_file=CATALOGUE_FILE):
+
+    with contextlib.closing(connect(catalogue_file)) as connection:
+        return pd.read_sql_query(sql, connection, params=params)
+
+
+# SQL that is true if a block name starts with one of the experiment names (the timing files are named
+# functional<run>_<experiment>...txt, which is how Aggregate_FIR.m finds the runs of an experiment)
+def experiment_block_sql(experiments):
+
+    sql = '(' + ' OR '.join(['substr(block_name, 1, length(?)) = ?'] * len(experiments)) + ')'
+    params = [experiment for experiment in experiments for _ in range(2)]
+
+    return sql, params
+
+
+# Find the sessions that meet the criteria, like Participant_Index.m. Sessions without an age in Participant_Data.txt
+# are never included. included_sessions and excluded_sessions are lists of (part) names and experiments is a list of
+# experiment names that the session must have done at least one of. The SNR and SFNR criteria must be met by every run
+# in data/nifti (or only the runs of the experiments, if there are any) and runs without QA count as 0, so they fail a
+# minimum. min_included_blocks is the fewest included blocks the session must have (of the experiments if they are
+# specified). Returns a table with a row per session
+def find_sessions(included_sessions=None, excluded_sessions=None, min_age=0, max_age=np.inf, experiments=None,
+                  min_snr=0, max_snr=np.inf, min_sfnr=0, max_sfnr=np.inf, min_included_blocks=None, catalogue_file=CATALOGUE_FILE):
+
+    conditions = ['age IS NOT NULL']
+    params = []
+
+    if min_age > 0 or max_age < np.inf:
+        conditions.append('age >= ? AND age <= ?')
+        params += [min_age, max_age if max_age < np.inf else 1e308]
+
+    if included_sessions is not None:
+        conditions.append('(' + ' OR '.join(['instr(session, ?) > 0'] * len(included_sessions)) + ')')
+        params += list(included_sessions)
+
+    for excluded_session in excluded_sessions or []:
+        conditions.append('instr(session, ?) = 0')
+        params.append(excluded_session)
+
+    if experiments is not None:
+        conditions.append('session IN (SELECT session FROM experiments WHERE experiment IN (%s))' % ', '.join('?' * len(experiments)))
+        params += list(experiments)
+
+    # Every run that is checked has to meet the SNR and SFNR criteria. If the session has runs of the experiments then
+    # only those are checked, otherwise all of the runs in data/nifti are (pseudoruns have no QA)
+    if min_snr > 0 or max_snr < np.inf or min_sfnr > 0 or max_sfnr < np.inf:
+        run_sql = "SELECT session FROM runs WHERE instr(nifti_file, '/data/nifti/') > 0"
+        run_params = []
+        if experiments is not None:
+            block_sql, block_params = experiment_block_sql(experiments)
+            run_sql += (' AND (func_run IN (SELECT func_run FROM blocks WHERE blocks.session = runs.session AND %s)'
+                        ' OR NOT EXISTS (SELECT 1 FROM blocks WHERE blocks.session = runs.session AND %s))' % (block_sql, block_sql))
+            run_params += block_params * 2
+        run_sql += ' AND (COALESCE(snr, 0) < ? OR COALESCE(snr, 0) > ? OR COALESCE(sfnr, 0) < ? OR COALESCE(sfnr, 0) > ?)'
+        run_params += [min_snr, max_snr if max_snr < np.inf else 1e308, min_sfnr, max_sfnr if max_sfnr < np.inf else 1e308]
+        conditions.append('session NOT IN (%s)' % run_sql)
+        params += run_params
+
+    if min_included_blocks is not None:
+        block_sql = 'SELECT session FROM blocks'
+        block_params = []
+        if experiments is not None:
+            experiment_sql, block_params = experiment_block_sql(experiments)
+            block_sql += ' WHERE ' + experiment_sql
+        conditions.append('session IN (%s GROUP BY session HAVING SUM(included) >= ?)' % block_sql)
+        params += block_params + [min_included_blocks]
+
+    sql = 'SELECT * FROM sessions WHERE ' + ' AND '.join(conditions)
+
+    return query(sql + ' ORDER BY session', params, catalogue_file).drop(columns='signature')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Refresh the participant catalogue and list the sessions that meet the criteria')
+    parser.add_argument('--included_sessions', nargs='+', default=None, help='Only include sessions containing these strings')
+    parser.add_argument('--excluded_sessions', nargs='+', default=None, help='Exclude sessions containing these strings')
+    parser.add_argument('--min_age', type=float, default=0, help='Minimum age in months')
+    parser.add_argument('--max_age', type=float, default=np.inf, help='Maximum age in months')
+    parser.add_argument('--experiments', nargs='+', default=None, help='Only include sessions that did one of these experiments')
+    parser.add_argument('--min_snr', type=float, default=0)
+    parser.add_argument('--max_snr', type=float, default=np.inf)
+    parser.add_argument('--min_sfnr', type=float, default=0)
+    parser.add_argument('--max_sfnr', type=float, default=np.inf)
+    parser.add_argument('--min_included_blocks', type=int, default=None, help='Minimum number of included blocks')
+    parser.add_argument('--catalogue', default=CATALOGUE_FILE, help='Where the catalogue is stored')
+    parser.add_argument('--full', action='store_true', help='Rescan every session, not just those that have changed')
+    parser.add_argument('--no_refresh', action='store_true', help='Query the catalogue without checking for changes')
+    args = parser.parse_args()
+
+    if not args.no_refresh:
+        scanned_num = refresh_catalogue(catalogue_file=args.catalogue, full=args.full)
+        print('Rescanned %d sessions' % scanned_num)
+
+    sessions = find_sessions(args.included_sessions, args.excluded_sessions, args.min_age, args.max_age, args.experiments,
+                             args.min_snr, args.max_snr, args.min_sfnr, args.max_sfnr, args.min_included_blocks, args.catalogue)
+
+    print('\nParticipants who meet the criteria:')
+    for session in sessions['session']:
+        print(session)
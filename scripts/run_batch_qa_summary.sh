@@ -0,0 +1,18 @@
+#!/bin/bash
+#
+# Summarise the QA of all participants into a single table with batch_qa_summary.py
+# Any inputs are passed to batch_qa_summary.py
+#
+# Example command: 
+# "sbatch ./scripts/run_batch_qa_summary.sh --output results/qa_summary.parquet"
+
+#SBATCH --output=./logs/batch_qa_summary-%j.out
+#SBATCH -p short
+#SBATCH -t 2:00:00
+#SBATCH --cpus-per-task 16
+#SBATCH --mem 32000
+
+# Set up the environment
+source globals.sh
+
+python scripts/batch_qa_summary.py --workers ${SLURM_CPUS_PER_TASK:-1} "$@"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+## Compute the SFNR profile across slices for every run of every participant in subjects/
+# This runs session_profiles (from prototype/link/scripts/sfnr_profile_utils.py, a python version of
+# Analysis_SFNR_gradient.m) for each participant in parallel, rather than looping over the subject directories by hand,
+# and stacks the profiles of all runs into one .npz file. Each row of the mean, std, count and distribution arrays is a
+# run, identified by the session and run arrays, and runs with fewer slices are padded with NaN.
+#
+# Run this from the root directory ($PROJ_DIR). Example command:
+# python scripts/sfnr_profiles.py --output results/sfnr_profiles.npz --workers 16
+
+import os
+import sys
+import glob
+import argparse
+import functools
+import concurrent.futures
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts'))
+from sfnr_profile_utils import session_profiles, stack_profiles, save_profiles, PROFILE_AXIS
+from participant_summary_core import default_workers
+
+# Compute the profiles of every run in a session, returning a list with a dictionary for each run. This is run by
+# each worker
+def subject_profiles(subject_dir, axis=PROFILE_AXIS, use_cache=True):
+
+    subject = os.path.basename(os.path.normpath(subject_dir))
+    profiles = session_profiles(subject_dir, axis, use_cache)
+
+    runs = []
+    for run_counter, run in enumerate(profiles['runs']):
+        run_profile = {'session': subject, 'run': run, 'max_value': profiles['max_value'][run_counter]}
+
+        # Remove the padding so that each run can be padded to the longest run of any session
+        slice_num = int(np.sum(~np.isnan(profiles['count'][run_counter])))
+        for key in ['mean', 'std', 'count', 'distribution']:
+            run_profile[key] = profiles[key][run_counter, :slice_num]
+        runs.append(run_profile)
+
+    return runs
+
+
+# Compute the profiles of all of the participants in parallel and stack them in to arrays with one row per run
+def batch_profiles(subject_dirs, axis=PROFILE_AXIS, workers=None, use_cache=True):
+
+    if workers is None:
+        workers = default_workers()
+
+    subject_dirs = [os.path.abspath(subject_dir) for subject_dir in subject_dirs]
+
+    runs = []
+    profile_func = functools.partial(subject_profiles, axis=axis, use_cache=use_cache)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for subject_runs in executor.map(profile_func, subject_dirs):
+            runs += subject_runs
+
+    profiles = {'session': np.array([run['session'] for run in runs]),
+                'run': np.array([run['run'] for run in runs]),
+                'max_value': np.array([run['max_value'] for run in runs]),
+                }
+    for key in ['mean', 'std', 'count', 'distribution']:
+        profiles[key] = stack_profiles(runs, key)
+
+    return profiles
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compute the SFNR profile across slices for every run of every participant')
+    parser.add_argument('subjects', nargs='*', help='Participants to include (default: everyone in subjects/)')
+    parser.add_argument('--output', default='results/sfnr_profiles.npz', help='Where to save the profiles (.npz)')
+    parser.add_argument('--axis', type=int, default=PROFILE_AXIS, help='Which axis the profile is along (default: 1, Y)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all allocated cores)')
+    parser.add_argument('--no_cache', action='store_true', help='Recompute all profiles rather than using analysis/summary_cache/')
+    args = parser.parse_args()
+
+    if len(args.subjects) > 0:
+        subject_dirs = [os.path.join('subjects', subject) for subject in args.subjects]
+    else:
+        subject_dirs = sorted(subject_dir for subject_dir in glob.glob('subjects/*') if os.path.isdir(subject_dir))
+
+    profiles = batch_profiles(subject_dirs, args.axis, args.workers, not args.no_cache)
+    save_profiles(profiles, args.output)
+
+    print('Saved the SFNR profiles of %d runs from %d participants to %s' % (len(profiles['run']), len(subject_dirs), args.output))
@@ -0,0 +1,13 @@
+## Make the python ports importable in the tests
+# The pipeline's python utilities live in prototype/link/scripts (linked into every participant) and the project level
+# scripts live in scripts/, so both are added to the path the same way the scripts themselves do.
+#
+# Run the tests from the root directory ($PROJ_DIR):
+# python -m pytest -q tests
+
+import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT_DIR, 'prototype', 'link', 'scripts'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'scripts'))
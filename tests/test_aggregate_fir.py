@@ -0,0 +1,79 @@
+## Check aggregate_fir.py against the arithmetic of Aggregate_FIR.m
+
+import os
+import numpy as np
+from scipy.io import savemat
+from aggregate_fir import accumulator, accumulate, accumulator_result, aggregate_fir
+
+
+# What Aggregate_FIR.m does with the participant time courses (one per row). nanstd of a single value is 0 in matlab
+def matlab_mean_sem(pe_mean_ppt):
+
+    pe_mean_ppt = np.asarray(pe_mean_ppt, dtype=np.float64)
+    mean = np.full(pe_mean_ppt.shape[1], np.nan)
+    std = np.full(pe_mean_ppt.shape[1], np.nan)
+    for column in range(pe_mean_ppt.shape[1]):
+        values = pe_mean_ppt[~np.isnan(pe_mean_ppt[:, column]), column]
+        if len(values) > 0:
+            mean[column] = values.mean()
+            std[column] = values.std(ddof=1) if len(values) > 1 else 0
+
+    return mean, std / np.sqrt(pe_mean_ppt.shape[0])
+
+
+# The standard error is divided by the number of participants, not the number that aren't NaN
+def test_accumulator_matches_matlab():
+
+    pe_mean_ppt = np.random.default_rng(0).standard_normal((6, 6))
+    pe_mean_ppt[[1, 4], 2] = np.nan
+    pe_mean_ppt[:, 4] = np.nan
+    pe_mean_ppt[1:, 5] = np.nan
+
+    acc = accumulator(6)
+    for values in pe_mean_ppt:
+        accumulate(acc, values)
+    mean, sem = accumulator_result(acc)
+    matlab_mean, matlab_sem = matlab_mean_sem(pe_mean_ppt)
+
+    assert np.allclose(mean, matlab_mean, equal_nan=True)
+    assert np.allclose(sem, matlab_sem, equal_nan=True)
+
+
+# Save the FIR data and timing of a run
+def make_run(subjects_dir, participant, func_run, pe, blocks):
+
+    fir_dir = os.path.join(subjects_dir, participant, 'analysis/firstlevel/Exploration/functional%s_fir.feat/' % func_run)
+    timing_dir = os.path.join(subjects_dir, participant, 'analysis/firstlevel/Timing/')
+    os.makedirs(fir_dir)
+    os.makedirs(timing_dir, exist_ok=True)
+
+    pe = np.atleast_2d(pe)
+    savemat(fir_dir + 'FIR_data_Masktype_2.mat', {'pe_z': pe[0], 'masked_pe': pe, 'masked_psc_pe': pe,
+                                                  'masked_averaged': np.hstack((pe, pe[:, -1:])), 'design': np.arange(pe.shape[1] + 1.0)})
+    np.savetxt(os.path.join(subjects_dir, participant, 'analysis/firstlevel/Exploration/functional%s.txt' % func_run), np.ones((blocks, 3)))
+    np.savetxt(timing_dir + 'functional%s_Exp-1.txt' % func_run, np.ones((blocks, 3)))
+
+
+# Participants are weighted averages of their runs and those that are too short are reported and left out
+def test_aggregate_fir(tmp_path, capsys):
+
+    subjects_dir = str(tmp_path)
+    make_run(subjects_dir, 's1', '01', [[1, 2, 3, 4]], 1)
+    make_run(subjects_dir, 's1', '02', [[3, 4, 5, 6]], 3)
+    make_run(subjects_dir, 's1', '03', [[9, 9]], 3)
+    make_run(subjects_dir, 's2', '01', [[0, 1, 2, 3, 4]], 2)
+    make_run(subjects_dir, 's3', '01', [[5, 5, 5]], 2)
+
+    aggregate = aggregate_fir(['s1', 's2', 's3'], '2', 'Exp', workers=1, use_cache=False, subjects_dir=subjects_dir)
+    printed = capsys.readouterr().out
+
+    pe_mean_ppt = [[2.5, 3.5, 4.5, 5.5], [0, 1, 2, 3]]
+    assert aggregate['pe']['participants'] == ['s1', 's2']
+    assert np.allclose(aggregate['pe']['participant_means'], pe_mean_ppt)
+    assert np.allclose(aggregate['pe']['mean'], matlab_mean_sem(pe_mean_ppt)[0])
+    assert np.allclose(aggregate['pe']['sem'], matlab_mean_sem(pe_mean_ppt)[1])
+    assert aggregate['blocks_per_participant'] == {'s1': 4, 's2': 2, 's3': 2}
+    assert 'Not using run 03 of s1' in printed
+    assert 'Not including s3 in pe' in printed
+    assert 'Including s3' not in printed
+    assert np.allclose(aggregate['design'], [0, 1, 2, 3, 4])
@@ -0,0 +1,32 @@
+## Check that batch_qa_summary.py only makes numbers and reports participants that can't be summarised
+
+import os
+import glob
+from batch_qa_summary import summarise_subject
+from benchmark_summary import make_subject
+
+
+# No mosaics (or thumbnails/ folders) are made for the table
+def test_summarise_subject_makes_no_images(tmp_path, monkeypatch):
+
+    subject_dir = str(tmp_path / 'sub-01')
+    make_subject(subject_dir, TR_num=20, matrix=(16, 16, 9), run_num=2, coder_num=2)
+    monkeypatch.chdir(tmp_path)
+
+    rows = summarise_subject(subject_dir, use_cache=False)
+
+    assert sorted(row['func_run'] for row in rows) == ['01', '02']
+    assert all('error' not in row for row in rows)
+    assert all(row['TR_num'] == 20 for row in rows)
+    assert glob.glob(os.path.join(subject_dir, '**/thumbnails/'), recursive=True) == []
+
+
+# A participant directory that doesn't exist is an error row rather than stopping the batch
+def test_missing_subject(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    rows = summarise_subject(str(tmp_path / 'sub-missing'), use_cache=False)
+
+    assert len(rows) == 1
+    assert rows[0]['subject'] == 'sub-missing'
+    assert rows[0]['error'].startswith('FileNotFoundError: ')
@@ -0,0 +1,17 @@
+## Check that benchmark_summary.py only reports the timings of the current benchmark
+
+from benchmark_summary import make_subject, time_summarisers
+
+
+# Timing the same subject directory again gives a row per summariser and mode, not the rows of both benchmarks
+def test_time_summarisers_repeated(tmp_path, monkeypatch):
+
+    matrix = (16, 16, 9)
+    make_subject(str(tmp_path / 'sub-01'), TR_num=20, matrix=matrix, run_num=1, coder_num=2)
+    monkeypatch.chdir(tmp_path / 'sub-01')
+
+    first_rows = time_summarisers('test', 20, matrix, plots=False)
+    second_rows = time_summarisers('test', 20, matrix, plots=False)
+
+    assert len(first_rows) == len(second_rows) == 2 * 6
+    assert sorted((row['summariser'], row['mode']) for row in second_rows) == sorted((row['summariser'], row['mode']) for row in first_rows)
@@ -0,0 +1,91 @@
+## Check compute_overlap.py against hand counts and the arithmetic of the old compute_DICE.sh
+
+import numpy as np
+import nibabel
+from compute_overlap import load_labels, label_confusion, label_overlap, range_overlap, legacy_dice
+
+LABELS_1 = np.array([0, 1, 1, 2, 2, 2, 3, 0, 1, 2])
+LABELS_2 = np.array([0, 1, 2, 2, 2, 0, 3, 1, 1, 3])
+
+
+# What compute_DICE.sh computed with fslmaths: voxels in the range in each volume, and voxels with the same value that
+# are in the range in the first volume
+def shell_dice(vol_1, vol_2, lower_thr, upper_thr):
+
+    mask_1 = (vol_1 >= lower_thr) & (vol_1 <= upper_thr) & (vol_1 != 0)
+    mask_2 = (vol_2 >= lower_thr) & (vol_2 <= upper_thr) & (vol_2 != 0)
+    matches = (vol_1 == vol_2) & mask_1
+
+    return 2 * matches.sum() / (mask_1.sum() + mask_2.sum())
+
+
+# The confusion matrix counts each pair of labels
+def test_label_confusion_hand_count():
+
+    confusion, label_values = label_confusion(LABELS_1, LABELS_2)
+
+    assert list(label_values) == [0, 1, 2, 3]
+    assert confusion.tolist() == [[1, 1, 0, 0],
+                                  [0, 2, 1, 0],
+                                  [1, 0, 2, 1],
+                                  [0, 0, 0, 1]]
+
+
+# The DICE of label 2 by hand: 2 voxels in both, 4 in the first volume and 3 in the second
+def test_label_overlap_hand_count():
+
+    table = label_overlap(*label_confusion(LABELS_1, LABELS_2))
+    label_2 = table[table['label'] == 2].iloc[0]
+
+    assert list(table['label']) == [1, 2, 3]
+    assert (label_2['vol_1_count'], label_2['vol_2_count'], label_2['intersection']) == (4, 3, 2)
+    assert np.isclose(label_2['dice'], 2 * 2 / (4 + 3))
+    assert np.isclose(label_2['jaccard'], 2 / (4 + 3 - 2))
+
+
+# A range of labels is scored the same way as compute_DICE.sh, including a lower threshold of 0
+def test_range_overlap_matches_shell():
+
+    confusion, label_values = label_confusion(LABELS_1, LABELS_2)
+    for lower_thr, upper_thr in [(1, 100000), (2, 2), (2, 3), (0, 1)]:
+        overlap = range_overlap(confusion, label_values, lower_thr, upper_thr)
+        assert np.isclose(overlap['dice'], shell_dice(LABELS_1, LABELS_2, lower_thr, upper_thr))
+
+
+# Non integer values aren't rounded in to labels, they are thresholded as they are (like fslmaths -thr/-uthr)
+def test_non_integer_labels(tmp_path):
+
+    vol_1 = np.array([0, 1.4, 1.6, 2, 2.5], dtype=np.float32).reshape(5, 1, 1)
+    vol_2 = np.array([0, 1.4, 2, 2, 2.4], dtype=np.float32).reshape(5, 1, 1)
+    for name, vol in [('vol_1.nii.gz', vol_1), ('vol_2.nii.gz', vol_2)]:
+        nibabel.save(nibabel.Nifti1Image(vol, np.eye(4)), str(tmp_path / name))
+
+    labels_1 = load_labels(str(tmp_path / 'vol_1.nii.gz'))
+    labels_2 = load_labels(str(tmp_path / 'vol_2.nii.gz'))
+    overlap = range_overlap(*label_confusion(labels_1, labels_2), 1.5, 2.45)
+
+    assert np.isclose(overlap['dice'], shell_dice(vol_1.ravel(), vol_2.ravel(), 1.5, 2.45))
+    assert (overlap['vol_1_count'], overlap['vol_2_count'], overlap['intersection']) == (2, 3, 1)
+
+
+# Integer valued volumes saved as floats are loaded as integer labels
+def test_integer_labels_from_floats(tmp_path):
+
+    nibabel.save(nibabel.Nifti1Image(LABELS_1.astype(np.float32).reshape(10, 1, 1), np.eye(4)), str(tmp_path / 'labels.nii.gz'))
+
+    labels = load_labels(str(tmp_path / 'labels.nii.gz'))
+    assert labels.dtype == np.int64
+    assert list(labels) == list(LABELS_1)
+
+
+# bc with scale=3 truncates, drops the leading zero, prints 0 for zero and fails (printing nothing) without voxels
+def test_legacy_dice_format():
+
+    def overlap(intersection, total):
+        return {'vol_1_count': total, 'vol_2_count': 0, 'intersection': intersection}
+
+    assert legacy_dice(overlap(1799, 4000)) == '.899'
+    assert legacy_dice(overlap(1, 2)) == '1.000'
+    assert legacy_dice(overlap(1, 4000)) == '0'
+    assert legacy_dice(overlap(0, 0)) == ''
+    assert legacy_dice(overlap(50, 1000)) == '.100'
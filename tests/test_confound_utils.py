@@ -0,0 +1,139 @@
+## Check confound_utils.py against direct ports of the loops in motion_recovery.m and z_score_exclude.m
+
+import numpy as np
+import pytest
+from confound_utils import load_confounds, save_confounds, exclusion_matrix, excluded_TRs, recovery_idxs, recovery_sweep, motion_recovery, z_score_exclude
+
+TR_NUM = 20
+
+# Patterns of excluded TRs (0 based) including adjacent TRs, TRs within each other's recovery window and TRs whose
+# recovery window goes past the end of the run
+EXCLUDED_PATTERNS = [[], [5], [0], [19], [3, 4], [2, 4, 5, 6, 11], [0, 1, 17, 19], [8, 10, 12, 18]]
+
+
+# The loops of motion_recovery.m (0 based): for every excluded TR add each of the next recovery_TRs TRs that isn't
+# excluded, then drop the ones past the end of the run. Returns the output matrix
+def matlab_motion_recovery(input_mat, recovery_TRs):
+
+    confound_idxs = np.flatnonzero(input_mat[:, input_mat.sum(0) == 1].sum(1))
+
+    recovery_idxs = []
+    for confound_idx in confound_idxs:
+        for recovery_TR in range(1, recovery_TRs + 1):
+            if len(np.flatnonzero(confound_idxs == confound_idx + recovery_TR)) == 0:
+                recovery_idxs.append(confound_idx + recovery_TR)
+
+    recovery_idxs = [recovery_idx for recovery_idx in recovery_idxs if recovery_idx < input_mat.shape[0]]
+
+    output_mat = input_mat
+    for recovery_idx in recovery_idxs:
+        confound_vector = np.zeros((input_mat.shape[0], 1))
+        confound_vector[recovery_idx] = 1
+        output_mat = np.hstack((output_mat, confound_vector))
+
+    return output_mat
+
+
+# The z scoring in z_score_exclude.m (before the excluded TRs are interpolated)
+def matlab_z_score_exclude(brain, Excluded_TRs):
+
+    brain = np.array(brain, dtype=np.float64)
+    Included_TRs = np.setdiff1d(np.arange(brain.shape[-1]), Excluded_TRs)
+
+    brain[..., Excluded_TRs] = 0
+    brain_mean = brain[..., Included_TRs].mean(-1)
+    brain_std = brain[..., Included_TRs].std(-1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for TR_Counter in range(len(Included_TRs)):
+            brain[..., Included_TRs[TR_Counter]] = (brain[..., Included_TRs[TR_Counter]] - brain_mean) / brain_std
+    brain[np.isnan(brain)] = 0
+
+    return brain
+
+
+# A confound matrix with a column for each excluded TR after two motion parameter columns (which aren't exclusions)
+def make_confounds(excluded, seed=0):
+
+    motion_parameters = np.random.default_rng(seed).standard_normal((TR_NUM, 2))
+    return np.hstack((motion_parameters, exclusion_matrix(excluded, TR_NUM)))
+
+
+# The columns motion_recovery.m adds, without the repeats it makes for TRs in the window of two excluded TRs
+def unique_columns(confound_mat):
+
+    _, first_idxs = np.unique(confound_mat, axis=1, return_index=True)
+    return confound_mat[:, np.sort(first_idxs)]
+
+
+@pytest.mark.parametrize('recovery_TRs', [0, 1, 2, 4])
+@pytest.mark.parametrize('excluded', EXCLUDED_PATTERNS)
+def test_recovery_idxs_matches_matlab(excluded, recovery_TRs):
+
+    input_mat = make_confounds(excluded)
+    matlab_mat = matlab_motion_recovery(input_mat, recovery_TRs)
+    matlab_idxs = np.flatnonzero(matlab_mat[:, input_mat.shape[1]:].sum(1))
+
+    idxs = recovery_idxs(excluded_TRs(input_mat), recovery_TRs)
+    assert list(idxs) == list(matlab_idxs)
+    assert all(idx < TR_NUM for idx in idxs)
+
+
+# Save the confounds like the pipeline does, add the recovery TRs through the command line entry point (which gets
+# strings) and read the result back
+@pytest.mark.parametrize('excluded', EXCLUDED_PATTERNS[1:])
+def test_motion_recovery_round_trip(tmp_path, excluded):
+
+    input_file = str(tmp_path / 'MotionConfounds_functional01.txt')
+    output_file = str(tmp_path / 'MotionConfounds_recovery_functional01.txt')
+    input_mat = make_confounds(excluded)
+    save_confounds(input_mat, input_file)
+
+    output_mat = motion_recovery(input_file, output_file, '3')
+
+    matlab_mat = unique_columns(matlab_motion_recovery(load_confounds(input_file), 3))
+    assert np.allclose(load_confounds(output_file), matlab_mat, atol=1e-7)
+    assert np.allclose(output_mat, load_confounds(output_file), atol=1e-7)
+    assert np.allclose(load_confounds(output_file)[:, :input_mat.shape[1]], input_mat, atol=1e-7)
+
+
+# An empty confound file (no TRs were excluded) has no columns
+def test_load_empty_confounds(tmp_path):
+
+    confound_file = str(tmp_path / 'MotionConfounds_functional01.txt')
+    open(confound_file, 'w').close()
+
+    assert load_confounds(confound_file, TR_NUM).shape == (TR_NUM, 0)
+    assert not excluded_TRs(load_confounds(confound_file, TR_NUM)).any()
+
+
+# The number of TRs excluded with each number of recovery TRs is the same as running motion_recovery.m on each run
+def test_recovery_sweep_matches_matlab(tmp_path):
+
+    confound_files = []
+    for pattern_counter, excluded in enumerate(EXCLUDED_PATTERNS[1:]):
+        confound_files.append(str(tmp_path / ('MotionConfounds_functional%02d.txt' % pattern_counter)))
+        save_confounds(make_confounds(excluded, pattern_counter), confound_files[-1])
+
+    recovery_range = range(0, 6)
+    excluded_num = recovery_sweep(confound_files, recovery_range)
+
+    for file_counter, confound_file in enumerate(confound_files):
+        input_mat = load_confounds(confound_file)
+        for range_counter, recovery_TRs in enumerate(recovery_range):
+            matlab_mat = matlab_motion_recovery(input_mat, recovery_TRs)
+            assert excluded_num[file_counter, range_counter] == excluded_TRs(matlab_mat).sum()
+
+
+@pytest.mark.parametrize('excluded', EXCLUDED_PATTERNS)
+def test_z_score_exclude_matches_matlab(excluded):
+
+    data = np.random.default_rng(1).standard_normal((3, 2, 2, TR_NUM)) * 10 + 100
+
+    # A voxel with no variance over the included TRs
+    data[0, 0, 0] = 100
+
+    excluded_vector = np.zeros(TR_NUM, dtype=bool)
+    excluded_vector[excluded] = True
+
+    assert np.allclose(z_score_exclude(data, excluded_vector), matlab_z_score_exclude(data, excluded))
+    assert z_score_exclude(data.astype(np.float32), excluded_vector).dtype == np.float32
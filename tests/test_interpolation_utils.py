@@ -0,0 +1,152 @@
+## Check interpolation_utils.py against direct ports of interpolate_TRs.m and z_score_exclude.m
+
+import os
+import numpy as np
+import nibabel
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+from interpolation_utils import interpolation_matrix, interpolate_TRs, z_score_interpolate, process_run, excluded_from_confounds
+
+# Patterns of excluded TRs (0 based) including the first and last TRs and runs of consecutive TRs
+EXCLUDED_PATTERNS = [[3], [0], [11], [0, 1, 5, 6, 7, 11], [2, 3, 10, 11], [1, 3, 5, 7, 9]]
+
+
+# The loops of interpolate_TRs.m (with the TRs 1 based as they are in matlab)
+def matlab_interpolate(brain, Excluded_TRs, interpolation_type='mean_included'):
+
+    brain = np.array(brain, dtype=np.float64)
+    TR_num = brain.shape[-1]
+    Excluded_TRs = [TR + 1 for TR in Excluded_TRs]
+
+    for TR in Excluded_TRs:
+        if interpolation_type == 'mean':
+            Border_TRs = [Border_TR for Border_TR in [TR - 1, TR + 1] if 0 < Border_TR < TR_num]
+        else:
+            back_reference = 1
+            forward_reference = 1
+            while True:
+                Border_TRs = [Border_TR for Border_TR in [TR - back_reference, TR + forward_reference] if 0 < Border_TR <= TR_num]
+                if Border_TRs[0] not in Excluded_TRs and Border_TRs[-1] not in Excluded_TRs:
+                    break
+                elif Border_TRs[0] < TR and Border_TRs[0] in Excluded_TRs:
+                    back_reference += 1
+                elif Border_TRs[-1] in Excluded_TRs:
+                    forward_reference += 1
+
+        brain[..., TR - 1] = brain[..., [Border_TR - 1 for Border_TR in Border_TRs]].mean(-1)
+
+    return brain
+
+
+# What z_score_exclude.m does: z score each voxel over the included TRs, set the excluded TRs (and NaNs) to zero and
+# then interpolate the excluded TRs
+def matlab_z_score_exclude(brain, Excluded_TRs):
+
+    brain = np.array(brain, dtype=np.float64)
+    included = np.setdiff1d(np.arange(brain.shape[-1]), Excluded_TRs)
+
+    brain[..., Excluded_TRs] = 0
+    brain_mean = brain[..., included].mean(-1, keepdims=True)
+    brain_std = brain[..., included].std(-1, ddof=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        brain[..., included] = (brain[..., included] - brain_mean) / brain_std
+    brain[np.isnan(brain)] = 0
+
+    return matlab_interpolate(brain, Excluded_TRs)
+
+
+def excluded_vector(excluded_TRs, TR_num=12):
+
+    excluded = np.zeros(TR_num, dtype=bool)
+    excluded[excluded_TRs] = True
+    return excluded
+
+
+@pytest.mark.parametrize('interpolation_type', ['mean_included', 'mean'])
+@pytest.mark.parametrize('excluded_TRs', EXCLUDED_PATTERNS)
+def test_interpolate_TRs_matches_matlab(excluded_TRs, interpolation_type):
+
+    data = np.random.default_rng(0).standard_normal((3, 2, 12)) * 10 + 100
+    interpolated = interpolate_TRs(data, excluded_vector(excluded_TRs), interpolation_type)
+
+    assert np.allclose(interpolated, matlab_interpolate(data.astype(np.float32), excluded_TRs, interpolation_type), rtol=1e-5)
+
+
+# The weights of each excluded TR by hand: TR 5 is between included TRs 4 and 8 (0 based)
+def test_interpolation_weights_hand_count():
+
+    excluded = excluded_vector([5, 6, 7])
+
+    weights = interpolation_matrix(excluded, 'mean_included')
+    assert np.allclose(weights[5], np.eye(12)[[4, 8]].mean(0))
+    assert np.allclose(weights[:5], np.eye(12)[:5])
+
+    weights = interpolation_matrix(excluded, 'linear')
+    assert np.allclose(weights[5, [4, 8]], [0.75, 0.25])
+    assert np.allclose(weights[7, [4, 8]], [0.25, 0.75])
+
+    # Each replaced TR is used for the next one
+    weights = interpolation_matrix(excluded, 'mean')
+    assert np.allclose(weights[5], np.eye(12)[[4, 6]].mean(0))
+    assert np.allclose(weights[6], (weights[5] + np.eye(12)[7]) / 2)
+
+
+@pytest.mark.parametrize('excluded_TRs', EXCLUDED_PATTERNS)
+def test_z_score_interpolate_matches_matlab(excluded_TRs):
+
+    data = np.random.default_rng(1).standard_normal((3, 2, 12)) * 10 + 100
+    data[0, 0] = 100
+
+    zscored = z_score_interpolate(data, excluded_vector(excluded_TRs))
+    assert np.allclose(zscored, matlab_z_score_exclude(data.astype(np.float32), excluded_TRs), atol=1e-5)
+
+
+# Processing a file a block of slices at a time gives the same answer as processing it all at once
+def test_process_run_blocks(tmp_path):
+
+    data = np.random.default_rng(2).standard_normal((4, 3, 5, 12)).astype(np.float32) * 10 + 100
+    input_file = str(tmp_path / 'prefiltered_func_data.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), input_file)
+
+    excluded = excluded_vector([0, 5, 6])
+    output_file = str(tmp_path / 'interpolated.nii.gz')
+    process_run(input_file, output_file, lambda block: interpolate_TRs(block, excluded), chunk_values=4 * 3 * 12 * 2)
+
+    assert np.allclose(np.asarray(nibabel.load(output_file).dataobj), interpolate_TRs(data, excluded))
+
+
+# Like interpolate_TRs.m, only confound columns with a single 1 are used and the file must have a row for every TR
+def test_excluded_from_confounds(tmp_path):
+
+    confounds = np.zeros((12, 3))
+    confounds[[2, 7], [0, 1]] = 1
+    confounds[:, 2] = 1
+    confound_file = str(tmp_path / 'MotionConfounds_functional01.txt')
+    np.savetxt(confound_file, confounds, fmt='%d')
+
+    assert list(np.flatnonzero(excluded_from_confounds(confound_file, 12))) == [2, 7]
+    assert excluded_from_confounds(confound_file, 13) is None
+    assert list(np.flatnonzero(excluded_from_confounds([3, 4], 6))) == [3, 4]
+
+
+# The preview interpolates prefiltered_func_data_raw in the feat folder, like FEAT_prestats.sh, and reports a missing run
+def test_preview_interpolation(tmp_path, monkeypatch, capsys):
+
+    from participant_summary_utils import preview_interpolation
+
+    monkeypatch.chdir(tmp_path)
+    assert preview_interpolation('01', voxels=[(0, 0, 0)]) is None
+    assert "Can't find" in capsys.readouterr().out
+
+    data = np.random.default_rng(3).standard_normal((2, 2, 2, 12)).astype(np.float32) * 10 + 100
+    os.makedirs('analysis/firstlevel/functional01.feat/')
+    os.makedirs('analysis/firstlevel/Confounds/')
+    nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), 'analysis/firstlevel/functional01.feat/prefiltered_func_data_raw.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(data * 0, np.eye(4)), 'analysis/firstlevel/functional01.feat/prefiltered_func_data.nii.gz')
+    confounds = np.zeros((12, 1))
+    confounds[4] = 1
+    np.savetxt('analysis/firstlevel/Confounds/MotionConfounds_functional01.txt', confounds, fmt='%d')
+
+    interpolated = preview_interpolation('01', voxels=[(1, 0, 1)])
+    assert np.allclose(interpolated, interpolate_TRs(data[1, 0, 1], excluded_vector([4])))
@@ -0,0 +1,171 @@
+## Check that mat_utils.py reads the same fields as loading the whole MAT file and remakes its sidecar when it changes
+
+import os
+import numpy as np
+import h5py
+import pytest
+from scipy.io import savemat, loadmat
+import mat_utils
+from mat_utils import load_fields, mat_cache_dir
+from participant_summary_core import BEHAVIOR_FIELDS
+
+FIELDS = ['AnalysedData.' + field for field in BEHAVIOR_FIELDS] + ['AnalysedData.EyeData.Missing', 'AnalysedData.TR.Missing', 'Missing.TR']
+
+
+# An AnalysedData struct with the fields describe_behavior reads, two experiments of reliability and some eye tracking
+# data that isn't requested
+def make_analysed_data(TR=2.0, seed=0):
+
+    rng = np.random.default_rng(seed)
+    coder_names = np.empty((1, 3), dtype=object)
+    coder_names[0] = ['Coder_AA_1.mat', 'Coder_BB_1.mat', 'Coder_CC_1.mat']
+    aggregate = np.empty((1, 2), dtype=object)
+    aggregate[0] = [rng.random((3, 50)), rng.random((3, 40))]
+
+    return {'FunctionalLength': np.array([[100.0, 96.0]]),
+            'FunctionalLength_Actual': np.array([[53.0, 51.0]]),
+            'TR': np.array([[TR, TR]]),
+            'BurnInTRNumber': np.array([[3.0]]),
+            'Include_Run': np.array([[1.0, 0.0]]),
+            'EyeData': {'Coder_name': coder_names,
+                        'IncludedCoders': np.array([[1.0, 3.0]]),
+                        'Reliability': {'ExpA': {'Intraframe_all': rng.random((1, 3)), 'Interframe_all': rng.random((1, 3))},
+                                        'ExpB': {'Intraframe_all': rng.random((1, 3)), 'Interframe_all': rng.random((1, 3))}},
+                        'Aggregate': {'ExpA': aggregate},
+                        },
+            }
+
+
+# Write a value into a v7.3 MAT file the way MATLAB does: structs are groups, arrays are transposed (column major),
+# chars are uint16 and cells are datasets of references to nodes in #refs#
+def write_hdf5(h5_file, group, name, value):
+
+    if isinstance(value, dict):
+        node = group.create_group(name)
+        node.attrs['MATLAB_class'] = np.bytes_('struct')
+        for field, field_value in value.items():
+            write_hdf5(h5_file, node, field, field_value)
+
+    elif isinstance(value, str):
+        node = group.create_dataset(name, data=np.array([[ord(character)] for character in value], dtype=np.uint16))
+        node.attrs['MATLAB_class'] = np.bytes_('char')
+
+    elif value.dtype == object:
+        refs_group = h5_file.require_group('#refs#')
+        refs = []
+        for item in value.ravel(order='F'):
+            ref_name = 'ref_%d' % len(refs_group)
+            write_hdf5(h5_file, refs_group, ref_name, item)
+            refs.append(refs_group[ref_name].ref)
+        node = group.create_dataset(name, data=np.array(refs, dtype=h5py.ref_dtype).reshape(value.shape[::-1]))
+        node.attrs['MATLAB_class'] = np.bytes_('cell')
+
+    else:
+        node = group.create_dataset(name, data=np.asarray(value, dtype=np.float64).T)
+        node.attrs['MATLAB_class'] = np.bytes_('double')
+
+
+# Save a v7.3 MAT file, with the header MATLAB puts in the user block
+def save_hdf5_mat(mat_file, variables):
+
+    with h5py.File(mat_file, 'w', userblock_size=512) as h5_file:
+        for name, value in variables.items():
+            write_hdf5(h5_file, h5_file, name, value)
+
+    with open(mat_file, 'r+b') as fid:
+        fid.write(b'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: Mon Jan  1 00:00:00 2024 HDF5 schema 1.00 .'.ljust(128))
+
+
+# Follow a field through the variables of a full loadmat (with the default options), returning None if it doesn't exist
+def full_value(variables, field):
+
+    path = field.split('.')
+    if path[0] not in variables:
+        return None
+
+    value = variables[path[0]]
+    for field_counter, name in enumerate(path[1:]):
+        if value.dtype.names is None:
+            return None
+        if name == '*':
+            return {struct_field: full_value({'value': value[struct_field][0, 0]}, '.'.join(['value'] + path[field_counter + 2:])) for struct_field in value.dtype.names}
+        if name not in value.dtype.names:
+            return None
+        value = value[name][0, 0]
+
+    if value.dtype == object:
+        return [str(np.squeeze(item)) for item in value.ravel(order='F')]
+
+    return np.squeeze(value)
+
+
+# Compare a value read by load_fields to the one from the full loadmat
+def assert_same(value, expected):
+
+    if expected is None or isinstance(expected, list):
+        assert value == expected
+    elif isinstance(expected, dict):
+        assert sorted(value) == sorted(expected)
+        for key in expected:
+            assert_same(value[key], expected[key])
+    else:
+        assert np.allclose(value, expected)
+        assert np.shape(value) == np.shape(expected)
+
+
+@pytest.mark.parametrize('hdf5', [False, True])
+def test_fields_match_loadmat(tmp_path, hdf5):
+
+    mat_file = str(tmp_path / 'AnalysedData.mat')
+    variables = {'AnalysedData': make_analysed_data(), 'Other': np.arange(5.0)}
+    if hdf5:
+        save_hdf5_mat(mat_file, variables)
+        reference_file = str(tmp_path / 'AnalysedData_v7.mat')
+    else:
+        reference_file = mat_file
+    savemat(reference_file, variables)
+
+    full_variables = loadmat(reference_file)
+    for use_cache in [False, True, True]:
+        values = load_fields(mat_file, FIELDS, use_cache=use_cache)
+
+        assert list(values) == FIELDS
+        for field in FIELDS:
+            assert_same(values[field], full_value(full_variables, field))
+
+    assert values['AnalysedData.EyeData.Coder_name'] == ['Coder_AA_1.mat', 'Coder_BB_1.mat', 'Coder_CC_1.mat']
+    assert sorted(values['AnalysedData.EyeData.Reliability.*.Intraframe_all']) == ['ExpA', 'ExpB']
+
+
+# The sidecar is used until the MAT file changes and is then remade
+@pytest.mark.parametrize('hdf5', [False, True])
+def test_sidecar_rebuilt(tmp_path, monkeypatch, hdf5):
+
+    mat_file = str(tmp_path / 'AnalysedData.mat')
+    save_mat = save_hdf5_mat if hdf5 else savemat
+    save_mat(mat_file, {'AnalysedData': make_analysed_data(TR=2.0)})
+
+    # Count how often the MAT file is read
+    reads = []
+    read_fields = mat_utils.read_fields
+    monkeypatch.setattr(mat_utils, 'read_fields', lambda *args: reads.append(1) or read_fields(*args))
+
+    assert np.allclose(load_fields(mat_file, ['AnalysedData.TR'])['AnalysedData.TR'], 2.0)
+    assert np.allclose(load_fields(mat_file, ['AnalysedData.TR'])['AnalysedData.TR'], 2.0)
+    assert len(reads) == 1
+    sidecar_files = os.listdir(mat_cache_dir(mat_file))
+    assert len(sidecar_files) == 1
+
+    # Changing the MAT file remakes the sidecar
+    save_mat(mat_file, {'AnalysedData': make_analysed_data(TR=1.5)})
+    os.utime(mat_file, ns=(0, os.stat(mat_file).st_mtime_ns + 10 ** 9))
+
+    assert np.allclose(load_fields(mat_file, ['AnalysedData.TR'])['AnalysedData.TR'], 1.5)
+    assert np.allclose(load_fields(mat_file, ['AnalysedData.TR'])['AnalysedData.TR'], 1.5)
+    assert len(reads) == 2
+    assert os.listdir(mat_cache_dir(mat_file)) == sidecar_files
+
+    # Only touching it (the contents are the same) also remakes it
+    os.utime(mat_file, ns=(0, os.stat(mat_file).st_mtime_ns + 10 ** 9))
+    assert np.allclose(load_fields(mat_file, ['AnalysedData.TR'])['AnalysedData.TR'], 1.5)
+    assert len(reads) == 3
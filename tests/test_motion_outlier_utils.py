@@ -0,0 +1,103 @@
+## Check motion_outlier_utils.py against the arithmetic of fsl_motion_outliers_example_func.sh
+
+import os
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from motion_outlier_utils import outlier_threshold, find_outliers, dvars, framewise_displacement, refrms, robust_mask
+
+
+# The box-plot cutoff is P75 + 1.5 * IQR
+def test_outlier_threshold():
+
+    metric = np.arange(1, 9, dtype=float)
+    p25, p75 = 2.75, 6.25
+    assert np.isclose(outlier_threshold(metric), p75 + 1.5 * (p75 - p25))
+
+
+# The zero for the first TR isn't used to set the default threshold (the shell script computes the percentiles over
+# the differenced metric, which has one fewer value)
+def test_find_outliers_ignores_first_TR():
+
+    metric_values = np.array([0, 1, 2, 3, 4, 5, 6, 7, 13.2, 30])
+    outliers, threshold = find_outliers(metric_values)
+
+    assert np.isclose(threshold, outlier_threshold(metric_values[1:]))
+    assert not np.isclose(threshold, outlier_threshold(metric_values))
+    assert list(np.flatnonzero(outliers)) == [8, 9]
+
+
+# Values at the threshold are outliers (fslmaths -thr keeps them) but the zero for the first TR never is
+def test_find_outliers_absolute_threshold():
+
+    outliers, threshold = find_outliers([0, 2, 3, 1], threshold=2)
+
+    assert threshold == 2
+    assert list(outliers) == [False, True, True, False]
+    assert not find_outliers([0, 0, 0], threshold=0)[0].any()
+
+
+# DVARS is the RMS of the difference between consecutive TRs within the mask, as per mille of the brain median
+def test_dvars_hand_count():
+
+    func_data = np.zeros((2, 1, 1, 3))
+    func_data[0, 0, 0] = [10, 12, 12]
+    func_data[1, 0, 0] = [20, 20, 26]
+    mask = np.ones((2, 1, 1), dtype=bool)
+
+    median = np.median([10, 12, 12, 20, 20, 26])
+    expected = [np.sqrt((2 ** 2 + 0 ** 2) / 2), np.sqrt((0 ** 2 + 6 ** 2) / 2)]
+    assert np.allclose(dvars(func_data, mask), np.array(expected) / median * 1000)
+
+
+# refrms is the absolute change in the RMS difference to the reference between TRs
+def test_refrms_hand_count():
+
+    func_data = np.array([10.0, 11, 13]).reshape(1, 1, 1, 3)
+    reference = np.full((1, 1, 1), 10.0)
+    mask = np.ones((1, 1, 1), dtype=bool)
+
+    rms = np.abs(np.array([0, 1, 3]) / 11)
+    assert np.allclose(refrms(func_data, mask, reference), np.abs(np.diff(rms)))
+    assert np.allclose(refrms(func_data, mask, reference, rms=False), np.abs(np.diff(rms ** 2)))
+
+
+# Rotations (radians) are converted to displacement on a 50mm sphere and added to the translations
+def test_framewise_displacement():
+
+    motion_parameters = np.array([[0, 0, 0, 0, 0, 0],
+                                  [0.01, 0, -0.02, 1, 0, -0.5]])
+
+    assert np.allclose(framewise_displacement(motion_parameters), [(0.01 + 0.02) * 50 + 1 + 0.5])
+
+
+# Like fslmaths -thr -bin the mask keeps voxels whose mean is at the threshold but not zeros
+def test_robust_mask_threshold():
+
+    func_data = np.zeros((12, 1, 1, 1))
+    func_data[1:, 0, 0, 0] = np.arange(1, 12)
+    thr2, thr98 = np.percentile(np.arange(1, 12), [2, 98])
+    func_data[5, 0, 0, 0] = thr2 + 0.1 * (thr98 - thr2)
+
+    mask = robust_mask(func_data)[:, 0, 0]
+    assert mask[5]
+    assert not mask[0]
+    assert list(mask) == list(func_data[:, 0, 0, 0] >= func_data[5, 0, 0, 0])
+
+
+# The threshold the pipeline used (fslmotion_<N> is --fd --thresh=N) is used unless another is given, and the box-plot
+# cutoff is only used for metrics without one
+def test_summarise_motion_outliers_threshold(tmp_path, monkeypatch):
+
+    from participant_summary_utils import summarise_motion_outliers
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('analysis/firstlevel/Confounds/')
+    metric_values = np.array([0, 0.1, 0.2, 0.1, 0.2, 0.1, 3, 0.2, 2.5, 0.1])
+    for metric_name in ['fslmotion_3', 'fslmotion_0.5', 'refrms']:
+        np.savetxt('analysis/firstlevel/Confounds/MotionMetric_%s_functional01.txt' % metric_name, metric_values)
+
+    assert list(np.flatnonzero(summarise_motion_outliers('01'))) == [6]
+    assert list(np.flatnonzero(summarise_motion_outliers('01', metric_name='fslmotion_0.5'))) == [6, 8]
+    assert list(np.flatnonzero(summarise_motion_outliers('01', threshold=2, metric_name='fslmotion_3'))) == [6, 8]
+    assert list(np.flatnonzero(summarise_motion_outliers('01', metric_name='refrms'))) == list(np.flatnonzero(find_outliers(metric_values)[0]))
@@ -0,0 +1,65 @@
+## Check that nifti_utils.py reads the same time courses as loading the whole volume
+
+import os
+import numpy as np
+import nibabel
+import pytest
+import nifti_utils
+from nifti_utils import extract_timecourses, voxel_coordinates
+
+VOXELS = [(0, 0, 0), (3, 1, 2), (5, 4, 3), (3, 1, 2)]
+
+
+# Save a run as scaled integers (like the scanner does) so that the slope and intercept have to be applied
+def make_run(tmp_path, file_name):
+
+    data = np.random.default_rng(0).standard_normal((6, 5, 4, 11)) * 100 + 1000
+    nii = nibabel.Nifti1Image(data.astype(np.float32), np.eye(4))
+    nii.set_data_dtype(np.int16)
+    nii.header.set_slope_inter(0.5, 10)
+    nifti_file = str(tmp_path / file_name)
+    nibabel.save(nii, nifti_file)
+
+    return nifti_file, nibabel.load(nifti_file).get_fdata()
+
+
+@pytest.mark.parametrize('file_name', ['run.nii', 'run.nii.gz'])
+def test_extract_timecourses_matches_get_fdata(tmp_path, monkeypatch, file_name):
+
+    nifti_file, data = make_run(tmp_path, file_name)
+    expected = np.array([data[voxel] for voxel in VOXELS])
+
+    # Use small chunks so the streamed read crosses chunk boundaries
+    monkeypatch.setattr(nifti_utils, 'CHUNK_TRS', 4)
+    assert np.allclose(extract_timecourses(nifti_file, VOXELS), expected)
+    assert np.allclose(extract_timecourses(nifti_file, VOXELS, sidecar_dir=str(tmp_path / 'sidecar')), expected)
+
+    mask = np.zeros(data.shape[:3], dtype=bool)
+    mask[2:4, 1, :] = True
+    assert np.allclose(extract_timecourses(nifti_file, mask=mask), data[mask])
+
+
+# The sidecar is only remade if the original is newer
+def test_sidecar_reused(tmp_path):
+
+    nifti_file, _ = make_run(tmp_path, 'run.nii.gz')
+    sidecar_file = nifti_utils.uncompressed_sidecar(nifti_file, str(tmp_path / 'sidecar'))
+    os.utime(sidecar_file, (0, os.path.getmtime(nifti_file) + 10))
+    sidecar_mtime = os.path.getmtime(sidecar_file)
+
+    assert nifti_utils.uncompressed_sidecar(nifti_file, str(tmp_path / 'sidecar')) == sidecar_file
+    assert os.path.getmtime(sidecar_file) == sidecar_mtime
+
+    os.utime(nifti_file, (0, sidecar_mtime + 10))
+    nifti_utils.uncompressed_sidecar(nifti_file, str(tmp_path / 'sidecar'))
+    assert os.path.getmtime(sidecar_file) != sidecar_mtime
+
+
+def test_voxel_coordinates_errors():
+
+    with pytest.raises(IndexError):
+        voxel_coordinates((6, 5, 4, 11), [(6, 0, 0)])
+    with pytest.raises(ValueError):
+        voxel_coordinates((6, 5, 4, 11), mask=np.ones((6, 5, 3)))
+    with pytest.raises(ValueError):
+        voxel_coordinates((6, 5, 4, 11))
@@ -0,0 +1,69 @@
+## Check that overlay_utils.py shows the same slices as overlaying the whole volumes
+
+import numpy as np
+import nibabel
+import pytest
+from overlay_utils import lightbox, slice_indices, extract_planes, normalise_planes, blend_planes
+
+SHAPE = (10, 12, 8)
+
+
+# Save a random bottom volume and a top volume (4D, like a functional, if volumes is given)
+def make_volumes(tmp_path, volumes=None):
+
+    rng = np.random.default_rng(0)
+    bottom = rng.random(SHAPE).astype(np.float32) * 1000
+    top = rng.random(SHAPE + ((volumes,) if volumes else ())).astype(np.float32) * 50
+    bottom_file = str(tmp_path / 'highres.nii.gz')
+    top_file = str(tmp_path / 'example_func2highres.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(bottom, np.eye(4)), bottom_file)
+    nibabel.save(nibabel.Nifti1Image(top, np.eye(4)), top_file)
+
+    return bottom_file, top_file, bottom, top if volumes is None else top[..., 0]
+
+
+# Each tile is the blend of a plane of the whole volumes, scaled by all of the planes that are shown
+@pytest.mark.parametrize('volumes', [None, 3])
+@pytest.mark.parametrize('slice_num', [1, 3])
+def test_lightbox(tmp_path, slice_num, volumes):
+
+    bottom_file, top_file, bottom, top = make_volumes(tmp_path, volumes)
+    image = lightbox(bottom_file, top_file, slice_num)
+
+    # With one slice the three axes are side by side, otherwise each axis is a row of slice_num tiles. Every tile is
+    # padded to the largest rotated plane (12 x 12)
+    tile_size = max(SHAPE[:2])
+    assert image.dtype == np.uint8
+    row_num, col_num = (1, 3) if slice_num == 1 else (3, slice_num)
+    assert image.shape == (row_num * tile_size, col_num * tile_size, 4)
+
+    planes = []
+    for axis in range(3):
+        indices = slice_indices(SHAPE[axis], slice_num)
+        assert len(indices) == slice_num
+        planes += [(np.take(bottom, index, axis), np.take(top, index, axis)) for index in indices]
+    assert len(planes) == row_num * col_num
+    bottom_min = min(plane.min() for plane, _ in planes)
+    bottom_max = max(plane.max() for plane, _ in planes)
+    top_max = max(plane.max() for _, plane in planes)
+
+    for plane_counter, (bottom_plane, top_plane) in enumerate(planes):
+        expected = np.rot90(blend_planes(normalise_planes(bottom_plane, bottom_min, bottom_max), normalise_planes(top_plane, 0, top_max)))
+        row, col = divmod(plane_counter, col_num)
+        top_edge = row * tile_size + (tile_size - expected.shape[0]) // 2
+        left_edge = col * tile_size + (tile_size - expected.shape[1]) // 2
+        tile = image[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+
+        assert np.array_equal(image[top_edge:top_edge + expected.shape[0], left_edge:left_edge + expected.shape[1]], expected)
+        assert tile[..., 3].sum() == 255 * expected.shape[0] * expected.shape[1]
+
+
+# Only evenly spaced planes can be read as one slab
+def test_extract_planes(tmp_path):
+
+    bottom_file, _, bottom, _ = make_volumes(tmp_path)
+
+    assert np.allclose(extract_planes(bottom_file, 1, [2, 5, 8]), np.moveaxis(bottom[:, [2, 5, 8]], 1, 0))
+    assert np.allclose(extract_planes(bottom_file, 2, [4]), bottom[np.newaxis, :, :, 4])
+    with pytest.raises(ValueError):
+        extract_planes(bottom_file, 0, [1, 2, 4])
@@ -0,0 +1,70 @@
+## Check that find_sessions selects the same sessions as Participant_Index.m
+
+import contextlib
+from participant_catalogue import connect, find_sessions
+
+
+# Fill a catalogue by hand: s1 is good, s2 has a bad run of another experiment, s3 has a run without QA, s4 has no age,
+# s5 has a bad pseudorun and experiment names that share a prefix
+def make_catalogue(tmp_path):
+
+    catalogue_file = str(tmp_path / 'catalogue.sqlite')
+    sessions = [('s1', 10), ('s2', 12), ('s3', 14), ('s4', None), ('s5', 16)]
+    experiments = [('s1', 'Exp'), ('s1', 'E_p'), ('s2', 'Exp'), ('s2', 'Other'), ('s3', 'Exp'), ('s4', 'Exp'), ('s5', 'Exp'), ('s5', 'ExpLong')]
+    runs = [('s1', '01', 100, 80), ('s2', '01', 100, 80), ('s2', '02', 10, 10), ('s3', '01', 100, 80), ('s3', '02', None, None),
+            ('s4', '01', 100, 80), ('s5', '01', 100, 80), ('s5', '01_1', None, None)]
+    blocks = [('s1', '01', 'Exp-1', 2, 0), ('s2', '01', 'Exp-1', 3, 0), ('s2', '02', 'Other-1', 1, 0), ('s3', '01', 'Exp-1', 2, 0),
+              ('s3', '02', 'Exp-1', 1, 1), ('s4', '01', 'Exp-1', 2, 0), ('s5', '01', 'ExpLong-1', 4, 0)]
+
+    with contextlib.closing(connect(catalogue_file)) as connection, connection:
+        connection.executemany('INSERT INTO sessions VALUES (?, ?, NULL, NULL, NULL)', sessions)
+        connection.executemany('INSERT INTO experiments VALUES (?, ?)', experiments)
+        for session, func_run, snr, sfnr in runs:
+            nifti_dir = 'data/nifti/' if func_run.find('_') == -1 else 'analysis/firstlevel/pseudorun/'
+            nifti_file = 'subjects/%s/%s%s_functional%s.nii.gz' % (session, nifti_dir, session, func_run)
+            connection.execute('INSERT INTO runs VALUES (?, ?, ?, 100, NULL, ?, ?, 0, 0)', (session, func_run, nifti_file, snr, sfnr))
+        connection.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?, ?)', blocks)
+
+    return catalogue_file
+
+
+def found(catalogue_file, **kwargs):
+
+    return list(find_sessions(catalogue_file=catalogue_file, **kwargs)['session'])
+
+
+# Sessions without an age are never included
+def test_age_required(tmp_path):
+
+    catalogue_file = make_catalogue(tmp_path)
+
+    assert found(catalogue_file) == ['s1', 's2', 's3', 's5']
+    assert found(catalogue_file, max_age=12) == ['s1', 's2']
+
+
+# Runs without QA count as 0 and pseudoruns aren't checked
+def test_missing_qa_fails(tmp_path):
+
+    catalogue_file = make_catalogue(tmp_path)
+
+    assert found(catalogue_file, min_snr=50) == ['s1', 's5']
+    assert found(catalogue_file, max_sfnr=100) == ['s1', 's2', 's3', 's5']
+
+
+# Only the runs of the experiments are checked, if the session has any
+def test_qa_of_experiment_runs(tmp_path):
+
+    catalogue_file = make_catalogue(tmp_path)
+
+    assert found(catalogue_file, experiments=['Exp'], min_snr=50) == ['s1', 's2', 's5']
+    assert found(catalogue_file, experiments=['Other'], min_snr=50) == []
+
+
+# Block names are matched on the experiment name as a prefix, without treating % or _ as wildcards
+def test_included_blocks(tmp_path):
+
+    catalogue_file = make_catalogue(tmp_path)
+
+    assert found(catalogue_file, experiments=['Exp'], min_included_blocks=3) == ['s2', 's3', 's5']
+    assert found(catalogue_file, experiments=['E_p'], min_included_blocks=1) == []
+    assert found(catalogue_file, experiments=['ExpLong'], min_included_blocks=5) == []
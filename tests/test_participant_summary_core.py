@@ -0,0 +1,112 @@
+## Check that the describe_* functions only read the participant's directory, that the core imports quickly and that
+# summarising runs in parallel gives the same result
+
+import os
+import sys
+import subprocess
+import numpy as np
+import nibabel
+import pytest
+from participant_summary_core import describe_firstlevel, summarise_participant, SectionError
+
+
+# Make a feat folder with slice time corrected data but without the SFNR maps
+def make_feat(subject_dir):
+
+    feat_folder = os.path.join(subject_dir, 'analysis/firstlevel/functional01.feat/')
+    os.makedirs(feat_folder)
+    func_data = 1000 + np.random.default_rng(0).standard_normal((4, 4, 3, 20))
+    nibabel.save(nibabel.Nifti1Image(func_data.astype(np.float32), np.eye(4)), feat_folder + 'prefiltered_func_data_st.nii.gz')
+
+    return feat_folder
+
+
+# Missing SFNR maps are reported, not made, unless make_sfnr is True
+def test_describe_firstlevel_doesnt_make_sfnr(tmp_path, monkeypatch):
+
+    feat_folder = make_feat(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    summary = describe_firstlevel('01', use_cache=False, images=False)
+    assert summary['sfnr'] is None
+    assert sorted(os.listdir(feat_folder)) == ['prefiltered_func_data_st.nii.gz']
+
+    summary = describe_firstlevel('01', use_cache=False, images=False, make_sfnr=True)
+    assert summary['sfnr'] is not None
+    assert os.path.isfile(feat_folder + 'sfnr_mask_prefiltered_func_data_st.nii.gz')
+
+
+# Importing the core doesn't load the plotting and image libraries, or the parts of scipy that read MAT files (nibabel
+# imports the top level of scipy itself)
+def test_core_imports():
+
+    script_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'prototype', 'link', 'scripts')
+    code = ('import sys; import participant_summary_core; '
+            'print(" ".join(sorted(set(name.split(".")[0] for name in sys.modules if name.startswith(("matplotlib", "PIL", "nilearn", "scipy.io", "h5py"))))))')
+    loaded = subprocess.run([sys.executable, '-c', code], cwd=script_dir, capture_output=True, text=True, check=True).stdout.split()
+
+    assert loaded == []
+
+
+# Import the way the notebook does (from the scripts folder, then move into the subject) and check that the image
+# helpers can still be found once the scripts folder is no longer the current directory
+def test_notebook_imports(tmp_path):
+
+    root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    sys.path.insert(0, os.path.join(root_dir, 'scripts'))
+    from benchmark_summary import make_subject
+    subject_dir = str(tmp_path / 'sub-01')
+    make_subject(subject_dir, TR_num=20, matrix=(16, 16, 9), run_num=1, coder_num=2)
+
+    code = ('import os; from participant_summary_utils import *; os.chdir(%r); '
+            'run = describe_run("01", use_cache=False); firstlevel = describe_firstlevel("01", voxels=[(8, 8, 4)], use_cache=False); '
+            'print(os.path.isfile(run["excluded_TR_mosaic"]), os.path.isfile(firstlevel["ev_png"]), firstlevel["registration"].ndim)') % subject_dir
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONPATH'}
+    result = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(root_dir, 'prototype', 'link', 'scripts'), env=env, capture_output=True, text=True)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split() == ['True', 'True', '3']
+
+
+# Check that two summaries are the same, comparing arrays by value
+def assert_same_summary(summary, expected):
+
+    if isinstance(expected, dict):
+        assert sorted(summary) == sorted(expected)
+        for key in expected:
+            assert_same_summary(summary[key], expected[key])
+    elif isinstance(expected, (list, tuple)):
+        assert type(summary) == type(expected) and len(summary) == len(expected)
+        for item, expected_item in zip(summary, expected):
+            assert_same_summary(item, expected_item)
+    elif isinstance(expected, np.ndarray):
+        assert summary.dtype == expected.dtype
+        assert np.array_equal(summary, expected, equal_nan=expected.dtype.kind == 'f')
+    else:
+        assert summary == expected
+
+
+# Running the runs in separate processes gives the same summaries, in the same order, as running them one at a time
+def test_summarise_participant_workers(tmp_path, monkeypatch):
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+    from benchmark_summary import make_subject
+    make_subject(str(tmp_path / 'sub-01'), TR_num=20, matrix=(16, 16, 9), run_num=3, coder_num=2)
+    monkeypatch.chdir(tmp_path / 'sub-01')
+
+    runs = ['03', '01', '02']
+    serial = summarise_participant(runs, workers=1, voxels=[(8, 8, 4)], use_cache=False)
+    parallel = summarise_participant(runs, workers=3, voxels=[(8, 8, 4)], use_cache=False)
+
+    assert [result['func_run'] for result in parallel] == runs
+    assert_same_summary(parallel, serial)
+
+    # A section that fails (the default voxel is outside of this volume) only replaces that section when errors are
+    # caught, and is raised otherwise
+    for workers in [1, 3]:
+        results = summarise_participant(runs, workers=workers, use_cache=False, catch_errors=True)
+        assert all(isinstance(result['firstlevel'], SectionError) and result['firstlevel'].message.startswith('IndexError: ') for result in results)
+        assert_same_summary([result['descriptives'] for result in results], [result['descriptives'] for result in serial])
+
+        with pytest.raises(IndexError):
+            summarise_participant(runs, workers=workers, use_cache=False)
@@ -0,0 +1,99 @@
+## Check that profiling_utils.py combines the records of each stage and records nested stages
+
+import json
+import numpy as np
+import pytest
+from profiling_utils import load_profile, aggregate_profile, profiled, profile_stage, enable_profiling, disable_profiling, print_profile
+
+MEASURES = ['wall_time', 'cpu_time', 'bytes_read', 'peak_memory', 'files_opened', 'globs']
+
+
+# A record with the same measure for everything, except those given
+def make_record(stage, subject, parents=(), value=1.0, **measures):
+
+    record = {'stage': stage, 'parents': list(parents), 'labels': {}, 'subject': subject}
+    record.update({measure: value for measure in MEASURES})
+    record.update(measures)
+
+    return record
+
+
+# Write the records as a profile file, with a blank line like a file that was being appended to
+def save_profile(records, file_name):
+
+    with open(file_name, 'w') as fid:
+        for record in records:
+            fid.write(json.dumps(record) + '\n')
+        fid.write('\n')
+
+
+def test_aggregate_profile(tmp_path):
+
+    records = [make_record('describe_run', 'sub-01', value=1),
+               make_record('describe_run', 'sub-01', value=3),
+               make_record('describe_run', 'sub-02', value=8, bytes_read=None),
+               # A cache miss computing itself is only counted once
+               make_record('describe_run', 'sub-02', parents=['summarise_participant', 'describe_run'], value=100),
+               make_record('summarise_participant', 'sub-02', value=20, bytes_read=None),
+               ]
+    save_profile(records[:2], str(tmp_path / 'sub-01.jsonl'))
+    save_profile(records[2:], str(tmp_path / 'sub-02.jsonl'))
+
+    loaded = load_profile([str(tmp_path / 'sub-01.jsonl'), str(tmp_path / 'sub-02.jsonl')])
+    assert loaded == records
+    assert load_profile(str(tmp_path / 'sub-01.jsonl')) == records[:2]
+
+    summary = aggregate_profile(loaded)
+    assert sorted(summary) == ['describe_run', 'summarise_participant']
+
+    describe_run = summary['describe_run']
+    assert describe_run['calls'] == 3 and describe_run['subjects'] == 2
+    assert describe_run['wall_time_total'] == 12 and describe_run['wall_time_median'] == 3 and describe_run['wall_time_max'] == 8
+
+    # Missing measures are left out, and a measure that is always missing is NaN
+    assert describe_run['bytes_read_total'] == 4 and describe_run['bytes_read_max'] == 3
+    assert np.isnan(summary['summarise_participant']['bytes_read_total'])
+    assert summary['summarise_participant']['calls'] == 1
+
+    print_profile(summary)
+
+
+# Nested stages list the stages they were called from and nothing is written when profiling is off
+def test_profiled_records(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    profile_file = str(tmp_path / 'profile.jsonl')
+
+    @profiled
+    def describe_run(func_run, use_cache=True):
+        return np.ones(1000).sum()
+
+    @profiled
+    def summarise_participant():
+        with profile_stage('plotting', section='runs'):
+            return [describe_run(func_run, use_cache=False) for func_run in ['01', '02']]
+
+    assert summarise_participant() == [1000, 1000]
+    assert not (tmp_path / 'profile.jsonl').exists()
+
+    enable_profiling(profile_file)
+    try:
+        with pytest.raises(ZeroDivisionError):
+            with profile_stage('failing'):
+                1 / 0
+        assert summarise_participant() == [1000, 1000]
+    finally:
+        disable_profiling()
+
+    records = load_profile(profile_file)
+    assert [record['stage'] for record in records] == ['failing', 'describe_run', 'describe_run', 'plotting', 'summarise_participant']
+    assert records[0]['error'] == 'ZeroDivisionError'
+    assert records[1]['parents'] == ['summarise_participant', 'plotting']
+    assert records[1]['labels'] == {'func_run': '01', 'use_cache': False}
+    assert records[3]['labels'] == {'section': 'runs'}
+    assert all(record['subject'] == tmp_path.name and record['wall_time'] >= 0 for record in records)
+    assert records[4]['wall_time'] >= records[1]['wall_time'] + records[2]['wall_time']
+
+    # Turning profiling off stops the records
+    summarise_participant()
+    assert len(load_profile(profile_file)) == len(records)
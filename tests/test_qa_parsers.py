@@ -0,0 +1,80 @@
+## Check that qa_parsers.py reads the metrics of the BXH QA files
+
+import numpy as np
+import pandas as pd
+from qa_parsers import parse_qa_xml, parse_qa_lines, first_metric
+
+# A QA file in the style of the XCEDE events: each event has an onset and duration, the summary metrics appear once and
+# the per volume metrics appear once per event
+QA_TEXT = '''<?xml version="1.0"?>
+<events xmlns="http://www.xcede.org/xcede-2">
+ <event type="summary">
+  <onset>0</onset>
+  <duration>0</duration>
+  <value name="mean_snr_middle_slice">120.5</value>
+  <value name="mean_sfnr_middle_slice">80.25</value>
+  <value name="units">percent</value>
+ </event>
+ <event type="volume">
+  <onset>0</onset>
+  <duration>2</duration>
+  <value name="volmean">1000</value>
+ </event>
+ <event type="volume">
+  <onset>2</onset>
+  <duration>2</duration>
+  <value name="volmean">1010</value>
+ </event>
+ <event type="volume">
+  <onset>4</onset>
+  <duration>2</duration>
+  <value name="volmean">990</value>
+ </event>
+</events>
+'''
+
+
+def write_qa(tmp_path, text=QA_TEXT):
+
+    file_name = str(tmp_path / 'qa_events_s1_functional01.bxh.xml')
+    with open(file_name, 'w') as fid:
+        fid.write(text)
+
+    return file_name
+
+
+# Metrics that appear once are scalars, repeated metrics are arrays and the onsets and durations are skipped
+def test_parse_qa_xml(tmp_path):
+
+    record = parse_qa_xml(write_qa(tmp_path))
+
+    assert record.func_run == '01'
+    assert list(record.metrics) == ['mean_snr_middle_slice', 'mean_sfnr_middle_slice', 'units', 'volmean']
+    assert record.metrics['mean_snr_middle_slice'] == 120.5
+    assert record.metrics['units'] == 'percent'
+    assert np.array_equal(record.metrics['volmean'], [1000, 1010, 990])
+    assert first_metric(record.metrics, 'volmean') == 1000
+    assert first_metric(record.metrics, 'missing') is None
+
+
+# Files that aren't valid XML are read line by line, giving the same metrics
+def test_parse_qa_lines(tmp_path):
+
+    file_name = write_qa(tmp_path, QA_TEXT.replace('</events>', ''))
+    record = parse_qa_xml(file_name)
+
+    assert record.metrics['mean_sfnr_middle_slice'] == 80.25
+    assert np.array_equal(record.metrics['volmean'], [1000, 1010, 990])
+    assert 'onset' not in parse_qa_lines(file_name)
+
+
+# The batch table has a scalar in every cell
+def test_qa_columns(tmp_path):
+
+    from batch_qa_summary import qa_columns
+
+    columns = qa_columns(parse_qa_xml(write_qa(tmp_path)).metrics)
+
+    assert columns == {'qa_mean_snr_middle_slice': 120.5, 'qa_mean_sfnr_middle_slice': 80.25, 'qa_units': 'percent',
+                       'qa_volmean_mean': 1000, 'qa_volmean_max': 1010}
+    assert len(pd.DataFrame([columns])) == 1
@@ -0,0 +1,151 @@
+## Check reliability_utils.py against a direct port of the loops in EyeTracking_Reliability.m
+
+import warnings
+import itertools
+import numpy as np
+from reliability_utils import trial_agreement, subset_reliability, all_subsets, passes_threshold, match_coders, RELIABILITY_THRESHOLD
+
+CONDITIONS = np.array([1, 1, 2, 1, 2])
+EXPERIMENTS = ['ExpA', 'ExpB']
+
+
+# Assign to a 2D array, growing it with zeros like matlab does
+def grow_assign(array, row, column, value):
+
+    if row >= array.shape[0] or column >= array.shape[1]:
+        grown = np.zeros((max(array.shape[0], row + 1), max(array.shape[1], column + 1)))
+        grown[:array.shape[0], :array.shape[1]] = array
+        array = grown
+    array[row, column] = value
+
+    return array
+
+
+# The mean of an array, NaN if it is empty (like matlab)
+def matlab_mean(values):
+    return np.mean(values) if np.size(values) > 0 else np.nan
+
+
+# nanmean without the warning for all NaN slices
+def matlab_nanmean(values, axis=None):
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(values, axis)
+
+
+# The reliability loops of EyeTracking_Reliability.m (0 based). trials is a dictionary of lists of coder x frame arrays
+# and isIncluded_Coder says which coders are compared. Returns the Intraframe_all and Interframe_all of each experiment
+def matlab_reliability(trials, Coder_ConditionList, isIncluded_Coder):
+
+    Reliability = {}
+    for Condition in np.unique(Coder_ConditionList):
+        for Experiment in EXPERIMENTS:
+            Experiment_Reliability = Reliability.setdefault(Experiment, {'Intraframe': {}, 'Intraframe_Coder_Comparisons': {}, 'Interframe': {}, 'Interframe_Coder_Comparisons': {}})
+            for IdxCounter, TrialFixations in enumerate(trials[Experiment]):
+
+                potential_coders = np.flatnonzero(Coder_ConditionList == Condition)
+                Coder_Idx = potential_coders[isIncluded_Coder[potential_coders]]
+
+                # Intraframe reliability
+                for PairCounter, CoderPair in enumerate(itertools.combinations(Coder_Idx, 2)):
+                    both_coded = ~np.isnan(TrialFixations[CoderPair[0]]) & ~np.isnan(TrialFixations[CoderPair[1]])
+                    PairedResponses = TrialFixations[list(CoderPair)][:, both_coded]
+
+                    if np.sum(~np.all(np.isnan(TrialFixations[Coder_Idx]), 1)) >= 2:
+                        value = matlab_mean(np.diff(PairedResponses, axis=0) == 0)
+                    else:
+                        value = np.nan
+                    Experiment_Reliability['Intraframe'][Condition] = grow_assign(Experiment_Reliability['Intraframe'].get(Condition, np.zeros((0, 0))), IdxCounter, PairCounter, value)
+
+                    # Who are the coders being compared (the third dimension in matlab is a list here)
+                    comparisons = Experiment_Reliability['Intraframe_Coder_Comparisons'].get(Condition, [np.zeros((0, 0))] * 2)
+                    Experiment_Reliability['Intraframe_Coder_Comparisons'][Condition] = [grow_assign(comparisons[pair_counter], IdxCounter, PairCounter, CoderPair[pair_counter] + 1) for pair_counter in range(2)]
+
+                # Interframe reliability
+                ComparisonIdx = 0
+                for Coder in Coder_Idx:
+                    CurrentFixations = TrialFixations[Coder]
+                    AdjacentIdxs = np.flatnonzero(~np.isnan(CurrentFixations)) + 1
+                    if len(AdjacentIdxs) > 0:
+                        if AdjacentIdxs[-1] >= len(CurrentFixations):
+                            AdjacentIdxs = AdjacentIdxs[:-1]
+
+                        AdjacentFixations = TrialFixations[np.flatnonzero(isIncluded_Coder)][:, AdjacentIdxs]
+                        CurrentFixations = CurrentFixations[~np.isnan(CurrentFixations)]
+                        AdjacentCoders = np.flatnonzero(np.mean(np.isnan(AdjacentFixations), 1) < 1)
+                        AdjacentFixations = AdjacentFixations[AdjacentCoders]
+
+                        for AdjacentFixation in AdjacentFixations:
+                            idxs = np.flatnonzero(~np.isnan(AdjacentFixation))
+                            value = matlab_mean((CurrentFixations[idxs] - AdjacentFixation[idxs]) == 0)
+                            Experiment_Reliability['Interframe'][Condition] = grow_assign(Experiment_Reliability['Interframe'].get(Condition, np.zeros((0, 0))), IdxCounter, ComparisonIdx, value)
+                            Experiment_Reliability['Interframe_Coder_Comparisons'][Condition] = grow_assign(Experiment_Reliability['Interframe_Coder_Comparisons'].get(Condition, np.full((0, 0), np.nan)), IdxCounter, ComparisonIdx, Coder + 1)
+                            ComparisonIdx += 1
+
+    # Average each coder's comparisons within trial and then across trials
+    Intraframe_all = np.full((len(EXPERIMENTS), len(Coder_ConditionList)), np.nan)
+    Interframe_all = np.full((len(EXPERIMENTS), len(Coder_ConditionList)), np.nan)
+    for CoderCounter, Condition in enumerate(Coder_ConditionList):
+        for ExperimentCounter, Experiment in enumerate(EXPERIMENTS):
+            Experiment_Reliability = Reliability[Experiment]
+
+            if Condition in Experiment_Reliability['Intraframe_Coder_Comparisons']:
+                comparisons = Experiment_Reliability['Intraframe_Coder_Comparisons'][Condition]
+                IncludedComparisons = np.any((comparisons[0] == CoderCounter + 1) | (comparisons[1] == CoderCounter + 1), 0)
+                Intraframe_all[ExperimentCounter, CoderCounter] = matlab_nanmean(matlab_nanmean(Experiment_Reliability['Intraframe'][Condition][:, IncludedComparisons], 1))
+
+            if Condition in Experiment_Reliability['Interframe_Coder_Comparisons']:
+                IncludedComparisons = np.any(Experiment_Reliability['Interframe_Coder_Comparisons'][Condition] == CoderCounter + 1, 0)
+                Interframe_all[ExperimentCounter, CoderCounter] = matlab_nanmean(matlab_nanmean(Experiment_Reliability['Interframe'][Condition][:, IncludedComparisons], 1))
+
+    return Intraframe_all, Interframe_all
+
+
+# Random codes for each experiment, with some frames that weren't coded (including the first and last) but where every
+# coder codes some frames of every trial so that the matlab comparisons line up across trials
+def make_trials(seed=0, trial_num=4, frame_num=30):
+
+    rng = np.random.default_rng(seed)
+    trials = {}
+    for Experiment in EXPERIMENTS:
+        trials[Experiment] = []
+        for _ in range(trial_num):
+            truth = rng.integers(0, 4, frame_num)
+            codes = np.where(rng.random((len(CONDITIONS), frame_num)) < 0.8, truth, rng.integers(0, 4, (len(CONDITIONS), frame_num))).astype(float)
+            codes[rng.random(codes.shape) < 0.2] = np.nan
+            codes[0, 0] = np.nan
+            codes[1, -1] = np.nan
+            trials[Experiment].append(codes)
+
+    return trials
+
+
+# Every subset of at least two coders gives the same reliability for the coders in the subset as the matlab loops
+def test_subset_reliability_matches_matlab():
+
+    trials = make_trials()
+    agreement = {'coder_names': ['Coder_%d' % coder for coder in range(len(CONDITIONS))], 'conditions': CONDITIONS,
+                 'experiments': {experiment: trial_agreement(trials[experiment], len(CONDITIONS)) for experiment in EXPERIMENTS}}
+
+    subsets = all_subsets(len(CONDITIONS))
+    subsets = subsets[subsets.sum(1) >= 2]
+    reliability = subset_reliability(agreement, subsets)
+    assert reliability['experiments'] == EXPERIMENTS
+
+    for subset_counter, subset in enumerate(subsets):
+        Intraframe_all, Interframe_all = matlab_reliability(trials, CONDITIONS, subset)
+
+        assert np.allclose(reliability['intraframe'][subset_counter][:, subset], Intraframe_all[:, subset], atol=1e-6, equal_nan=True)
+        assert np.allclose(reliability['interframe'][subset_counter][:, subset], Interframe_all[:, subset], atol=1e-6, equal_nan=True)
+
+        with np.errstate(invalid='ignore'):
+            matlab_pass = ~((matlab_nanmean(Intraframe_all, 0) < RELIABILITY_THRESHOLD) | (matlab_nanmean(Interframe_all, 0) < RELIABILITY_THRESHOLD))
+        assert np.array_equal(passes_threshold(reliability['intraframe'][subset_counter], reliability['interframe'][subset_counter])[subset], matlab_pass[subset])
+
+
+# Coders are matched on the part of their name after Coder_
+def test_match_coders():
+
+    coder_names = ['JO_Coder_AB.mat', 'Coder_JO.mat', 'Coder_Pilot1.mat', 'CJ.mat']
+    assert list(match_coders(coder_names, ['JO', 'Pilot'])) == [False, True, True, False]
@@ -0,0 +1,73 @@
+## Check that render_report.py renders the rest of the report when a section fails
+
+import os
+import argparse
+import numpy as np
+import nibabel
+import pytest
+import participant_summary_core
+import render_report
+
+
+# A participant with a single small run and nothing else
+def make_subject(subject_dir):
+
+    os.makedirs(os.path.join(subject_dir, 'data/nifti/'))
+    func_data = 1000 + np.random.default_rng(0).standard_normal((16, 16, 9, 10))
+    nibabel.save(nibabel.Nifti1Image(func_data.astype(np.float32), np.eye(4)), os.path.join(subject_dir, 'data/nifti/s1_functional01.nii.gz'))
+
+
+# An error describing one section is shown in its place and the other sections are still rendered
+def test_failing_section(tmp_path, monkeypatch):
+
+    make_subject(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+    def describe_firstlevel(func_run, voxels=None, mask=None, sidecar_dir=None, use_cache=True, reg_slices=1):
+        raise IndexError('index 32 is out of bounds for axis 0 with size 16')
+    monkeypatch.setattr(participant_summary_core, 'describe_firstlevel', describe_firstlevel)
+
+    report_file = render_report.render_report(workers=1, use_cache=False)
+    with open(report_file) as fid:
+        report = fid.read()
+
+    assert 'Could not summarise this section: IndexError: index 32 is out of bounds' in report
+    assert 'Functional run 01 has 10 TRs' in report
+    assert '<h2>SFNR profiles</h2>\n<pre>No SFNR maps found' in report
+    assert '<h2>Secondlevel</h2>' in report
+
+
+# An error while plotting is shown with whatever was printed before it
+def test_failing_plot(tmp_path):
+
+    def plot_function(summary):
+        print('Plotting %s' % summary)
+        raise ValueError('bad summary')
+
+    section = render_report.render_section('Test', 'test', str(tmp_path), plot_function, 'summary')
+
+    assert section['text'] == 'Plotting summary\nCould not plot this section: ValueError: bad summary\n'
+    assert section['figures'] == []
+
+
+def test_voxel_coordinate():
+
+    assert render_report.voxel_coordinate('8,8,4') == (8, 8, 4)
+    with pytest.raises(argparse.ArgumentTypeError):
+        render_report.voxel_coordinate('8,8')
+
+
+# A participant with every file renders every section, including the SFNR profiles across runs
+def test_full_report(tmp_path, monkeypatch):
+
+    from benchmark_summary import make_subject
+    make_subject(str(tmp_path / 'sub-01'), TR_num=20, matrix=(16, 16, 9), run_num=2, coder_num=2)
+    monkeypatch.chdir(tmp_path / 'sub-01')
+
+    report_file = render_report.render_report(workers=1, use_cache=False, voxels=[(8, 8, 4)])
+    with open(report_file) as fid:
+        report = fid.read()
+
+    assert 'Could not' not in report
+    assert 'SFNR profiles saved in analysis/firstlevel/sfnr_profiles.npz' in report
+    assert 'alt="sfnr_profiles_00.png"' in report and 'alt="sfnr_profiles_01.png"' in report
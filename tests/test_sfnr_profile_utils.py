@@ -0,0 +1,125 @@
+## Check sfnr_profile_utils.py against the loop over slices in Analysis_SFNR_gradient.m and the stacking of profiles
+
+import os
+import numpy as np
+import nibabel
+from sfnr_profile_utils import slice_profile, stack_profiles, session_profiles, DISTRIBUTION_BINS
+from sfnr_profiles import subject_profiles, batch_profiles
+
+
+# The loop of Analysis_SFNR_gradient.m (using every voxel) along Y: mask out the map, then take the mean and standard
+# deviation of what is left in each slice. Slices with fewer than 2 voxels have a NaN standard deviation (matlab gives
+# 0 for a single voxel). The distribution of each slice is binned between 0 and the maximum one voxel at a time
+def loop_profile(sfnr_map, mask, bins=DISTRIBUTION_BINS):
+
+    sfnr_map = np.array(sfnr_map, dtype=np.float64)
+    sfnr_map[mask == 0] = np.nan
+    max_value = np.nanmax(sfnr_map) if np.any(np.isfinite(sfnr_map)) else 0
+
+    profile = {'mean': [], 'std': [], 'count': [], 'distribution': [], 'max_value': max_value}
+    for y_counter in range(sfnr_map.shape[1]):
+        sample = sfnr_map[:, y_counter, :]
+        sample = sample[~np.isnan(sample)]
+
+        distribution = np.zeros(bins)
+        for value in sample:
+            distribution[min(int(value / max_value * bins), bins - 1)] += 1
+
+        profile['mean'].append(np.mean(sample) if len(sample) > 0 else np.nan)
+        profile['std'].append(np.std(sample, ddof=1) if len(sample) > 1 else np.nan)
+        profile['count'].append(len(sample))
+        profile['distribution'].append(distribution / len(sample) if len(sample) > 0 else np.full(bins, np.nan))
+
+    return profile
+
+
+# A random map and mask with empty slices (including the last), a slice with one voxel and a NaN inside the mask
+def make_map(seed=0, shape=(6, 8, 5)):
+
+    rng = np.random.default_rng(seed)
+    sfnr_map = rng.random(shape) * 200
+    mask = (rng.random(shape) < 0.6).astype(np.float32)
+    mask[:, 1:3, :] = 0
+    mask[:, -1, :] = 0
+    mask[3, 1, 1] = 1
+    sfnr_map[0, 0, 0] = np.nan
+    mask[0, 0, 0] = 1
+
+    return sfnr_map, mask
+
+
+def test_slice_profile_matches_loop():
+
+    sfnr_map, mask = make_map()
+    profile = slice_profile(sfnr_map, mask)
+    expected = loop_profile(sfnr_map, mask)
+
+    assert list(profile['count']) == expected['count']
+    assert list(profile['count'][[1, 2, -1]]) == [1, 0, 0]
+    assert np.isclose(profile['max_value'], expected['max_value'])
+    for key in ['mean', 'std', 'distribution']:
+        assert np.allclose(profile[key], expected[key], equal_nan=True)
+    assert np.allclose(profile['distribution'][profile['count'] > 0].sum(1), 1)
+
+
+# Nothing in the mask gives NaN statistics rather than dividing by zero
+def test_slice_profile_empty_mask():
+
+    profile = slice_profile(np.ones((3, 4, 2)), np.zeros((3, 4, 2)))
+
+    assert profile['max_value'] == 0
+    assert list(profile['count']) == [0] * 4
+    assert np.all(np.isnan(profile['mean'])) and np.all(np.isnan(profile['distribution']))
+
+
+# Shorter profiles are padded with NaN, including the bins of the distribution
+def test_stack_profiles_pads():
+
+    profiles = [slice_profile(*make_map(0, (6, 8, 5))), slice_profile(*make_map(1, (6, 5, 5)))]
+
+    stacked = stack_profiles(profiles, 'mean')
+    assert stacked.shape == (2, 8)
+    assert np.allclose(stacked[1, :5], profiles[1]['mean'], equal_nan=True)
+    assert np.all(np.isnan(stacked[1, 5:]))
+
+    distribution = stack_profiles(profiles, 'distribution')
+    assert distribution.shape == (2, 8, DISTRIBUTION_BINS)
+    assert np.all(np.isnan(distribution[1, 5:]))
+
+    assert stack_profiles([], 'mean').shape == (0, 0)
+
+
+# Save the SFNR map and mask in a feat folder
+def make_feat(feat_folder, seed, shape):
+
+    sfnr_map, mask = make_map(seed, shape)
+    os.makedirs(feat_folder)
+    nibabel.save(nibabel.Nifti1Image(sfnr_map.astype(np.float32), np.eye(4)), os.path.join(feat_folder, 'sfnr_prefiltered_func_data_st.nii.gz'))
+    nibabel.save(nibabel.Nifti1Image(mask, np.eye(4)), os.path.join(feat_folder, 'sfnr_mask_prefiltered_func_data_st.nii.gz'))
+
+    return slice_profile(sfnr_map.astype(np.float32), mask)
+
+
+# The padding of a session is removed for each run (even if the last slice of a run is empty) and the runs of every
+# session are padded to the longest run
+def test_subject_profiles_unpads(tmp_path):
+
+    expected = {}
+    for subject, shapes in [('sub-01', [(6, 8, 5), (6, 6, 5)]), ('sub-02', [(6, 10, 5)])]:
+        for run_counter, shape in enumerate(shapes):
+            feat_folder = str(tmp_path / subject / 'analysis' / 'firstlevel' / ('functional%02d.feat' % (run_counter + 1)))
+            expected[subject, run_counter] = make_feat(feat_folder, run_counter, shape)
+
+    runs = subject_profiles(str(tmp_path / 'sub-01'), use_cache=False)
+    assert [run['run'] for run in runs] == ['analysis/firstlevel/functional01.feat', 'analysis/firstlevel/functional02.feat']
+    assert session_profiles(str(tmp_path / 'sub-01'), use_cache=False)['mean'].shape == (2, 8)
+    for run_counter, run in enumerate(runs):
+        for key in ['mean', 'std', 'count', 'distribution']:
+            assert run[key].shape == np.shape(expected['sub-01', run_counter][key])
+            assert np.allclose(run[key], expected['sub-01', run_counter][key], equal_nan=True)
+
+    profiles = batch_profiles([str(tmp_path / 'sub-01'), str(tmp_path / 'sub-02')], workers=1, use_cache=False)
+    assert list(profiles['session']) == ['sub-01', 'sub-01', 'sub-02']
+    assert profiles['count'].shape == (3, 10)
+    assert np.allclose(profiles['count'][1, :6], expected['sub-01', 1]['count'])
+    assert np.all(np.isnan(profiles['count'][1, 6:]))
@@ -0,0 +1,107 @@
+## Check sfnr_utils.py against a direct port of whole_brain_sfnr.m
+
+import os
+import numpy as np
+import nibabel
+from sfnr_utils import compute_sfnr, sfnr_threshold, confound_excluded_TRs, whole_brain_sfnr
+
+
+# What whole_brain_sfnr.m does: remove the excluded TRs, fit a second order polynomial to every voxel over the
+# remaining TRs (numbered 1:n) and divide the mean by the standard deviation of the residuals
+def matlab_sfnr(brain, excluded_TRs=None):
+
+    if excluded_TRs is not None:
+        brain = brain[..., ~excluded_TRs]
+
+    brain_mat = brain.reshape(-1, brain.shape[3])
+    trs = np.arange(1, brain_mat.shape[1] + 1)
+    detrended = np.zeros(brain_mat.shape)
+    for voxel_counter in range(brain_mat.shape[0]):
+        coefs = np.polyfit(trs, brain_mat[voxel_counter], 2)
+        detrended[voxel_counter] = np.polyval(coefs, trs) - brain_mat[voxel_counter]
+
+    mean_map = brain.mean(3)
+    sfnr_map = mean_map / detrended.reshape(brain.shape).std(3, ddof=1)
+    sfnr_map[mean_map < 100] = 0
+
+    return sfnr_map, mean_map / brain.std(3, ddof=1)
+
+
+# Make a small run with a quadratic drift, noise and some voxels with a low mean
+def make_run(tmp_path, TR_num=50):
+
+    rng = np.random.default_rng(0)
+    trs = np.arange(TR_num)
+    brain = 1000 + rng.standard_normal((4, 3, 2, TR_num)) * rng.uniform(1, 20, (4, 3, 2, 1))
+    brain += 0.05 * trs + 0.002 * trs ** 2
+    brain[0, 0, 0] = 50 + rng.standard_normal(TR_num)
+
+    func_file = str(tmp_path / 'prefiltered_func_data_st.nii.gz')
+    nibabel.save(nibabel.Nifti1Image(brain.astype(np.float32), np.eye(4)), func_file)
+
+    return func_file, np.asarray(nibabel.load(func_file).dataobj, dtype=np.float64)
+
+
+# The streamed fit matches a per voxel polyfit, whatever size the chunks are
+def test_compute_sfnr_matches_matlab(tmp_path):
+
+    func_file, brain = make_run(tmp_path)
+    sfnr_map, tsnr_map = matlab_sfnr(brain)
+
+    for chunk_TRs in [7, 32, 100]:
+        maps = compute_sfnr(func_file, chunk_TRs=chunk_TRs)
+        assert np.allclose(maps['sfnr'], sfnr_map, rtol=1e-6)
+        assert np.allclose(maps['tsnr'], tsnr_map, rtol=1e-6)
+        assert np.allclose(maps['mean'], brain.mean(3))
+    assert maps['sfnr'][0, 0, 0] == 0
+
+
+# Excluded TRs are removed before the trend is fit (so the trend is over the included TRs numbered consecutively)
+def test_compute_sfnr_excluded_TRs(tmp_path):
+
+    func_file, brain = make_run(tmp_path)
+    excluded_TRs = np.zeros(brain.shape[3], dtype=bool)
+    excluded_TRs[[0, 10, 11, 30]] = True
+
+    maps = compute_sfnr(func_file, excluded_TRs, chunk_TRs=8)
+    assert maps['included_num'] == brain.shape[3] - 4
+    assert np.allclose(maps['sfnr'], matlab_sfnr(brain, excluded_TRs)[0], rtol=1e-6)
+
+
+# Only confound columns with a single 1 are used, and only if there is a row for every TR
+def test_confound_excluded_TRs(tmp_path):
+
+    confounds = np.zeros((6, 3))
+    confounds[1, 0] = 1
+    confounds[4, 1] = 1
+    confounds[:, 2] = np.arange(6)
+    confound_file = str(tmp_path / 'MotionConfounds_functional01.txt')
+    np.savetxt(confound_file, confounds)
+
+    assert list(np.flatnonzero(confound_excluded_TRs(confound_file, 6))) == [1, 4]
+    assert confound_excluded_TRs(confound_file, 7) is None
+    assert confound_excluded_TRs(str(tmp_path / 'missing.txt'), 6) is None
+
+
+# The threshold is the first lowest bin between the two highest peaks of the histogram. With these values the bins
+# are 8 wide (centred on 14, 22, ... 86) and the counts are [1, 100, 0, 0, 0, 3, 0, 80, 0, 1], so it is the bin
+# centred on 30
+def test_sfnr_threshold():
+
+    values = np.concatenate(([10.0], np.full(100, 20.0), np.full(3, 50.0), np.full(80, 70.0), [90.0]))
+    threshold = sfnr_threshold(values, bin_num=10)
+
+    assert np.isclose(threshold, 30)
+    assert sfnr_threshold(np.full(20, 5.0), bin_num=10) == 0
+
+
+# The maps are saved with the names the rest of the pipeline expects
+def test_whole_brain_sfnr_saves_maps(tmp_path):
+
+    func_file, brain = make_run(tmp_path)
+    whole_brain_sfnr(func_file, str(tmp_path), str(tmp_path / 'missing.txt'))
+
+    for prefix in ['sfnr_', 'sfnr_mask_', 'tsnr_']:
+        assert os.path.isfile(str(tmp_path / (prefix + 'prefiltered_func_data_st.nii.gz')))
+    saved = np.asarray(nibabel.load(str(tmp_path / 'sfnr_prefiltered_func_data_st.nii.gz')).dataobj)
+    assert np.allclose(saved, matlab_sfnr(brain)[0], rtol=1e-5)
@@ -0,0 +1,73 @@
+## Check that summary_cache.py recomputes summaries when their sources change
+
+import os
+from summary_cache import cached_summary, cache_file, evict
+
+
+# A summary that counts how often it was computed
+def make_compute(sources, calls):
+
+    def compute():
+        calls.append(1)
+        return {'value': len(calls), 'sources': sources}
+
+    return compute
+
+
+def test_cached_until_sources_change(tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+    source_file = str(tmp_path / 'source.txt')
+    new_file = str(tmp_path / 'new.txt')
+    with open(source_file, 'w') as fid:
+        fid.write('a')
+
+    calls = []
+    compute = make_compute([source_file, new_file, str(tmp_path)], calls)
+
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 1
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 1
+
+    # A different key (e.g. a new version) is a different summary
+    assert cached_summary(('key', 2), compute, cache_dir)['value'] == 2
+
+    # Changing the size of a source
+    with open(source_file, 'a') as fid:
+        fid.write('b')
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 3
+
+    # Changing only the modification time of a source
+    os.utime(source_file, ns=(0, os.stat(source_file).st_mtime_ns + 10 ** 9))
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 4
+
+    # A source that didn't exist appearing
+    with open(new_file, 'w') as fid:
+        fid.write('c')
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 5
+    assert cached_summary(('key', 1), compute, cache_dir)['value'] == 5
+
+
+# A partially written cache file is recomputed rather than raising
+def test_corrupt_cache_file(tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+    calls = []
+    compute = make_compute([], calls)
+    cached_summary(('key',), compute, cache_dir)
+
+    with open(cache_file(('key',), cache_dir), 'wb') as fid:
+        fid.write(b'\x80')
+    assert cached_summary(('key',), compute, cache_dir)['value'] == 2
+
+
+# The least recently used summaries are deleted first
+def test_evict(tmp_path):
+
+    cache_dir = str(tmp_path / 'cache')
+    for key_counter in range(3):
+        cached_summary(('key', key_counter), make_compute([], []), cache_dir)
+        os.utime(cache_file(('key', key_counter), cache_dir), (0, key_counter * 100))
+    size = os.path.getsize(cache_file(('key', 0), cache_dir))
+
+    evict(cache_dir, max_bytes=2 * size)
+    assert [os.path.isfile(cache_file(('key', key_counter), cache_dir)) for key_counter in range(3)] == [False, True, True]
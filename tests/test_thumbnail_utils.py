@@ -0,0 +1,78 @@
+## Check that thumbnail_utils.py reuses mosaics until one of their images changes
+
+import os
+import numpy as np
+from PIL import Image
+import thumbnail_utils
+from thumbnail_utils import cached_mosaic, mosaic_file_name
+
+
+# Save some solid colour PNGs
+def make_images(folder, colours, size=(80, 60)):
+
+    image_files = []
+    for colour_counter, colour in enumerate(colours):
+        image_files.append(os.path.join(folder, 'Excluded_TRs_functional01_%d.png' % colour_counter))
+        Image.new('RGB', size, colour).save(image_files[-1])
+
+    return image_files
+
+
+def test_cached_mosaic(tmp_path, monkeypatch):
+
+    image_files = make_images(str(tmp_path), [(255, 0, 0), (0, 255, 0), (0, 0, 255)])
+
+    # Count how often the mosaic is made
+    made = []
+    make_mosaic = thumbnail_utils.make_mosaic
+    monkeypatch.setattr(thumbnail_utils, 'make_mosaic', lambda *args: made.append(1) or make_mosaic(*args))
+
+    assert cached_mosaic([], 'Excluded_TRs_functional01') is None
+
+    mosaic_file = cached_mosaic(image_files, 'Excluded_TRs_functional01', max_pixels=4 * 80 * 60)
+    assert mosaic_file == os.path.join(str(tmp_path), 'thumbnails', 'Excluded_TRs_functional01.png')
+    assert mosaic_file == mosaic_file_name(sorted(image_files), 'Excluded_TRs_functional01')
+
+    # The three images are tiled 2 x 2 at full size with the last tile left white
+    with Image.open(mosaic_file) as mosaic:
+        pixels = np.asarray(mosaic.convert('RGB'))
+    assert pixels.shape == (120, 160, 3)
+    assert list(pixels[30, 40]) == [255, 0, 0] and list(pixels[30, 120]) == [0, 255, 0] and list(pixels[90, 40]) == [0, 0, 255]
+    assert list(pixels[90, 120]) == [255, 255, 255]
+
+    # The order the images are listed in doesn't matter
+    assert cached_mosaic(image_files[::-1], 'Excluded_TRs_functional01', max_pixels=4 * 80 * 60) == mosaic_file
+    assert len(made) == 1
+
+    # Changing an image remakes the mosaic
+    Image.new('RGB', (80, 60), (255, 255, 0)).save(image_files[0])
+    os.utime(image_files[0], ns=(0, os.stat(image_files[0]).st_mtime_ns + 10 ** 9))
+    cached_mosaic(image_files, 'Excluded_TRs_functional01', max_pixels=4 * 80 * 60)
+    assert len(made) == 2
+    with Image.open(mosaic_file) as mosaic:
+        assert list(np.asarray(mosaic.convert('RGB'))[30, 40]) == [255, 255, 0]
+
+    # As does adding an image
+    image_files.append(os.path.join(str(tmp_path), 'Excluded_TRs_functional01_3.png'))
+    Image.new('RGB', (80, 60), (0, 0, 0)).save(image_files[-1])
+    cached_mosaic(image_files, 'Excluded_TRs_functional01', max_pixels=4 * 80 * 60)
+    assert len(made) == 3
+    cached_mosaic(image_files, 'Excluded_TRs_functional01', max_pixels=4 * 80 * 60)
+    assert len(made) == 3
+
+
+# Large images are shrunk so that the mosaic has no more than max_pixels pixels, and a broken mosaic is remade
+def test_mosaic_size(tmp_path):
+
+    image_files = make_images(str(tmp_path), [(255, 0, 0)] * 5, size=(640, 480))
+    mosaic_file = cached_mosaic(image_files, 'Behavioral', max_pixels=100000)
+
+    with Image.open(mosaic_file) as mosaic:
+        assert mosaic.size[0] * mosaic.size[1] <= 100000
+        assert mosaic.size[0] > mosaic.size[1]
+
+    with open(mosaic_file, 'wb') as fid:
+        fid.write(b'not a png')
+    assert cached_mosaic(image_files, 'Behavioral', max_pixels=100000) == mosaic_file
+    with Image.open(mosaic_file) as mosaic:
+        assert mosaic.size[0] * mosaic.size[1] <= 100000